@@ -0,0 +1,253 @@
+"""
+Benchmark PDFHandler operations on synthetic PDFs
+
+Generates text-only and image-heavy PDFs with ReportLab, runs each
+operation in a fresh process and records wall time, peak RSS and output
+size as JSON so runs can be compared.
+
+Usage:
+    python benchmarks/bench_pdf_handler.py
+    python benchmarks/bench_pdf_handler.py --pages 1,10,100 --kinds text
+    python benchmarks/bench_pdf_handler.py --kinds image --image-max-pages 1000
+    python benchmarks/bench_pdf_handler.py --compare benchmarks/results/old.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+from queue import Empty
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PyPDF2
+from PIL import Image
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from pdf_handler import PDFHandler
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# Image pages are ~200 KB, so by default image fixtures stop at 100 pages
+# (a 20 MB fixture, merged into 200 MB with 10 inputs)
+IMAGE_MAX_PAGES = 100
+# Seconds to wait for one measurement before giving up on it
+MEASURE_TIMEOUT = 3600
+
+
+def generate_pdf(path, pages, kind):
+    """
+    Generate a synthetic PDF
+
+    Args:
+        path: Output file path
+        pages: Number of pages
+        kind: 'text' for text-only pages, 'image' for one JPEG scan per page
+    """
+    c = canvas.Canvas(path, pagesize=A4)
+    width, height = A4
+    for page in range(pages):
+        if kind == 'image':
+            # Smoothed noise, different on every page, compresses like a scanned photo
+            image = Image.frombytes('RGB', (100, 138), os.urandom(100 * 138 * 3))
+            data = io.BytesIO()
+            image.resize((800, 1100), Image.BILINEAR).save(data, 'JPEG', quality=75)
+            data.seek(0)
+            c.drawImage(ImageReader(data), 0, 0, width, height)
+        else:
+            c.setFont("Helvetica", 10)
+            for line in range(60):
+                c.drawString(40, height - 40 - line * 12, f"Page {page + 1} line {line + 1} " * 4)
+        c.showPage()
+    c.save()
+
+
+def _peak_rss():
+    """Peak resident set size of this process in bytes"""
+    # On Linux ru_maxrss survives exec, so a spawned child would report its
+    # parent's peak; VmHWM starts afresh with the new program
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def _measure(queue, operation, args):
+    """Run one operation in this (child) process and report its cost"""
+    handler = PDFHandler()
+    start = time.perf_counter()
+    if operation == '_create_watermark':
+        # Build many overlays to get a stable per-call figure
+        for _ in range(args['calls']):
+            handler._create_watermark('CONFIDENTIAL', 'diagonal', 0.3, 595.0, 842.0)
+    else:
+        getattr(handler, operation)(*args['call_args'])
+    wall = time.perf_counter() - start
+
+    peak_rss = _peak_rss()
+
+    output_path = args.get('output_path')
+    queue.put({
+        'wall_s': round(wall, 4),
+        'peak_rss_mb': round(peak_rss / (1024 * 1024), 1),
+        'output_bytes': os.path.getsize(output_path) if output_path else None,
+    })
+
+
+def measure(operation, args, timeout=MEASURE_TIMEOUT):
+    """
+    Run an operation in a fresh process so peak RSS is not shared
+
+    Returns:
+        Result dictionary, with an 'error' instead of figures if the process
+        died (e.g. killed for running out of memory) or timed out
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(queue, operation, args))
+    process.start()
+    deadline = time.monotonic() + timeout
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            if process.exitcode is not None:
+                result = {'error': f"process exited with code {process.exitcode}"}
+            elif time.monotonic() > deadline:
+                process.kill()
+                result = {'error': f"timed out after {timeout} s"}
+    process.join()
+    return result
+
+
+def run(pages_list, kinds, input_counts, workdir, image_max_pages=IMAGE_MAX_PAGES):
+    """
+    Run all benchmarks
+
+    Args:
+        pages_list: Page counts of the fixtures
+        kinds: Fixture kinds
+        input_counts: Number of inputs of each merge
+        workdir: Directory for fixtures and outputs
+        image_max_pages: Largest image fixture; larger page counts are skipped
+
+    Returns:
+        List of result dictionaries
+    """
+    results = []
+    for kind in kinds:
+        for pages in pages_list:
+            if kind == 'image' and pages > image_max_pages:
+                print(f"Skipping {kind} {pages}p (over --image-max-pages {image_max_pages})")
+                continue
+            fixture = os.path.join(workdir, f"{kind}_{pages}.pdf")
+            generate_pdf(fixture, pages, kind)
+            input_bytes = os.path.getsize(fixture)
+            output_path = os.path.join(workdir, 'output.pdf')
+
+            for inputs in input_counts:
+                result = measure('merge_pdfs', {
+                    'call_args': ([fixture] * inputs, output_path),
+                    'output_path': output_path,
+                })
+                results.append(dict(
+                    result, operation='merge_pdfs', kind=kind, pages=pages,
+                    inputs=inputs, input_bytes=input_bytes * inputs
+                ))
+                print(f"merge_pdfs {kind} {pages}p x{inputs}: {result}")
+
+            result = measure('add_watermark', {
+                'call_args': (fixture, output_path, 'CONFIDENTIAL', 'diagonal', 0.3),
+                'output_path': output_path,
+            })
+            results.append(dict(
+                result, operation='add_watermark', kind=kind, pages=pages,
+                inputs=1, input_bytes=input_bytes
+            ))
+            print(f"add_watermark {kind} {pages}p: {result}")
+
+            os.remove(fixture)
+
+    calls = 100
+    result = measure('_create_watermark', {'calls': calls})
+    results.append(dict(result, operation='_create_watermark', calls=calls))
+    print(f"_create_watermark x{calls}: {result}")
+    return results
+
+
+def compare(results, baseline_path):
+    """Print the wall time and RSS change of each result against a previous run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    def key(r):
+        return (r['operation'], r.get('kind'), r.get('pages'), r.get('inputs'), r.get('calls'))
+
+    previous = {key(r): r for r in baseline}
+    for r in results:
+        old = previous.get(key(r))
+        if not old or 'error' in r or 'error' in old:
+            continue
+        time_change = (r['wall_s'] - old['wall_s']) / old['wall_s'] * 100 if old['wall_s'] else 0
+        rss_change = r['peak_rss_mb'] - old['peak_rss_mb']
+        print(f"{' '.join(str(k) for k in key(r) if k is not None)}: "
+              f"time {time_change:+.1f}%, peak RSS {rss_change:+.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDFHandler operations")
+    parser.add_argument('--pages', default='1,10,100,1000',
+                        help="Comma-separated page counts (default: 1,10,100,1000)")
+    parser.add_argument('--kinds', default='text,image',
+                        help="Comma-separated fixture kinds: text, image (default: both)")
+    parser.add_argument('--inputs', default='2,10',
+                        help="Comma-separated number of merge inputs (default: 2,10)")
+    parser.add_argument('--image-max-pages', type=int, default=IMAGE_MAX_PAGES,
+                        help=f"Largest image fixture in pages (default: {IMAGE_MAX_PAGES})")
+    parser.add_argument('--output', help="Result JSON path (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', help="Previous result JSON to compare against")
+    args = parser.parse_args()
+
+    pages_list = [int(p) for p in args.pages.split(',')]
+    kinds = args.kinds.split(',')
+    input_counts = [int(n) for n in args.inputs.split(',')]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(pages_list, kinds, input_counts, workdir, args.image_max_pages)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'pypdf2': PyPDF2.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import os
+import hashlib
+import logging
+import time
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Directory holding cached downloads
+BLOB_STORE_DIR = os.getenv('BLOB_STORE_DIR', 'temp/blobs')
+# Maximum size of the cache in bytes
+BLOB_STORE_MAX_BYTES = int(os.getenv('BLOB_STORE_MAX_MB', 500)) * 1024 * 1024
+
+# Prefix of session file references that point into a MemoryFileStore
+MEMORY_PREFIX = 'memory://'
+# Maximum size of all in-memory files in bytes (0 = no limit)
+MEMORY_STORE_MAX_BYTES = int(os.getenv('MEMORY_STORE_MB', 512)) * 1024 * 1024
+
+
+class MemoryStoreFull(Exception):
+    """Raised when a file would not fit in the memory budget"""
+
+
+class BlobStore:
+    """
+    Content-addressed cache for downloaded Telegram files
+
+    Blobs are stored once per SHA-256 digest and handed to sessions as hard
+    links. The link count of a blob is its reference count: a session deleting
+    its copy only drops one reference, and blobs nobody links to any more are
+    evicted in least-recently-used order once the store exceeds its size cap.
+    """
+
+    def __init__(self, root=BLOB_STORE_DIR, max_bytes=BLOB_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.aliases = {}  # file_unique_id -> sha256
+        self.blobs = OrderedDict()  # sha256 -> size, least recently used first
+        self.total_size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Register blobs left on disk by a previous run"""
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+
+        for _, sha256, size in sorted(entries):
+            self.blobs[sha256] = size
+            self.total_size += size
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.root, sha256)
+
+    def refcount(self, sha256):
+        """
+        Get the number of session files referencing a blob
+
+        Args:
+            sha256: Blob digest
+
+        Returns:
+            Number of hard links besides the blob itself
+        """
+        try:
+            return os.stat(self._blob_path(sha256)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def link(self, file_unique_id, dest_path):
+        """
+        Place a cached file at dest_path without downloading it
+
+        Args:
+            file_unique_id: Telegram file_unique_id of the document
+            dest_path: Path where the file should appear
+
+        Returns:
+            True on a cache hit, False if the file must be downloaded
+        """
+        with self._lock:
+            sha256 = self.aliases.get(file_unique_id)
+            if sha256 is None or sha256 not in self.blobs:
+                return False
+
+            blob_path = self._blob_path(sha256)
+            if not os.path.exists(blob_path):
+                self._forget(sha256)
+                return False
+
+            self._link_file(blob_path, dest_path)
+            self.blobs.move_to_end(sha256)
+            return True
+
+    def add(self, file_unique_id, file_path):
+        """
+        Add a freshly downloaded file to the store
+
+        If identical content is already stored, file_path is replaced by a
+        link to the existing blob so the data exists only once on disk.
+
+        Args:
+            file_unique_id: Telegram file_unique_id of the document
+            file_path: Path of the downloaded file
+
+        Returns:
+            SHA-256 digest of the file
+        """
+        sha256 = self._hash_file(file_path)
+
+        with self._lock:
+            blob_path = self._blob_path(sha256)
+            if sha256 in self.blobs and os.path.exists(blob_path):
+                self._link_file(blob_path, file_path)
+                self.blobs.move_to_end(sha256)
+            else:
+                size = os.path.getsize(file_path)
+                if os.path.exists(blob_path):
+                    os.remove(blob_path)
+                try:
+                    os.link(file_path, blob_path)
+                except OSError:
+                    shutil.copyfile(file_path, blob_path)
+                self.blobs[sha256] = size
+                self.total_size += size
+
+            self.aliases[file_unique_id] = sha256
+            self._evict()
+
+        return sha256
+
+    def _link_file(self, blob_path, dest_path):
+        """Point dest_path at a blob, replacing any existing file"""
+        tmp_path = f"{dest_path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+
+    def _hash_file(self, file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _forget(self, sha256):
+        """Drop a blob and every alias pointing to it from the index"""
+        self.total_size -= self.blobs.pop(sha256, 0)
+        for file_unique_id in [k for k, v in self.aliases.items() if v == sha256]:
+            del self.aliases[file_unique_id]
+
+    def _evict(self):
+        """Remove unreferenced blobs until the store fits its size cap"""
+        for sha256 in list(self.blobs):
+            if self.total_size <= self.max_bytes:
+                break
+            if self.refcount(sha256) > 0:
+                continue
+            try:
+                os.remove(self._blob_path(sha256))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error evicting blob {sha256}: {e}")
+                continue
+            self._forget(sha256)
+
+
+class MemoryFileStore:
+    """
+    Keep downloaded files as in-memory buffers instead of temp files
+
+    Space for downloads is reserved up front and checked against a total
+    byte budget, like the disk quota of workspace.WorkspaceManager.
+    """
+
+    def __init__(self, max_bytes=MEMORY_STORE_MAX_BYTES):
+        self.files = {}
+        self.stored_at = {}  # ref -> time.monotonic() when stored
+        self.max_bytes = max_bytes
+        self.total_size = 0
+        self.reserved = 0  # Bytes reserved by running downloads
+
+    @staticmethod
+    def is_ref(file_path):
+        """Return True if file_path refers to an in-memory file"""
+        return isinstance(file_path, str) and file_path.startswith(MEMORY_PREFIX)
+
+    @contextmanager
+    def reserve(self, size):
+        """
+        Reserve space for a file that is about to be downloaded
+
+        Args:
+            size: Expected number of bytes
+
+        Raises:
+            MemoryStoreFull: If the space is not available
+        """
+        if self.max_bytes and self.total_size + self.reserved + size > self.max_bytes:
+            raise MemoryStoreFull("In-memory file budget reached")
+        self.reserved += size
+        try:
+            yield
+        finally:
+            self.reserved -= size
+
+    def put(self, key, data):
+        """
+        Store file contents
+
+        Args:
+            key: Unique key for the file
+            data: File contents
+
+        Returns:
+            Reference string to keep in the session instead of a path
+        """
+        ref = f"{MEMORY_PREFIX}{key}"
+        self.discard(ref)
+        self.files[ref] = data
+        self.stored_at[ref] = time.monotonic()
+        self.total_size += len(data)
+        return ref
+
+    def refs(self, min_age=0):
+        """
+        List the stored files
+
+        Args:
+            min_age: Only list files stored at least this many seconds ago
+
+        Returns:
+            List of references
+        """
+        cutoff = time.monotonic() - min_age
+        return [ref for ref, stored_at in self.stored_at.items() if stored_at <= cutoff]
+
+    def get(self, ref):
+        """Get the contents of an in-memory file"""
+        return self.files[ref]
+
+    def discard(self, ref):
+        """Release an in-memory file"""
+        data = self.files.pop(ref, None)
+        self.stored_at.pop(ref, None)
+        if data is not None:
+            self.total_size -= len(data)
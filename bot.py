@@ -1,5 +1,6 @@
 import os
 import logging
+import math
 import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -8,10 +9,37 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     ContextTypes,
+    ApplicationHandlerStop,
     filters,
 )
-from pdf_handler import PDFHandler
-from session_manager import SessionManager
+from pdf_handler import PDFMemoryLimitError, PageRangeError, parse_merge_spec, parse_split_spec
+from converter import RENDERING_AVAILABLE, RenderingUnavailable
+from session_manager import AsyncSessionManager
+from job_executor import JobExecutor, JobExecutorBusy, JobCancelled
+from blob_store import BlobStore, MemoryFileStore, MemoryStoreFull
+from scheduler import JobScheduler, RateLimited
+from workspace import WorkspaceManager, WorkspaceQuotaExceeded
+from job_queue import create_job_queue, new_job, new_job_id, telegram_ref
+from telegram_files import (
+    TELEGRAM_LOCAL_MODE,
+    configure_builder,
+    download_file,
+    send_file,
+    send_parts,
+    send_photos,
+    send_sent_files,
+)
+from operations import OperationTracker
+from worker import QueueWorker, DONE_TEXT
+from result_cache import ResultCache, result_key
+from progress import JobStatus, CANCEL_JOB
+import metrics
+from update_ingest import (
+    PerUserUpdateProcessor,
+    WebhookIngestor,
+    WEBHOOK_OVERFLOW,
+    WEBHOOK_MAX_BODY_BYTES,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -20,35 +48,322 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Constants
+# The cloud Bot API only serves files up to 20 MB; a local server up to 2000 MB
+MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', 2000 if TELEGRAM_LOCAL_MODE else 20))
+MAX_FILE_SIZE = MAX_FILE_SIZE_MB * 1024 * 1024
+# Keep uploads and results in memory instead of the temp/ directory
+IN_MEMORY = os.getenv('PDF_IN_MEMORY', '').lower() in ('1', 'true', 'yes')
+# Callback data of the buttons that start an operation; documents and text
+# messages start the others (preview, rename and split)
+OPERATION_CALLBACKS = r'^(merge_complete|images_complete|watermark_opacity_.+)$'
+
+memory_store = MemoryFileStore()
+
+def remove_file(file_path):
+    """Release a session file, whether it lives on disk or in memory"""
+    if memory_store.is_ref(file_path):
+        memory_store.discard(file_path)
+    elif os.path.exists(file_path):
+        os.remove(file_path)
+
+def load_file(file_path):
+    """Get the PDFHandler input (path or bytes) for a session file"""
+    if memory_store.is_ref(file_path):
+        return memory_store.get(file_path)
+    return file_path
+
+def file_size(file_path):
+    """Size in bytes of a session file, whether on disk or in memory"""
+    if memory_store.is_ref(file_path):
+        return len(memory_store.get(file_path))
+    return os.path.getsize(file_path)
+
+async def session_files(min_age):
+    """Session files this process keeps that were stored at least min_age seconds ago"""
+    uploads = [] if IN_MEMORY else await asyncio.to_thread(workspaces.uploads, min_age)
+    return memory_store.refs(min_age) + uploads
+
+async def send_document(message, document, filename, caption, operation):
+    """Reply with a document given as a file path or as bytes; returns the sent Message"""
+    return await send_file(message.get_bot(), message.chat_id, document, filename, caption, operation)
+
 # Initialize handlers
-pdf_handler = PDFHandler()
-session_manager = SessionManager()
+session_manager = AsyncSessionManager(file_remover=remove_file, file_lister=session_files)
+metrics.instrument_session_manager(session_manager, [
+    'get_session', 'update_session', 'remove_pdf', 'apply_changes', 'clear_session'
+])
+job_executor = JobExecutor()
+job_scheduler = JobScheduler(job_executor)
+blob_store = BlobStore()
+# Shared queue for worker.py processes (None = run jobs in this process)
+job_queue = create_job_queue()
+workspaces = WorkspaceManager()
+# Telegram file_ids of earlier results, sent again for identical operations
+result_cache = ResultCache()
+# Persistent records of running operations, for idempotency and resuming
+operations = OperationTracker(session_manager, result_cache)
+QUOTA_TEXT = "⚠️ Not enough storage space right now. Please finish or cancel other operations and try again."
+BUSY_TEXT = "⏳ The bot is busy right now. Please try again in a moment."
+CANCELLED_TEXT = "✖️ Operation cancelled. Use /start for more operations."
 
-# Constants
-MAX_FILE_SIZE = 20 * 1024 * 1024  # 20 MB
+# Task of each user's running job, for the Cancel button
+running_jobs = {}
+
+def busy_text(error):
+    """Message for a job rejected by the scheduler or executor"""
+    if isinstance(error, RateLimited):
+        return (
+            "⏳ You're starting jobs too quickly. "
+            f"Please try again in {math.ceil(error.retry_after)} seconds."
+        )
+    return BUSY_TEXT
+
+def menu_keyboard():
+    """Buttons of the main menu; Preview is left out without PyMuPDF"""
+    keyboard = [
+        [InlineKeyboardButton("📄 Merge PDFs", callback_data='merge')],
+        [InlineKeyboardButton("✏️ Rename PDF", callback_data='rename')],
+        [InlineKeyboardButton("💧 Add Watermark", callback_data='watermark')],
+        [InlineKeyboardButton("🖼 Images to PDF", callback_data='images')],
+        [InlineKeyboardButton("✂️ Split PDF", callback_data='split')],
+    ]
+    if RENDERING_AVAILABLE:
+        keyboard.append([InlineKeyboardButton("👁 Preview PDF", callback_data='preview')])
+    keyboard.append([InlineKeyboardButton("ℹ️ Help", callback_data='help')])
+    return InlineKeyboardMarkup(keyboard)
+
+async def run_job(user_id, status, method, *args, **kwargs):
+    """
+    Run a PDFHandler method for a user, showing its progress on a status message
+    
+    The job runs in its own task, which the user's Cancel button cancels
+    while the job waits or runs. The task that called run_job (a handler or
+    an ingestor task) is never cancelled by it.
+    
+    Args:
+        user_id: Telegram user ID
+        status: JobStatus of the job
+        method: Name of the PDFHandler method to call
+        *args: Positional arguments for the method
+        **kwargs: Keyword arguments for the method
+    
+    Returns:
+        Whatever the PDFHandler method returns
+    
+    Raises:
+        JobCancelled: If the user cancelled the job
+    """
+    job = asyncio.create_task(job_scheduler.run(
+        user_id, method, *args,
+        on_position=status.on_position, on_progress=status.on_progress, **kwargs
+    ))
+    running_jobs[user_id] = job
+    status.start()
+    try:
+        return await job
+    except asyncio.CancelledError:
+        # cancel_job forgets the job first; otherwise the caller itself was cancelled
+        if running_jobs.get(user_id) is job:
+            raise
+        raise JobCancelled(f"User {user_id} cancelled {method}")
+    finally:
+        if running_jobs.get(user_id) is job:
+            del running_jobs[user_id]
+        await status.close()
+
+def cancel_job(user_id):
+    """Cancel a user's running job; returns False if there is none"""
+    task = running_jobs.pop(user_id, None)
+    # A job that already finished cannot be cancelled
+    return task is not None and task.cancel()
+
+async def enqueue_job(status, user_id, job):
+    """
+    Hand an operation to the queue workers instead of running it here
+    
+    Args:
+        status: Bot message the worker updates when the job is done
+        user_id: Telegram user ID
+        job: Job dictionary from begin_operation
+    
+    Raises:
+        RateLimited: If the user exceeded the rate limit
+    """
+    job_scheduler.admit(user_id)
+    # The operation record is keyed by update; queued jobs are time-ordered
+    await job_queue.enqueue(dict(job, _id=new_job_id()))
+    await session_manager.clear_session(user_id)
+    await status.edit_text("🕒 Job queued. The result will be sent here when it's ready.")
+
+def remember_upload(session, file_path, file_name, media):
+    """Stage the original name and Telegram file IDs of an upload"""
+    session.update('uploads', (session.get('uploads') or []) + [
+        [file_path, file_name, media.file_id, media.file_unique_id]
+    ])
+
+def upload_names(session, pdf_files):
+    """Original file names of session files, in upload order"""
+    names = {entry[0]: entry[1] for entry in session.get('uploads') or []}
+    return [names.get(file, os.path.basename(file)) for file in pdf_files]
+
+def operation_key(source):
+    """Idempotency key of the update or callback query that started an operation"""
+    query = source.callback_query if isinstance(source, Update) else source
+    if query is not None:
+        return f"callback:{query.id}"
+    return f"update:{source.update_id}"
+
+async def replay_operation(bot, record):
+    """Answer a redelivered update from the record of the operation it started"""
+    logger.info(f"Operation {record['_id']} was already handled ({record['status']})")
+    if record['status'] == 'done' and record.get('outputs'):
+        # Send the result again by file_id instead of recomputing it
+        await send_sent_files(bot, record['chat_id'], record['outputs'], "✅ Here is your result.")
+
+async def begin_operation(source, status, session, user_id, operation, pdf_files, caption, **params):
+    """
+    Record an operation before running it, or answer it from the result cache
+    
+    On a cache hit the earlier result is sent again by file_id and the
+    session is closed, so there is nothing left to do. A redelivered update
+    finds the record of its first delivery and gets that result again.
+    
+    Args:
+        source: Update or CallbackQuery that started the operation
+        status: Bot message that reports the outcome
+        session: User session holding the uploads
+        user_id: Telegram user ID
+        operation: Operation name, e.g. 'merge'
+        pdf_files: Session file references of the inputs
+        caption: Caption of the result
+        **params: Operation parameters, as queue workers take them
+    
+    Returns:
+        Job dictionary whose _id is the idempotency key, or None if there is
+        nothing to run
+    """
+    uploads = {entry[0]: entry for entry in session.get('uploads') or []}
+    inputs = [uploads.get(file) or [file, None, None, None] for file in pdf_files]
+    job = new_job(
+        operation, user_id, status.chat_id, status.message_id,
+        [entry[2] for entry in inputs], **params
+    )
+    job['_id'] = operation_key(source)
+    job['cache_key'] = result_key(operation, [entry[3] for entry in inputs], params)
+    existing = await operations.begin(job)
+    if existing is not None:
+        await replay_operation(status.get_bot(), existing)
+        if existing['status'] == 'done':
+            await status.edit_text(DONE_TEXT[operation])
+        return None
+    await session_manager.update_session(user_id, 'operation', job['_id'])
+    
+    files = await result_cache.get(job['cache_key'])
+    if files:
+        try:
+            messages = await send_sent_files(status.get_bot(), status.chat_id, files, caption)
+        except Exception as e:
+            # e.g. the result was deleted on Telegram's side
+            logger.warning(f"Cached {operation} result could not be sent: {e}")
+            await result_cache.discard(job['cache_key'])
+        else:
+            metrics.RESULT_CACHE_TOTAL.inc(operation=operation, result='hit')
+            await operations.finish(job['_id'], messages, cached=True)
+            await session_manager.clear_session(user_id)
+            await status.edit_text(DONE_TEXT[operation])
+            return None
+    if job['cache_key']:
+        metrics.RESULT_CACHE_TOTAL.inc(operation=operation, result='miss')
+    return job
+
+async def store_upload(message, bot, user_id, media, file_name, operation):
+    """
+    Download an uploaded file into session storage
+    
+    Args:
+        message: User's message, used for status replies
+        bot: Telegram bot
+        user_id: Telegram user ID
+        media: Telegram Document or PhotoSize
+        file_name: Name to keep the file under
+        operation: Operation label for metrics
+    
+    Returns:
+        Session file reference, or None if the upload did not fit the quota
+    """
+    if job_queue:
+        # Workers download the file themselves when the job runs
+        return telegram_ref(media.file_id)
+    
+    if IN_MEMORY:
+        # Download straight into memory
+        try:
+            with memory_store.reserve(media.file_size or 0):
+                await message.reply_text("⏳ Downloading file...")
+                with metrics.STAGE_SECONDS.time(operation=operation, stage='download'):
+                    data = await download_file(bot, media.file_id)
+                return memory_store.put(f"{user_id}/{media.file_unique_id}", data)
+        except MemoryStoreFull as e:
+            logger.warning(f"Upload rejected: {e}")
+            await message.reply_text(QUOTA_TEXT)
+            return None
+    
+    # Reuse a cached copy or download file under a unique name
+    file_path = workspaces.upload_path(user_id, file_name)
+    if blob_store.link(media.file_unique_id, file_path):
+        metrics.DOWNLOAD_CACHE_TOTAL.inc(result='hit')
+        return file_path
+    
+    metrics.DOWNLOAD_CACHE_TOTAL.inc(result='miss')
+    try:
+        async with workspaces.reserve(user_id, media.file_size or 0):
+            await message.reply_text("⏳ Downloading file...")
+            with metrics.STAGE_SECONDS.time(operation=operation, stage='download'):
+                await download_file(bot, media.file_id, file_path)
+    except WorkspaceQuotaExceeded as e:
+        logger.warning(f"Upload rejected: {e}")
+        await message.reply_text(QUOTA_TEXT)
+        return None
+    await asyncio.to_thread(blob_store.add, media.file_unique_id, file_path)
+    return file_path
+
+# Background inspections of uploaded files, awaited before merging
+inspection_tasks = {}
 
 class PDFBot:
+    @staticmethod
+    async def replay_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Answer a redelivered button press from its operation record instead of handling it again"""
+        record = await session_manager.get_operation(operation_key(update))
+        if record is None:
+            return
+        
+        try:
+            await update.callback_query.answer()
+        except Exception:
+            pass  # Already answered by the first delivery
+        await replay_operation(context.bot, record)
+        raise ApplicationHandlerStop
+
     @staticmethod
     async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         user_id = update.effective_user.id
-        session_manager.clear_session(user_id)
+        await session_manager.clear_session(user_id)
         
-        keyboard = [
-            [InlineKeyboardButton("📄 Merge PDFs", callback_data='merge')],
-            [InlineKeyboardButton("✏️ Rename PDF", callback_data='rename')],
-            [InlineKeyboardButton("💧 Add Watermark", callback_data='watermark')],
-            [InlineKeyboardButton("ℹ️ Help", callback_data='help')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = menu_keyboard()
         
         welcome_text = (
             "🤖 *Welcome to PDF Utility Bot!*\n\n"
             "I can help you with:\n"
             "• Merge multiple PDF files\n"
             "• Rename PDF files\n"
-            "• Add text watermarks to PDFs\n\n"
-            "Choose an option below to get started:"
+            "• Add text watermarks to PDFs\n"
+            "• Turn photos into a PDF\n"
+            "• Split PDFs or extract pages\n"
+            + ("• Preview PDF pages\n" if RENDERING_AVAILABLE else "") +
+            "\nChoose an option below to get started:"
         )
         
         await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
@@ -57,18 +372,25 @@ class PDFBot:
     async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle button callbacks"""
         query = update.callback_query
-        await query.answer()
-        
         user_id = query.from_user.id
         action = query.data
         
+        if action == CANCEL_JOB:
+            # Runs next to the job's own handler (see update_ingest._user_key)
+            await query.answer("Cancelling..." if cancel_job(user_id) else "Nothing to cancel")
+            return
+        
+        await query.answer()
+        
         if action == 'merge':
-            session_manager.set_state(user_id, 'MERGE_UPLOAD')
+            await session_manager.set_state(user_id, 'MERGE_UPLOAD')
             await query.edit_message_text(
                 "📄 *Merge PDFs*\n\n"
                 "Send me the PDF files you want to merge (one by one).\n"
+                "To take only some pages, then send a page selection like "
+                "`1:1-3, 2:10-` (file number or name, then pages).\n"
                 "When done, click the button below.\n\n"
-                "⚠️ Max file size: 20 MB",
+                f"⚠️ Max file size: {MAX_FILE_SIZE_MB} MB",
                 parse_mode='Markdown',
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("✅ Done Uploading", callback_data='merge_complete'),
@@ -77,11 +399,11 @@ class PDFBot:
             )
         
         elif action == 'rename':
-            session_manager.set_state(user_id, 'RENAME_UPLOAD')
+            await session_manager.set_state(user_id, 'RENAME_UPLOAD')
             await query.edit_message_text(
                 "✏️ *Rename PDF*\n\n"
                 "Send me the PDF file you want to rename.\n\n"
-                "⚠️ Max file size: 20 MB",
+                f"⚠️ Max file size: {MAX_FILE_SIZE_MB} MB",
                 parse_mode='Markdown',
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
@@ -89,23 +411,64 @@ class PDFBot:
             )
         
         elif action == 'watermark':
-            session_manager.set_state(user_id, 'WATERMARK_UPLOAD')
+            await session_manager.set_state(user_id, 'WATERMARK_UPLOAD')
             await query.edit_message_text(
                 "💧 *Add Watermark*\n\n"
                 "Send me the PDF file you want to add a watermark to.\n\n"
-                "⚠️ Max file size: 20 MB",
+                f"⚠️ Max file size: {MAX_FILE_SIZE_MB} MB",
+                parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
+        elif action == 'images':
+            await session_manager.set_state(user_id, 'IMAGES_UPLOAD')
+            await query.edit_message_text(
+                "🖼 *Images to PDF*\n\n"
+                "Send me the photos or image files (one by one), in page order.\n"
+                "When done, click the button below.\n\n"
+                f"⚠️ Max file size: {MAX_FILE_SIZE_MB} MB",
+                parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("✅ Create PDF", callback_data='images_complete'),
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
+        elif action == 'split':
+            await session_manager.set_state(user_id, 'SPLIT_UPLOAD')
+            await query.edit_message_text(
+                "✂️ *Split PDF*\n\n"
+                "Send me the PDF file you want to split or extract pages from.\n\n"
+                f"⚠️ Max file size: {MAX_FILE_SIZE_MB} MB",
                 parse_mode='Markdown',
                 reply_markup=InlineKeyboardMarkup([[
                     InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
                 ]])
             )
         
+        elif action == 'preview':
+            await session_manager.set_state(user_id, 'PREVIEW_UPLOAD')
+            await query.edit_message_text(
+                "👁 *Preview PDF*\n\n"
+                "Send me the PDF file you want to preview.\n\n"
+                f"⚠️ Max file size: {MAX_FILE_SIZE_MB} MB",
+                parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
+        elif action == 'images_complete':
+            await PDFBot.process_images(query, user_id)
+        
         elif action == 'merge_complete':
             await PDFBot.process_merge(query, user_id)
         
         elif action.startswith('watermark_pos_'):
             position = action.replace('watermark_pos_', '')
-            session_manager.update_session(user_id, 'watermark_position', position)
+            await session_manager.update_session(user_id, 'watermark_position', position)
             
             keyboard = [
                 [InlineKeyboardButton("10%", callback_data='watermark_opacity_0.1')],
@@ -129,8 +492,9 @@ class PDFBot:
                 "*Merge PDFs:*\n"
                 "1. Click 'Merge PDFs'\n"
                 "2. Send multiple PDF files\n"
-                "3. Click 'Done Uploading'\n"
-                "4. Receive merged PDF\n\n"
+                "3. Optionally send pages to keep, e.g. `1:1-3, 2:10-`\n"
+                "4. Click 'Done Uploading'\n"
+                "5. Receive merged PDF\n\n"
                 "*Rename PDF:*\n"
                 "1. Click 'Rename PDF'\n"
                 "2. Send one PDF file\n"
@@ -142,7 +506,23 @@ class PDFBot:
                 "3. Type watermark text\n"
                 "4. Select position & opacity\n"
                 "5. Receive watermarked PDF\n\n"
-                "⚠️ Max file size: 20 MB per file"
+                "*Images to PDF:*\n"
+                "1. Click 'Images to PDF'\n"
+                "2. Send photos or image files\n"
+                "3. Click 'Create PDF'\n\n"
+                "*Split PDF:*\n"
+                "1. Click 'Split PDF'\n"
+                "2. Send one PDF file\n"
+                "3. Send `every 5`, a size like `10MB`, or parts like `1-3; 4-10`\n"
+                "4. Receive the parts\n\n"
+                + (
+                    "*Preview PDF:*\n"
+                    "1. Click 'Preview PDF'\n"
+                    "2. Send one PDF file\n"
+                    "3. Receive images of the first pages\n\n"
+                    if RENDERING_AVAILABLE else ""
+                ) +
+                f"⚠️ Max file size: {MAX_FILE_SIZE_MB} MB per file"
             )
             await query.edit_message_text(
                 help_text,
@@ -153,23 +533,18 @@ class PDFBot:
             )
         
         elif action == 'back_to_menu' or action == 'cancel':
-            session_manager.clear_session(user_id)
-            keyboard = [
-                [InlineKeyboardButton("📄 Merge PDFs", callback_data='merge')],
-                [InlineKeyboardButton("✏️ Rename PDF", callback_data='rename')],
-                [InlineKeyboardButton("💧 Add Watermark", callback_data='watermark')],
-                [InlineKeyboardButton("ℹ️ Help", callback_data='help')]
-            ]
+            await session_manager.clear_session(user_id)
             await query.edit_message_text(
                 "Choose an option:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=menu_keyboard()
             )
 
     @staticmethod
     async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle PDF file uploads"""
         user_id = update.effective_user.id
-        state = session_manager.get_state(user_id)
+        session = await session_manager.unit_of_work(user_id)
+        state = session.get('state')
         
         if not state:
             await update.message.reply_text(
@@ -179,6 +554,12 @@ class PDFBot:
         
         document = update.message.document
         
+        if state == 'IMAGES_UPLOAD':
+            await update.message.reply_text(
+                "⚠️ Please send photos or image files."
+            )
+            return
+        
         # Validate file type
         if not document.file_name.lower().endswith('.pdf'):
             await update.message.reply_text(
@@ -189,53 +570,184 @@ class PDFBot:
         # Validate file size
         if document.file_size > MAX_FILE_SIZE:
             await update.message.reply_text(
-                f"⚠️ File is too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)} MB."
+                f"⚠️ File is too large. Maximum size is {MAX_FILE_SIZE_MB} MB."
             )
             return
         
-        # Download file
-        await update.message.reply_text("⏳ Downloading file...")
-        file = await context.bot.get_file(document.file_id)
-        file_path = f"temp/{user_id}_{document.file_name}"
-        os.makedirs("temp", exist_ok=True)
-        await file.download_to_drive(file_path)
+        operation = state.split('_')[0].lower()
+        metrics.FILE_BYTES.observe(document.file_size, operation=operation, direction='in')
+        
+        file_path = await store_upload(
+            update.message, context.bot, user_id, document, document.file_name, operation
+        )
+        if file_path is None:
+            return
+        
+        # Page selections refer to the original name; resuming needs the file_id
+        remember_upload(session, file_path, document.file_name, document)
         
         if state == 'MERGE_UPLOAD':
-            session_manager.add_pdf(user_id, file_path)
-            count = len(session_manager.get_session(user_id).get('pdf_files', []))
-            await update.message.reply_text(
+            session.add_pdf(file_path)
+            await session.flush()
+            count = len(session.get('pdf_files', []))
+            status = await update.message.reply_text(
                 f"✅ File added! Total files: {count}\n"
                 "Send more files or click 'Done Uploading' when ready."
             )
+            
+            # Parse the file in the background while the user keeps uploading
+            if not job_queue:
+                task = asyncio.create_task(
+                    PDFBot.inspect_upload(status, user_id, file_path, document.file_name)
+                )
+                tasks = inspection_tasks.setdefault(user_id, set())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
         
         elif state == 'RENAME_UPLOAD':
-            session_manager.add_pdf(user_id, file_path)
-            session_manager.set_state(user_id, 'RENAME_WAIT_NAME')
+            session.add_pdf(file_path)
+            session.set_state('RENAME_WAIT_NAME')
+            await session.flush()
             await update.message.reply_text(
                 "✏️ Now send me the new filename (without .pdf extension):"
             )
         
         elif state == 'WATERMARK_UPLOAD':
-            session_manager.add_pdf(user_id, file_path)
-            session_manager.set_state(user_id, 'WATERMARK_WAIT_TEXT')
+            session.add_pdf(file_path)
+            session.set_state('WATERMARK_WAIT_TEXT')
+            await session.flush()
             await update.message.reply_text(
                 "💧 Now send me the watermark text:"
             )
+        
+        elif state == 'SPLIT_UPLOAD':
+            session.add_pdf(file_path)
+            session.set_state('SPLIT_WAIT_SPEC')
+            await session.flush()
+            await update.message.reply_text(
+                "✂️ Now tell me how to split it:\n"
+                "• every 5 — parts of 5 pages\n"
+                "• 10MB — parts of at most 10 MB\n"
+                "• 1-3; 4-10; 11- — one part per group\n"
+                "• 2,5,7 — extract these pages"
+            )
+        
+        elif state == 'PREVIEW_UPLOAD':
+            session.add_pdf(file_path)
+            await session.flush()
+            await PDFBot.process_preview(update, user_id, session, file_path)
+
+    @staticmethod
+    async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle photos and image files"""
+        user_id = update.effective_user.id
+        session = await session_manager.unit_of_work(user_id)
+        
+        if session.get('state') != 'IMAGES_UPLOAD':
+            await update.message.reply_text(
+                "To turn images into a PDF, use /start and select 'Images to PDF'."
+            )
+            return
+        
+        if update.message.photo:
+            # Largest available size of a compressed photo
+            media = update.message.photo[-1]
+            file_name = f"photo_{media.file_unique_id}.jpg"
+        else:
+            media = update.message.document
+            file_name = media.file_name or f"image_{media.file_unique_id}"
+        
+        # Validate file size
+        if (media.file_size or 0) > MAX_FILE_SIZE:
+            await update.message.reply_text(
+                f"⚠️ File is too large. Maximum size is {MAX_FILE_SIZE_MB} MB."
+            )
+            return
+        
+        metrics.FILE_BYTES.observe(media.file_size or 0, operation='images', direction='in')
+        file_path = await store_upload(
+            update.message, context.bot, user_id, media, file_name, 'images'
+        )
+        if file_path is None:
+            return
+        
+        session.add_pdf(file_path)
+        remember_upload(session, file_path, file_name, media)
+        await session.flush()
+        count = len(session.get('pdf_files', []))
+        await update.message.reply_text(
+            f"✅ Image added! Total images: {count}\n"
+            "Send more images or click 'Create PDF' when ready."
+        )
+
+    @staticmethod
+    async def inspect_upload(status, user_id, file_path, file_name):
+        """Validate an uploaded PDF and report its page count"""
+        try:
+            info = await job_executor.run('inspect_pdf', load_file(file_path))
+        except JobExecutorBusy:
+            # The merge will parse the file itself
+            return
+        except Exception as e:
+            logger.warning(f"Invalid upload {file_path}: {e}")
+            info = None
+        
+        if info is None or info['encrypted']:
+            await session_manager.remove_pdf(user_id, file_path)
+            remove_file(file_path)
+            reason = "is password-protected" if info else "could not be read as a PDF"
+            await status.edit_text(f"❌ {file_name} {reason} and was removed.")
+            return
+        
+        metrics.DOCUMENT_PAGES.observe(info['pages'], operation='merge')
+        await status.edit_text(
+            f"{status.text}\n\n📄 {file_name}: {info['pages']} pages"
+        )
 
     @staticmethod
     async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages"""
         user_id = update.effective_user.id
-        state = session_manager.get_state(user_id)
+        session = await session_manager.unit_of_work(user_id)
+        state = session.get('state')
         text = update.message.text
         
-        if state == 'RENAME_WAIT_NAME':
-            session_manager.update_session(user_id, 'new_name', text)
-            await PDFBot.process_rename(update, user_id)
+        if state == 'MERGE_UPLOAD':
+            # Page selection for the merge, e.g. "1:1-3, 2:10-"
+            pdf_files = session.get('pdf_files', [])
+            try:
+                entries = parse_merge_spec(text, upload_names(session, pdf_files))
+            except PageRangeError as e:
+                await update.message.reply_text(
+                    f"⚠️ {e}\n\nSend pages like 1:1-3, 2:10- after uploading the files."
+                )
+                return
+            session.update('merge_spec', text)
+            await session.flush()
+            await update.message.reply_text(
+                f"✅ Page selection saved ({len(entries)} parts). "
+                "Click 'Done Uploading' when ready."
+            )
+        
+        elif state == 'RENAME_WAIT_NAME':
+            session.update('new_name', text)
+            await session.flush()
+            await PDFBot.process_rename(update, user_id, session)
+        
+        elif state == 'SPLIT_WAIT_SPEC':
+            try:
+                split = parse_split_spec(text)
+            except PageRangeError as e:
+                await update.message.reply_text(
+                    f"⚠️ {e}\n\nSend every 5, 10MB or pages like 1-3; 4-10."
+                )
+                return
+            await PDFBot.process_split(update, user_id, session, split)
         
         elif state == 'WATERMARK_WAIT_TEXT':
-            session_manager.update_session(user_id, 'watermark_text', text)
-            session_manager.set_state(user_id, 'WATERMARK_WAIT_POSITION')
+            session.update('watermark_text', text)
+            session.set_state('WATERMARK_WAIT_POSITION')
+            await session.flush()
             
             keyboard = [
                 [InlineKeyboardButton("Center", callback_data='watermark_pos_center')],
@@ -248,13 +760,153 @@ class PDFBot:
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
 
+    @staticmethod
+    async def process_images(query, user_id):
+        """Turn the uploaded images into one PDF"""
+        session = await session_manager.get_session(user_id)
+        image_files = session.get('pdf_files', [])
+        
+        if not image_files:
+            await query.edit_message_text(
+                "⚠️ Please send at least one image first.",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔙 Back", callback_data='images')
+                ]])
+            )
+            return
+        
+        await query.edit_message_text("⏳ Creating PDF...")
+        
+        caption = f"✅ Created a PDF from {len(image_files)} images!"
+        record = await begin_operation(query, query.message, session, user_id, 'images', image_files, caption)
+        if record is None:
+            return
+        key = record['_id']
+        
+        try:
+            if job_queue:
+                await enqueue_job(query.message, user_id, record)
+                await operations.finish(key, status='queued')
+                return
+            
+            # Images are down-sampled, so the PDF is at most as large as its inputs
+            expected_size = 0 if IN_MEMORY else sum(file_size(file) for file in image_files)
+            async with workspaces.job(user_id, expected_size) as job:
+                output_path = None if IN_MEMORY else job.path('images.pdf')
+                result = await run_job(
+                    user_id, JobStatus(query.edit_message_text, "⏳ Creating PDF..."),
+                    'images_to_pdf', [load_file(file) for file in image_files], output_path
+                )
+                
+                message = await send_document(
+                    query.message,
+                    result or output_path,
+                    'images.pdf',
+                    caption,
+                    'images'
+                )
+                await operations.finish(key, [message])
+            
+            # Cleanup
+            for file in image_files:
+                remove_file(file)
+            
+            await session_manager.clear_session(user_id)
+            await query.edit_message_text(
+                "✅ PDF created! Use /start for more operations."
+            )
+        
+        except JobCancelled:
+            await session_manager.clear_session(user_id)
+            await query.edit_message_text(CANCELLED_TEXT)
+        
+        except (JobExecutorBusy, RateLimited) as e:
+            await query.edit_message_text(
+                busy_text(e),
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔄 Try Again", callback_data='images_complete'),
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
+        except WorkspaceQuotaExceeded as e:
+            logger.warning(f"Image conversion rejected: {e}")
+            await query.edit_message_text(QUOTA_TEXT)
+        
+        except Exception as e:
+            logger.error(f"Image conversion error: {e}")
+            await query.edit_message_text(
+                "❌ An error occurred while creating the PDF. Please check the images and try again."
+            )
+        
+        finally:
+            await operations.abandon(key)
+
+    @staticmethod
+    async def process_preview(update, user_id, session, pdf_file):
+        """Send images of the first pages of a PDF"""
+        status = await update.message.reply_text("⏳ Rendering preview...")
+        
+        record = await begin_operation(update, status, session, user_id, 'preview', [pdf_file], "👁 Preview")
+        if record is None:
+            return
+        key = record['_id']
+        
+        try:
+            if job_queue:
+                await enqueue_job(status, user_id, record)
+                await operations.finish(key, status='queued')
+                return
+            
+            # Previews are quick; only the queue position is shown
+            preview_status = JobStatus(status.edit_text, "⏳ Rendering preview...", cancellable=False)
+            try:
+                thumbnails = await job_scheduler.run(
+                    user_id, 'render_thumbnails', load_file(pdf_file),
+                    on_position=preview_status.on_position
+                )
+            finally:
+                await preview_status.close()
+            messages = await send_photos(update.get_bot(), update.message.chat_id, thumbnails, "👁 Preview")
+            await operations.finish(key, messages)
+            
+            # Cleanup
+            remove_file(pdf_file)
+            
+            await session_manager.clear_session(user_id)
+            await status.edit_text("✅ Preview sent! Use /start for more operations.")
+        
+        except (JobExecutorBusy, RateLimited) as e:
+            await status.edit_text(busy_text(e))
+        
+        except RenderingUnavailable as e:
+            logger.warning(f"Preview unavailable: {e}")
+            await session_manager.clear_session(user_id)
+            await status.edit_text("⚠️ Previews are not available on this server.")
+        
+        except Exception as e:
+            logger.error(f"Preview error: {e}")
+            await status.edit_text(
+                "❌ An error occurred while rendering the preview. Please try again."
+            )
+        
+        finally:
+            await operations.abandon(key)
+
     @staticmethod
     async def process_merge(query, user_id):
         """Process PDF merge operation"""
-        session = session_manager.get_session(user_id)
+        # Wait for uploads that are still being inspected
+        pending = inspection_tasks.pop(user_id, None)
+        if pending:
+            await query.edit_message_text("⏳ Checking uploaded files...")
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        session = await session_manager.get_session(user_id)
         pdf_files = session.get('pdf_files', [])
+        merge_spec = session.get('merge_spec')
         
-        if len(pdf_files) < 2:
+        if len(pdf_files) < (1 if merge_spec else 2):
             await query.edit_message_text(
                 "⚠️ Please upload at least 2 PDF files to merge.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -263,161 +915,435 @@ class PDFBot:
             )
             return
         
+        # Resolve the page selection into inputs and their page ranges
+        inputs, page_ranges = pdf_files, None
+        if merge_spec:
+            try:
+                entries = parse_merge_spec(merge_spec, upload_names(session, pdf_files))
+            except PageRangeError as e:
+                # An upload named in the selection was removed after inspection
+                await query.edit_message_text(
+                    f"⚠️ {e}. Please send the page selection again.",
+                    reply_markup=InlineKeyboardMarkup([[
+                        InlineKeyboardButton("✅ Done Uploading", callback_data='merge_complete'),
+                        InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                    ]])
+                )
+                return
+            inputs = [pdf_files[index] for index, _ in entries]
+            page_ranges = [ranges for _, ranges in entries]
+        
         await query.edit_message_text("⏳ Merging PDFs...")
         
+        caption = f"✅ Successfully merged {len(inputs)} PDFs!"
+        record = await begin_operation(
+            query, query.message, session, user_id, 'merge', inputs, caption, page_ranges=page_ranges
+        )
+        if record is None:
+            return
+        key = record['_id']
+        
         try:
-            output_path = f"temp/{user_id}_merged.pdf"
-            pdf_handler.merge_pdfs(pdf_files, output_path)
+            if job_queue:
+                await enqueue_job(query.message, user_id, record)
+                await operations.finish(key, status='queued')
+                return
             
-            with open(output_path, 'rb') as doc:
-                await query.message.reply_document(
-                    document=doc,
-                    filename='merged.pdf',
-                    caption=f"✅ Successfully merged {len(pdf_files)} PDFs!"
+            # The merged file is about as large as its inputs together
+            expected_size = 0 if IN_MEMORY else sum(file_size(file) for file in pdf_files)
+            async with workspaces.job(user_id, expected_size) as job:
+                output_path = None if IN_MEMORY else job.path('merged.pdf')
+                result = await run_job(
+                    user_id, JobStatus(query.edit_message_text, "⏳ Merging PDFs..."),
+                    'merge_pdfs', [load_file(file) for file in inputs], output_path,
+                    page_ranges=page_ranges
                 )
+                
+                message = await send_document(
+                    query.message,
+                    result or output_path,
+                    'merged.pdf',
+                    caption,
+                    'merge'
+                )
+                await operations.finish(key, [message])
             
             # Cleanup
             for file in pdf_files:
-                if os.path.exists(file):
-                    os.remove(file)
-            if os.path.exists(output_path):
-                os.remove(output_path)
+                remove_file(file)
             
-            session_manager.clear_session(user_id)
+            await session_manager.clear_session(user_id)
             await query.edit_message_text(
                 "✅ Merge completed! Use /start for more operations."
             )
         
+        except JobCancelled:
+            await session_manager.clear_session(user_id)
+            await query.edit_message_text(CANCELLED_TEXT)
+        
+        except (JobExecutorBusy, RateLimited) as e:
+            await query.edit_message_text(
+                busy_text(e),
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔄 Try Again", callback_data='merge_complete'),
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
+        except WorkspaceQuotaExceeded as e:
+            logger.warning(f"Merge rejected: {e}")
+            await query.edit_message_text(
+                QUOTA_TEXT,
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔄 Try Again", callback_data='merge_complete'),
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
+        except PageRangeError as e:
+            await query.edit_message_text(
+                f"⚠️ {e}. Please send the page selection again.",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("✅ Done Uploading", callback_data='merge_complete'),
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
+        except PDFMemoryLimitError as e:
+            logger.warning(f"Merge rejected: {e}")
+            await session_manager.clear_session(user_id)
+            await query.edit_message_text(
+                "⚠️ These files are too large to merge together. "
+                "Please try again with fewer or smaller files."
+            )
+        
         except Exception as e:
             logger.error(f"Merge error: {e}")
             await query.edit_message_text(
                 "❌ An error occurred while merging PDFs. Please try again."
             )
+        
+        finally:
+            await operations.abandon(key)
 
     @staticmethod
-    async def process_rename(update, user_id):
+    async def process_rename(update, user_id, session):
         """Process PDF rename operation"""
-        session = session_manager.get_session(user_id)
         pdf_file = session.get('pdf_files', [])[0]
         new_name = session.get('new_name', 'renamed')
         
-        await update.message.reply_text("⏳ Renaming PDF...")
+        status = await update.message.reply_text("⏳ Renaming PDF...")
+        
+        caption = f"✅ File renamed to: {new_name}.pdf"
+        record = await begin_operation(
+            update, status, session, user_id, 'rename', [pdf_file], caption, new_name=new_name
+        )
+        if record is None:
+            return
+        key = record['_id']
         
         try:
-            output_path = f"temp/{user_id}_{new_name}.pdf"
-            pdf_handler.rename_pdf(pdf_file, output_path)
+            if job_queue:
+                await enqueue_job(status, user_id, record)
+                await operations.finish(key, status='queued')
+                return
             
-            with open(output_path, 'rb') as doc:
-                await update.message.reply_document(
-                    document=doc,
-                    filename=f"{new_name}.pdf",
-                    caption=f"✅ File renamed to: {new_name}.pdf"
-                )
+            # Send the original file under the new name, no copy needed
+            message = await send_document(
+                update.message,
+                load_file(pdf_file),
+                f"{new_name}.pdf",
+                caption,
+                'rename'
+            )
+            await operations.finish(key, [message])
             
             # Cleanup
-            if os.path.exists(pdf_file):
-                os.remove(pdf_file)
-            if os.path.exists(output_path):
-                os.remove(output_path)
+            remove_file(pdf_file)
             
-            session_manager.clear_session(user_id)
+            await session_manager.clear_session(user_id)
             await update.message.reply_text(
                 "✅ Rename completed! Use /start for more operations."
             )
         
+        except RateLimited as e:
+            await status.edit_text(busy_text(e))
+        
         except Exception as e:
             logger.error(f"Rename error: {e}")
             await update.message.reply_text(
                 "❌ An error occurred while renaming PDF. Please try again."
             )
+        
+        finally:
+            await operations.abandon(key)
+
+    @staticmethod
+    async def process_split(update, user_id, session, split):
+        """Split a PDF into parts and send them back together"""
+        pdf_file = session.get('pdf_files', [])[0]
+        base_name = os.path.splitext(upload_names(session, [pdf_file])[0])[0]
+        
+        status = await update.message.reply_text("⏳ Splitting PDF...")
+        
+        record = await begin_operation(
+            update, status, session, user_id, 'split', [pdf_file], "✅ Here are the parts!",
+            base_name=base_name, **split
+        )
+        if record is None:
+            return
+        key = record['_id']
+        
+        try:
+            if job_queue:
+                await enqueue_job(status, user_id, record)
+                await operations.finish(key, status='queued')
+                return
+            
+            # The parts together, plus a zip of them
+            expected_size = 0 if IN_MEMORY else 2 * file_size(pdf_file)
+            async with workspaces.job(user_id, expected_size) as job:
+                output_dir = None if IN_MEMORY else job.dir
+                parts = await run_job(
+                    user_id, JobStatus(status.edit_text, "⏳ Splitting PDF..."),
+                    'split_pdf', load_file(pdf_file), output_dir, **split
+                )
+                
+                messages = await send_parts(
+                    update.get_bot(), update.message.chat_id, parts, base_name,
+                    f"✅ Split into {len(parts)} files!", 'split',
+                    zip_path=None if IN_MEMORY else job.path('parts.zip')
+                )
+                await operations.finish(key, messages)
+            
+            # Cleanup
+            remove_file(pdf_file)
+            
+            await session_manager.clear_session(user_id)
+            await status.edit_text("✅ Split completed! Use /start for more operations.")
+        
+        except JobCancelled:
+            await session_manager.clear_session(user_id)
+            await status.edit_text(CANCELLED_TEXT)
+        
+        except (JobExecutorBusy, RateLimited) as e:
+            await status.edit_text(f"{busy_text(e)}\nSend the split again to retry.")
+        
+        except WorkspaceQuotaExceeded as e:
+            logger.warning(f"Split rejected: {e}")
+            await status.edit_text(QUOTA_TEXT)
+        
+        except PageRangeError as e:
+            await status.edit_text(f"⚠️ {e}. Please send a different split.")
+        
+        except Exception as e:
+            logger.error(f"Split error: {e}")
+            await status.edit_text(
+                "❌ An error occurred while splitting the PDF. Please try again."
+            )
+        
+        finally:
+            await operations.abandon(key)
 
     @staticmethod
     async def process_watermark(query, user_id, opacity):
         """Process PDF watermark operation"""
-        session = session_manager.get_session(user_id)
+        session = await session_manager.get_session(user_id)
         pdf_file = session.get('pdf_files', [])[0]
         watermark_text = session.get('watermark_text', '')
         position = session.get('watermark_position', 'center')
         
         await query.edit_message_text("⏳ Adding watermark...")
         
+        caption = f"✅ Watermark added: '{watermark_text}'"
+        record = await begin_operation(
+            query, query.message, session, user_id, 'watermark', [pdf_file], caption,
+            watermark_text=watermark_text, position=position, opacity=opacity
+        )
+        if record is None:
+            return
+        key = record['_id']
+        
         try:
-            output_path = f"temp/{user_id}_watermarked.pdf"
-            pdf_handler.add_watermark(pdf_file, output_path, watermark_text, position, opacity)
+            if job_queue:
+                await enqueue_job(query.message, user_id, record)
+                await operations.finish(key, status='queued')
+                return
             
-            with open(output_path, 'rb') as doc:
-                await query.message.reply_document(
-                    document=doc,
-                    filename='watermarked.pdf',
-                    caption=f"✅ Watermark added: '{watermark_text}'"
+            expected_size = 0 if IN_MEMORY else file_size(pdf_file)
+            async with workspaces.job(user_id, expected_size) as job:
+                output_path = None if IN_MEMORY else job.path('watermarked.pdf')
+                result = await run_job(
+                    user_id, JobStatus(query.edit_message_text, "⏳ Adding watermark..."),
+                    'add_watermark', load_file(pdf_file), output_path,
+                    watermark_text, position, opacity
+                )
+                
+                message = await send_document(
+                    query.message,
+                    result or output_path,
+                    'watermarked.pdf',
+                    caption,
+                    'watermark'
                 )
+                await operations.finish(key, [message])
             
             # Cleanup
-            if os.path.exists(pdf_file):
-                os.remove(pdf_file)
-            if os.path.exists(output_path):
-                os.remove(output_path)
+            remove_file(pdf_file)
             
-            session_manager.clear_session(user_id)
+            await session_manager.clear_session(user_id)
             await query.edit_message_text(
                 "✅ Watermark completed! Use /start for more operations."
             )
         
+        except JobCancelled:
+            await session_manager.clear_session(user_id)
+            await query.edit_message_text(CANCELLED_TEXT)
+        
+        except (JobExecutorBusy, RateLimited) as e:
+            await query.edit_message_text(
+                busy_text(e),
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔄 Try Again", callback_data=f'watermark_opacity_{opacity}'),
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
+        except WorkspaceQuotaExceeded as e:
+            logger.warning(f"Watermark rejected: {e}")
+            await query.edit_message_text(
+                QUOTA_TEXT,
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔄 Try Again", callback_data=f'watermark_opacity_{opacity}'),
+                    InlineKeyboardButton("🔙 Cancel", callback_data='cancel')
+                ]])
+            )
+        
         except Exception as e:
             logger.error(f"Watermark error: {e}")
             await query.edit_message_text(
                 "❌ An error occurred while adding watermark. Please try again."
             )
+        
+        finally:
+            await operations.abandon(key)
 
 async def main_async():
-    """Start the bot"""
+    """Start the bot and run it until cancelled"""
     # Get token from environment
     token = os.getenv('TELEGRAM_BOT_TOKEN')
     if not token:
         raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
     
-    # Create application
-    application = Application.builder().token(token).build()
-    
-    # Add handlers
-    application.add_handler(CommandHandler("start", PDFBot.start))
-    application.add_handler(CallbackQueryHandler(PDFBot.button_handler))
-    application.add_handler(MessageHandler(filters.Document.PDF, PDFBot.handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, PDFBot.handle_text))
-    
-    # Start bot
-    port = int(os.getenv('PORT', 8443))
-    webhook_url = os.getenv('WEBHOOK_URL')
-    
-    if webhook_url:
-        logger.info("Starting webhook mode")
-        await application.initialize()
-        await application.start()
-        await application.bot.set_webhook(url=f"{webhook_url}/{token}")
+    # Background loops, cancelled on shutdown
+    background_tasks = set()
+    application = runner = ingestor = None
+    try:
+        # Connect session storage and start evicting expired sessions
+        await session_manager.connect()
+        background_tasks.add(asyncio.create_task(session_manager.cleanup_loop()))
+        # Sweep files orphaned by a previous crash, then keep sweeping
+        background_tasks.add(asyncio.create_task(workspaces.reaper_loop()))
+        await result_cache.connect()
+        if job_queue:
+            await job_queue.connect()
+            logger.info("Handing PDF jobs to queue workers")
         
-        from aiohttp import web
+        # Create application
+        application = configure_builder(
+            Application.builder()
+            .token(token)
+            .concurrent_updates(PerUserUpdateProcessor())
+        ).build()
         
-        async def telegram_webhook(request):
-            await application.update_queue.put(
-                Update.de_json(data=await request.json(), bot=application.bot)
-            )
-            return web.Response(text="OK")
+        # Keep this process's operations owned, and resume those of dead processes
+        background_tasks.add(asyncio.create_task(operations.renew_loop()))
+        background_tasks.add(asyncio.create_task(operations.resume_loop(
+            QueueWorker(application.bot, None, job_executor, workspaces)
+        )))
         
-        app = web.Application()
-        app.router.add_post(f"/{token}", telegram_webhook)
+        # Add handlers
+        # Only buttons that start an operation are looked up, so other updates
+        # cost no database round trip; redelivered documents and text messages
+        # are caught when begin_operation finds their record
+        application.add_handler(CallbackQueryHandler(PDFBot.replay_update, pattern=OPERATION_CALLBACKS), group=-1)
+        application.add_handler(CommandHandler(
+            "start", metrics.instrument_handler('start', PDFBot.start)
+        ))
+        application.add_handler(CallbackQueryHandler(
+            metrics.instrument_handler('button', PDFBot.button_handler)
+        ))
+        application.add_handler(MessageHandler(
+            filters.Document.PDF, metrics.instrument_handler('document', PDFBot.handle_document)
+        ))
+        application.add_handler(MessageHandler(
+            filters.PHOTO | filters.Document.IMAGE,
+            metrics.instrument_handler('image', PDFBot.handle_image)
+        ))
+        application.add_handler(MessageHandler(
+            filters.TEXT & ~filters.COMMAND, metrics.instrument_handler('text', PDFBot.handle_text)
+        ))
         
-        runner = web.AppRunner(app)
-        await runner.setup()
-        site = web.TCPSite(runner, "0.0.0.0", port)
-        await site.start()
+        # Start bot
+        port = int(os.getenv('PORT', 8443))
+        webhook_url = os.getenv('WEBHOOK_URL')
         
-        logger.info(f"Webhook server started on port {port}")
+        await application.initialize()
+        await application.start()
+        
+        if webhook_url:
+            logger.info("Starting webhook mode")
+            await application.bot.set_webhook(url=f"{webhook_url}/{token}")
+            
+            from aiohttp import web
+            
+            ingestor = WebhookIngestor(application)
+            
+            async def telegram_webhook(request):
+                try:
+                    payload = await request.json()
+                except ValueError:
+                    return web.Response(status=400, text="Invalid JSON")
+                
+                # Acknowledge right away; the ingestor processes the update in the background
+                if not ingestor.submit(payload) and WEBHOOK_OVERFLOW == 'defer':
+                    return web.Response(status=503, text="Busy")
+                return web.Response(text="OK")
+            
+            async def metrics_endpoint(request):
+                return web.Response(text=metrics.REGISTRY.render(), content_type='text/plain')
+            
+            app = web.Application(client_max_size=WEBHOOK_MAX_BODY_BYTES)
+            app.router.add_post(f"/{token}", telegram_webhook)
+            app.router.add_get("/metrics", metrics_endpoint)
+            
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "0.0.0.0", port)
+            await site.start()
+            
+            logger.info(f"Webhook server started on port {port}")
+        else:
+            logger.info("Starting polling mode")
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
         
-        # Keep running
+        # Keep running until cancelled (Ctrl+C)
         await asyncio.Event().wait()
-    else:
-        logger.info("Starting polling mode")
-        await application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        # Stop taking updates, drop the ones in flight, then stop the loops
+        if runner is not None:
+            await runner.cleanup()
+        if ingestor is not None:
+            await ingestor.stop()
+        if application is not None:
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
 
 def main():
     """Entry point"""
@@ -425,6 +1351,8 @@ def main():
         asyncio.run(main_async())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
+    finally:
+        job_executor.shutdown()
 
 if __name__ == '__main__':
     main()
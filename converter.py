@@ -0,0 +1,190 @@
+import os
+import hashlib
+import logging
+from io import BytesIO
+from PIL import Image, ImageOps
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.utils import ImageReader
+from pdf_handler import PDFHandler, _is_buffer
+
+try:
+    import pymupdf  # Optional: only needed for page thumbnails
+except ImportError:
+    pymupdf = None
+
+# Page previews can be offered only when PyMuPDF is installed
+RENDERING_AVAILABLE = pymupdf is not None
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels of images placed in a PDF (larger photos are down-sampled)
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 2000))
+# JPEG quality of images placed in a PDF
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+# Margin around images on a page, in points
+IMAGE_PAGE_MARGIN = 18
+
+# Width in pixels of page thumbnails
+THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', 320))
+# Directory and size cap of the rendered thumbnail cache (shared by all workers)
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', 'temp/thumbs')
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MB', 50)) * 1024 * 1024
+
+
+class RenderingUnavailable(Exception):
+    """Raised when page rendering is requested without PyMuPDF installed"""
+
+
+def _source_key(pdf_file):
+    """
+    Cache key identifying the content of a PDF file
+
+    Files handed out by the BlobStore are hard links, so the same upload
+    shares an inode no matter which session it belongs to.
+    """
+    if _is_buffer(pdf_file):
+        return hashlib.sha1(pdf_file).hexdigest()
+    stat = os.stat(pdf_file)
+    return f"{stat.st_dev:x}-{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+class PDFConverter(PDFHandler):
+    """PDFHandler with image conversion and page rendering"""
+
+    def images_to_pdf(self, image_files, output_path, max_pixels=IMAGE_MAX_PIXELS,
+                      quality=IMAGE_JPEG_QUALITY):
+        """
+        Combine images into one PDF, one image per A4 page
+
+        Pages are assembled one at a time: each image is decoded, rotated
+        upright, down-sampled and re-encoded as JPEG before the next one is
+        opened, so only one decoded image is held in memory.
+
+        Args:
+            image_files: List of image file paths or image bytes
+            output_path: Output file path (None = return bytes)
+            max_pixels: Longest side of an image after down-sampling
+            quality: JPEG quality
+
+        Returns:
+            PDF bytes if output_path is None
+        """
+        packet = BytesIO() if output_path is None else output_path
+        c = canvas.Canvas(packet, pagesize=A4)
+
+        for image_file in image_files:
+            with self._stage('decode'):
+                source = BytesIO(image_file) if _is_buffer(image_file) else image_file
+                with Image.open(source) as image:
+                    # Phone photos are stored sideways with an EXIF rotation
+                    image = ImageOps.exif_transpose(image)
+                    image.thumbnail((max_pixels, max_pixels))
+                    if image.mode != 'RGB':
+                        image = image.convert('RGB')
+                    width, height = image.size
+                    encoded = BytesIO()
+                    image.save(encoded, 'JPEG', quality=quality, optimize=True)
+
+            with self._stage('stamp'):
+                page_width, page_height = landscape(A4) if width > height else A4
+                scale = min(
+                    (page_width - 2 * IMAGE_PAGE_MARGIN) / width,
+                    (page_height - 2 * IMAGE_PAGE_MARGIN) / height
+                )
+                draw_width, draw_height = width * scale, height * scale
+                c.setPageSize((page_width, page_height))
+                c.drawImage(
+                    ImageReader(encoded),
+                    (page_width - draw_width) / 2, (page_height - draw_height) / 2,
+                    draw_width, draw_height
+                )
+                c.showPage()
+            self._page_done(len(image_files))
+
+        with self._stage('write'):
+            c.save()
+        if output_path is None:
+            return packet.getvalue()
+
+    def render_thumbnails(self, pdf_file, pages=4, width=THUMBNAIL_WIDTH):
+        """
+        Render JPEG thumbnails of the first pages of a PDF
+
+        Thumbnails are cached on disk by file content, page and width, so
+        previews of a file that was rendered before are read back directly.
+
+        Args:
+            pdf_file: PDF file path or PDF bytes
+            pages: Number of pages to render from the start
+            width: Thumbnail width in pixels
+
+        Returns:
+            List of JPEG bytes, one per page
+
+        Raises:
+            RenderingUnavailable: If PyMuPDF is not installed
+        """
+        key = _source_key(pdf_file)
+        os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+
+        thumbnails = []
+        document = None
+        try:
+            for index in range(pages):
+                cache_path = os.path.join(THUMBNAIL_CACHE_DIR, f"{key}-{index}-{width}.jpg")
+                try:
+                    with open(cache_path, 'rb') as f:
+                        thumbnails.append(f.read())
+                    os.utime(cache_path)  # Most recently used
+                    continue
+                except FileNotFoundError:
+                    pass
+
+                if document is None:
+                    if pymupdf is None:
+                        raise RenderingUnavailable("Install PyMuPDF to render page previews")
+                    with self._stage('parse'):
+                        if _is_buffer(pdf_file):
+                            document = pymupdf.open(stream=pdf_file, filetype='pdf')
+                        else:
+                            document = pymupdf.open(pdf_file)
+                if index >= document.page_count:
+                    break
+
+                with self._stage('render'):
+                    page = document[index]
+                    zoom = width / page.rect.width
+                    pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+                    thumbnail = pixmap.tobytes('jpeg')
+
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(thumbnail)
+                os.replace(tmp_path, cache_path)
+                thumbnails.append(thumbnail)
+        finally:
+            if document is not None:
+                document.close()
+
+        self._evict_thumbnails()
+        return thumbnails
+
+    def _evict_thumbnails(self):
+        """Remove least recently used thumbnails while over the size cap"""
+        entries = []
+        total = 0
+        for entry in os.scandir(THUMBNAIL_CACHE_DIR):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= THUMBNAIL_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,283 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from converter import PDFConverter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes (defaults to the number of CPU cores)
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', os.cpu_count() or 1))
+# Maximum number of jobs waiting or running per worker process
+PDF_QUEUE_LIMIT = int(os.getenv('PDF_QUEUE_LIMIT', 4))
+# Documents with at least twice this many pages are watermarked in parallel
+# slices of at least this many pages (0 = never split)
+WATERMARK_CHUNK_PAGES = int(os.getenv('WATERMARK_CHUNK_PAGES', 200))
+# Seconds between progress reports (and cancellation checks) of a running job
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', 0.5))
+# Number of recently cancelled job IDs the worker processes can see
+CANCEL_SLOTS = 64
+
+# PDFConverter (PDFHandler plus conversions) owned by each worker process
+_worker_handler = None
+# Shared with the parent: progress reports out, cancelled job IDs in
+_progress_queue = None
+_cancelled_jobs = None
+
+
+class JobExecutorBusy(Exception):
+    """Raised when the job queue is full"""
+
+
+class JobCancelled(Exception):
+    """Raised when a job was cancelled, and inside the worker process to abort it"""
+
+
+def _init_worker(progress_queue, cancelled_jobs):
+    """Create the PDFConverter used by this worker process"""
+    global _worker_handler, _progress_queue, _cancelled_jobs
+    _worker_handler = PDFConverter()
+    _progress_queue = progress_queue
+    _cancelled_jobs = cancelled_jobs
+
+
+class _ProgressReporter:
+    """
+    Progress callback of a job running in a worker process
+
+    Reports are rate-limited to one per PROGRESS_INTERVAL. Each report also
+    checks whether the parent cancelled the job, so a cancelled job stops
+    within one interval and frees its worker process.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.state = {}
+        self.reported = 0
+
+    def __call__(self, **progress):
+        self.state.update(progress)
+        now = time.monotonic()
+        if now - self.reported < PROGRESS_INTERVAL:
+            return
+        self.reported = now
+        if self.job_id in _cancelled_jobs[:]:
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+        _progress_queue.put((self.job_id, dict(self.state)))
+
+
+def _run_job(job_id, method, args, kwargs):
+    """
+    Run a PDFHandler method inside a worker process
+
+    Args:
+        job_id: ID used for progress reports and cancellation
+        method: Name of the PDFHandler method to call
+        args: Positional arguments for the method
+        kwargs: Keyword arguments for the method
+
+    Returns:
+        Tuple of (method result, start timestamp, stage timings)
+    """
+    started = time.time()
+    _worker_handler.stage_timings = {}
+    _worker_handler.pages_done = 0
+    _worker_handler.progress = _ProgressReporter(job_id)
+    try:
+        result = getattr(_worker_handler, method)(*args, **kwargs)
+    finally:
+        _worker_handler.progress = None
+    return result, started, _worker_handler.stage_timings
+
+
+class JobExecutor:
+    """
+    Run PDFHandler operations in a bounded process pool
+
+    Worker processes send progress reports through a queue that a thread
+    hands to the event loop. Cancelling the task awaiting a job drops it if
+    it has not started yet, or flags its ID so the worker process aborts it
+    at its next progress report.
+    """
+
+    def __init__(self, max_workers=None, queue_limit=None):
+        self.max_workers = max_workers or PDF_WORKERS
+        self.queue_limit = queue_limit or PDF_QUEUE_LIMIT
+        self.max_pending = self.max_workers * self.queue_limit
+        self.pending = 0
+        self._pool = None
+        self._job_ids = itertools.count(1)
+        self._progress_callbacks = {}  # job_id -> on_progress
+        self._cancel_count = 0
+
+    def _get_pool(self):
+        """Create the process pool on first use"""
+        if self._pool is None:
+            self._loop = asyncio.get_running_loop()
+            self._progress_queue = multiprocessing.Queue()
+            self._cancelled_jobs = multiprocessing.Array('q', CANCEL_SLOTS)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(self._progress_queue, self._cancelled_jobs)
+            )
+            threading.Thread(
+                target=self._read_progress, args=(self._progress_queue,),
+                name='job-progress', daemon=True
+            ).start()
+            logger.info(f"Started PDF process pool with {self.max_workers} workers")
+        return self._pool
+
+    def _read_progress(self, progress_queue):
+        """Hand progress reports from the worker processes to the event loop"""
+        while True:
+            report = progress_queue.get()
+            if report is None:
+                return
+            self._loop.call_soon_threadsafe(self._dispatch_progress, *report)
+
+    def _dispatch_progress(self, job_id, progress):
+        callback = self._progress_callbacks.get(job_id)
+        if callback is None:
+            return
+        try:
+            callback(progress)
+        except Exception as e:
+            logger.debug(f"Progress callback failed: {e}")
+
+    def _cancel(self, job_id):
+        """Tell the worker processes to abort a job"""
+        self._cancelled_jobs[self._cancel_count % CANCEL_SLOTS] = job_id
+        self._cancel_count += 1
+
+    def is_busy(self):
+        """Return True if no more jobs can be accepted"""
+        return self.pending >= self.max_pending
+
+    async def run(self, method, *args, on_progress=None, **kwargs):
+        """
+        Run a PDFHandler method in the process pool
+
+        Args:
+            method: Name of the PDFHandler method to call
+            *args: Positional arguments for the method
+            on_progress: Optional callback called on the event loop with a
+                         dictionary of pages, total and bytes as the job runs
+            **kwargs: Keyword arguments for the method
+
+        Returns:
+            Whatever the PDFHandler method returns
+
+        Raises:
+            JobExecutorBusy: If the queue is full
+        """
+        if self.is_busy():
+            metrics.JOBS_TOTAL.inc(operation=method, outcome='busy')
+            raise JobExecutorBusy(f"{self.pending} jobs already queued")
+
+        self.pending += 1
+        try:
+            if method == 'add_watermark' and WATERMARK_CHUNK_PAGES and self.max_workers > 1:
+                return await self._run_chunked_watermark(*args, on_progress=on_progress, **kwargs)
+            return await self._submit(method, args, kwargs, on_progress)
+        finally:
+            self.pending -= 1
+
+    async def _submit(self, method, args, kwargs, on_progress=None):
+        """Run one PDFHandler call in the pool and record its metrics"""
+        submitted = time.time()
+        job_id = next(self._job_ids)
+        if on_progress is not None:
+            self._progress_callbacks[job_id] = on_progress
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, stage_timings = await loop.run_in_executor(
+                self._get_pool(), _run_job, job_id, method, args, kwargs
+            )
+        except asyncio.CancelledError:
+            # A job that already started keeps its process until it sees this
+            self._cancel(job_id)
+            metrics.JOBS_TOTAL.inc(operation=method, outcome='cancelled')
+            raise
+        except Exception:
+            metrics.JOBS_TOTAL.inc(operation=method, outcome='error')
+            raise
+        finally:
+            self._progress_callbacks.pop(job_id, None)
+
+        # Both timestamps come from the same host clock
+        metrics.STAGE_SECONDS.observe(max(started - submitted, 0), operation=method, stage='queue_wait')
+        metrics.STAGE_SECONDS.observe(time.time() - started, operation=method, stage='run')
+        for stage, seconds in stage_timings.items():
+            metrics.STAGE_SECONDS.observe(seconds, operation=method, stage=stage)
+        metrics.JOBS_TOTAL.inc(operation=method, outcome='success')
+        return result
+
+    async def _run_chunked_watermark(self, input_path, output_path, watermark_text,
+                                     position='center', opacity=0.3, mode=None, on_progress=None):
+        """
+        Watermark a large document in page slices across worker processes
+
+        Each worker stamps its slice with its own cached overlay, then the
+        slices are stitched back together in page order. Small documents are
+        watermarked in a single job. Progress is reported as the pages of all
+        slices together, then the bytes written by the stitching.
+        """
+        # None lets the worker use its own WATERMARK_MODE
+        mode_kwargs = {} if mode is None else {'mode': mode}
+        info = await self._submit('inspect_pdf', (input_path,), {})
+        pages = info['pages']
+        chunks = min(self.max_workers, pages // WATERMARK_CHUNK_PAGES)
+        if info['encrypted'] or chunks < 2:
+            return await self._submit(
+                'add_watermark', (input_path, output_path, watermark_text, position, opacity),
+                mode_kwargs, on_progress
+            )
+
+        slice_pages = [0] * chunks
+
+        def slice_progress(i):
+            def report(progress):
+                slice_pages[i] = progress.get('pages', slice_pages[i])
+                on_progress({'pages': sum(slice_pages), 'total': pages})
+            return None if on_progress is None else report
+
+        def stitch_progress(progress):
+            on_progress({'pages': pages, 'total': pages, 'bytes': progress.get('bytes', 0)})
+
+        bounds = [pages * i // chunks for i in range(chunks + 1)]
+        parts = [None if output_path is None else f"{output_path}.part{i}" for i in range(chunks)]
+        try:
+            results = await asyncio.gather(*(
+                self._submit('watermark_range', (
+                    input_path, parts[i], watermark_text, position, opacity,
+                    bounds[i], bounds[i + 1]
+                ), mode_kwargs, slice_progress(i))
+                for i in range(chunks)
+            ), return_exceptions=True)
+            # Wait for every slice before cleaning up, then surface the first error
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            # In-memory slices come back as bytes
+            slices = results if output_path is None else parts
+            return await self._submit(
+                'merge_pdfs', (slices, output_path, 0), {},
+                None if on_progress is None else stitch_progress
+            )
+        finally:
+            for part in parts:
+                if part and os.path.exists(part):
+                    os.remove(part)
+
+    def shutdown(self):
+        """Stop the process pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._progress_queue.put(None)  # Stop the progress thread
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from pymongo import ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
+from session_manager import MONGODB_POOL_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+# Shared job queue backend: '' runs jobs inside the bot process,
+# 'mongodb' or 'file' hands them to worker.py processes
+JOB_QUEUE = os.getenv('JOB_QUEUE', '')
+# Directory of the on-disk queue (must be shared by the bot and all workers)
+JOB_QUEUE_DIR = os.getenv('JOB_QUEUE_DIR', 'temp/queue')
+# Seconds a worker owns a claimed job before others may take it over
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 120))
+# Attempts per job before it is given up
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# Prefix of session file references that point to a Telegram file_id
+TELEGRAM_PREFIX = 'telegram://'
+
+
+def telegram_ref(file_id):
+    """Session file reference for a file that stays on Telegram's servers"""
+    return f"{TELEGRAM_PREFIX}{file_id}"
+
+
+def telegram_file_id(ref):
+    """Get the file_id of a Telegram file reference"""
+    return ref[len(TELEGRAM_PREFIX):]
+
+
+def new_job_id():
+    """Time-ordered job ID, so the on-disk queue is served first in, first out"""
+    return f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+
+
+def new_job(operation, user_id, chat_id, message_id, file_ids, **params):
+    """
+    Build a job document
+
+    Args:
+        operation: Operation name, e.g. 'merge'
+        user_id: Telegram user ID
+        chat_id: Chat that receives the result
+        message_id: Status message the worker keeps up to date
+        file_ids: Telegram file_ids of the input files
+        **params: Operation parameters
+
+    Returns:
+        Job dictionary
+    """
+    now = time.time()
+    return {
+        '_id': new_job_id(),
+        'operation': operation,
+        'user_id': user_id,
+        'chat_id': chat_id,
+        'message_id': message_id,
+        'files': list(file_ids),
+        'params': params,
+        'attempts': 0,
+        'created': now,
+        'available_at': now,
+    }
+
+
+class MongoJobQueue:
+    """
+    Job queue in a MongoDB collection, claimed with atomic updates
+
+    Every claim increments the job's attempts, so a worker owns a job while
+    both its ID and the attempt number of its claim still match.
+    """
+
+    def __init__(self, mongodb_uri=None):
+        self.mongodb_uri = mongodb_uri or os.getenv('MONGODB_URI')
+        self.jobs = None
+
+    async def connect(self):
+        """Connect and create the indexes"""
+        if not self.mongodb_uri:
+            raise ValueError("JOB_QUEUE=mongodb needs MONGODB_URI")
+        self.client = AsyncIOMotorClient(self.mongodb_uri, **MONGODB_POOL_OPTIONS)
+        self.jobs = self.client['pdf_bot']['jobs']
+        await self.jobs.create_index([('status', 1), ('available_at', 1)])
+        logger.info("Connected to MongoDB job queue")
+
+    async def enqueue(self, job):
+        await self.jobs.insert_one(dict(job, status='queued'))
+
+    async def claim(self, worker_id, lease=JOB_LEASE_SECONDS):
+        """
+        Take the oldest available job
+
+        Jobs whose lease expired (their worker died) are available again.
+
+        Args:
+            worker_id: ID of the claiming worker
+            lease: Seconds the job stays claimed without renewal
+
+        Returns:
+            Job dictionary, or None if nothing is available
+        """
+        now = time.time()
+        return await self.jobs.find_one_and_update(
+            {'$or': [
+                {'status': 'queued', 'available_at': {'$lte': now}},
+                {'status': 'running', 'lease_until': {'$lt': now}},
+            ]},
+            {
+                '$set': {'status': 'running', 'worker': worker_id, 'lease_until': now + lease},
+                '$inc': {'attempts': 1},
+            },
+            sort=[('available_at', 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def renew(self, job, worker_id, lease=JOB_LEASE_SECONDS):
+        """
+        Extend the lease of a claimed job
+
+        Returns:
+            False if the job was taken over by another worker
+        """
+        result = await self.jobs.update_one(
+            {'_id': job['_id'], 'worker': worker_id, 'attempts': job['attempts'], 'status': 'running'},
+            {'$set': {'lease_until': time.time() + lease}}
+        )
+        return result.matched_count == 1
+
+    async def complete(self, job, worker_id):
+        await self.jobs.delete_one({'_id': job['_id'], 'worker': worker_id, 'attempts': job['attempts']})
+
+    async def retry(self, job, worker_id, delay, error):
+        """Put a claimed job back in the queue after delay seconds"""
+        await self.jobs.update_one(
+            {'_id': job['_id'], 'worker': worker_id, 'attempts': job['attempts']},
+            {
+                '$set': {'status': 'queued', 'available_at': time.time() + delay, 'error': error},
+                '$unset': {'worker': '', 'lease_until': ''},
+            }
+        )
+
+    async def fail(self, job, worker_id, error):
+        """Give up on a job, keeping it for inspection"""
+        await self.jobs.update_one(
+            {'_id': job['_id'], 'worker': worker_id, 'attempts': job['attempts']},
+            {'$set': {'status': 'failed', 'error': error, 'finished': time.time()}}
+        )
+
+
+class FileJobQueue:
+    """
+    Job queue in a shared directory, one JSON file per job
+
+    Claims of a job are numbered lease files (job.lease.000001, 000002, ...).
+    A worker claims a job by creating the next lease file with os.link, which
+    fails if it exists, so only one worker can win each claim, including the
+    takeover of an expired lease. A worker owns a job while no later lease
+    file exists. Releasing a job adds a lease that expired already.
+    """
+
+    def __init__(self, root=JOB_QUEUE_DIR):
+        self.root = root
+        self.failed_dir = os.path.join(root, 'failed')
+
+    async def connect(self):
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def _job_path(self, job_id):
+        return os.path.join(self.root, f"{job_id}.json")
+
+    def _lease_path(self, job_id, generation):
+        return os.path.join(self.root, f"{job_id}.lease.{generation:06d}")
+
+    def _write_json(self, path, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read_json(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def _create_lease(self, job_id, generation, worker_id, until):
+        """
+        Create a lease file, complete or not at all
+
+        Returns:
+            False if another worker created this lease first
+        """
+        lease_path = self._lease_path(job_id, generation)
+        tmp_path = f"{lease_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'worker': worker_id, 'until': until}, f)
+        try:
+            os.link(tmp_path, lease_path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def _lease_generations(self, names):
+        """Latest lease generation of each job, from a directory listing"""
+        generations = {}
+        for name in names:
+            job_id, sep, generation = name.rpartition('.lease.')
+            if sep and generation.isdigit():
+                generations[job_id] = max(generations.get(job_id, 0), int(generation))
+        return generations
+
+    def _owns(self, job, worker_id):
+        generation = job.get('_lease')
+        if not generation:
+            return False
+        try:
+            lease = self._read_json(self._lease_path(job['_id'], generation))
+        except (FileNotFoundError, ValueError):
+            return False
+        return lease['worker'] == worker_id and not os.path.exists(
+            self._lease_path(job['_id'], generation + 1)
+        )
+
+    def _release(self, job):
+        """Let other workers claim the job again"""
+        self._create_lease(job['_id'], job['_lease'] + 1, None, 0)
+
+    def _remove(self, job_id):
+        """Delete a finished job and its lease files"""
+        os.remove(self._job_path(job_id))
+        prefix = f"{job_id}.lease."
+        for name in os.listdir(self.root):
+            if name.startswith(prefix):
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+
+    def _enqueue(self, job):
+        # The lease generation belongs to the claim, not to the job
+        self._write_json(
+            self._job_path(job['_id']), {key: value for key, value in job.items() if key != '_lease'}
+        )
+
+    def _claim(self, worker_id, lease):
+        now = time.time()
+        names = sorted(os.listdir(self.root))
+        generations = self._lease_generations(names)
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-len('.json')]
+            try:
+                if self._read_json(self._job_path(job_id))['available_at'] > now:
+                    continue
+                generation = generations.get(job_id, 0)
+                if generation and self._read_json(self._lease_path(job_id, generation))['until'] >= now:
+                    continue
+            except (FileNotFoundError, ValueError):
+                continue
+            # Fails if another worker claimed it since the listing
+            if not self._create_lease(job_id, generation + 1, worker_id, now + lease):
+                continue
+
+            job = {'_id': job_id, '_lease': generation + 1}
+            try:
+                # Re-read under the lease; the job may have been completed meanwhile
+                job = dict(self._read_json(self._job_path(job_id)), _lease=generation + 1)
+            except FileNotFoundError:
+                self._release(job)
+                continue
+            if not self._owns(job, worker_id):
+                continue
+            job['attempts'] += 1
+            self._enqueue(job)
+            return job
+        return None
+
+    def _renew(self, job, worker_id, lease):
+        if not self._owns(job, worker_id):
+            return False
+        self._write_json(
+            self._lease_path(job['_id'], job['_lease']), {'worker': worker_id, 'until': time.time() + lease}
+        )
+        return True
+
+    def _complete(self, job, worker_id):
+        if self._owns(job, worker_id):
+            self._remove(job['_id'])
+
+    def _retry(self, job, worker_id, delay, error):
+        if self._owns(job, worker_id):
+            self._enqueue(dict(job, available_at=time.time() + delay, error=error))
+            self._release(job)
+
+    def _fail(self, job, worker_id, error):
+        if self._owns(job, worker_id):
+            job = {key: value for key, value in job.items() if key != '_lease'}
+            self._write_json(
+                os.path.join(self.failed_dir, f"{job['_id']}.json"), dict(job, error=error, finished=time.time())
+            )
+            self._remove(job['_id'])
+
+    async def enqueue(self, job):
+        await asyncio.to_thread(self._enqueue, job)
+
+    async def claim(self, worker_id, lease=JOB_LEASE_SECONDS):
+        return await asyncio.to_thread(self._claim, worker_id, lease)
+
+    async def renew(self, job, worker_id, lease=JOB_LEASE_SECONDS):
+        return await asyncio.to_thread(self._renew, job, worker_id, lease)
+
+    async def complete(self, job, worker_id):
+        await asyncio.to_thread(self._complete, job, worker_id)
+
+    async def retry(self, job, worker_id, delay, error):
+        await asyncio.to_thread(self._retry, job, worker_id, delay, error)
+
+    async def fail(self, job, worker_id, error):
+        await asyncio.to_thread(self._fail, job, worker_id, error)
+
+
+def create_job_queue(backend=JOB_QUEUE):
+    """
+    Create the configured job queue
+
+    Args:
+        backend: '', 'mongodb' or 'file'
+
+    Returns:
+        Job queue, or None when jobs run inside the bot process
+    """
+    if not backend:
+        return None
+    if backend == 'mongodb':
+        return MongoJobQueue()
+    if backend == 'file':
+        return FileJobQueue()
+    raise ValueError(f"Unknown JOB_QUEUE backend: {backend}")
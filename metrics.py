@@ -0,0 +1,209 @@
+import time
+import functools
+from contextlib import contextmanager
+
+# Default histogram buckets in seconds
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Histogram buckets for file sizes in bytes
+SIZE_BUCKETS = tuple(2 ** n * 1024 for n in range(0, 20, 2))  # 1 KB .. 256 MB
+# Histogram buckets for page counts
+PAGE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing counter with labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge:
+    """Value that can go up and down, with labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        self.values[key] = value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for key, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Histogram with cumulative buckets, sum and count per label set"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {bucket_count}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    'pdfbot_handler_seconds', 'Time spent in Telegram handlers', ['handler', 'outcome']
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'pdfbot_stage_seconds',
+    'Time spent per processing stage (download, queue_wait, parse, write, run, upload)',
+    ['operation', 'stage']
+))
+JOBS_TOTAL = REGISTRY.register(Counter(
+    'pdfbot_jobs_total', 'PDF jobs by outcome', ['operation', 'outcome']
+))
+FILE_BYTES = REGISTRY.register(Histogram(
+    'pdfbot_file_bytes', 'Size of downloaded and sent files', ['operation', 'direction'],
+    buckets=SIZE_BUCKETS
+))
+DOCUMENT_PAGES = REGISTRY.register(Histogram(
+    'pdfbot_document_pages', 'Pages per uploaded document', ['operation'], buckets=PAGE_BUCKETS
+))
+DOWNLOAD_CACHE_TOTAL = REGISTRY.register(Counter(
+    'pdfbot_download_cache_total', 'Download cache lookups', ['result']
+))
+RESULT_CACHE_TOTAL = REGISTRY.register(Counter(
+    'pdfbot_result_cache_total', 'Result cache lookups', ['operation', 'result']
+))
+SESSION_STORE_SECONDS = REGISTRY.register(Histogram(
+    'pdfbot_session_store_seconds', 'Latency of session store calls', ['method']
+))
+WEBHOOK_UPDATES_TOTAL = REGISTRY.register(Counter(
+    'pdfbot_webhook_updates_total', 'Webhook updates by result (accepted, shed, defer)', ['result']
+))
+WEBHOOK_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'pdfbot_webhook_queue_depth', 'Webhook updates accepted but not yet processed'
+))
+
+
+def instrument_handler(name, handler):
+    """
+    Wrap a Telegram handler to record its duration and outcome
+
+    Args:
+        name: Handler label
+        handler: Async handler function
+
+    Returns:
+        Wrapped async handler
+    """
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = 'success'
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name, outcome=outcome)
+    return wrapper
+
+
+def instrument_session_manager(manager, methods):
+    """
+    Record the latency of session store coroutines on a manager instance
+
+    Args:
+        manager: AsyncSessionManager instance
+        methods: Names of the coroutine methods to wrap
+    """
+    for method in methods:
+        original = getattr(manager, method)
+
+        def make_wrapper(method, original):
+            @functools.wraps(original)
+            async def wrapper(*args, **kwargs):
+                with SESSION_STORE_SECONDS.time(method=method):
+                    return await original(*args, **kwargs)
+            return wrapper
+
+        setattr(manager, method, make_wrapper(method, original))
@@ -0,0 +1,155 @@
+import os
+import socket
+import asyncio
+import logging
+from job_executor import JobExecutorBusy
+from job_queue import JOB_MAX_ATTEMPTS
+from session_manager import OPERATION_LEASE_SECONDS
+from telegram_files import sent_files
+
+logger = logging.getLogger(__name__)
+
+
+class OperationTracker:
+    """
+    Persistent records of the operations the bot runs itself
+
+    Each operation is recorded under the idempotency key of the update that
+    started it before any work is done, and marked done with the file_ids of
+    its results, which also go to the result cache. The record holds the
+    input file_ids and parameters, so when
+    a process dies mid-operation its lease runs out and another sweep (in
+    this or any other bot process) runs the operation again from the record.
+    An operation whose lease is lost is cancelled here, so only its new
+    owner sends a result.
+    """
+
+    def __init__(self, sessions, results, owner=None):
+        self.sessions = sessions
+        self.results = results
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._running = {}  # Key -> (result cache key, task running it) of the operations this process owns
+        self._resumed = set()  # Tasks of the resumed operations
+
+    async def begin(self, job):
+        """
+        Record an operation before running it
+
+        The calling task is taken to run the operation, and is cancelled if
+        the operation's lease is lost.
+
+        Args:
+            job: Job dictionary whose _id is the idempotency key, with the
+                 cache_key of its result
+
+        Returns:
+            None if the operation should run, or the existing record if the
+            same update started it before
+        """
+        existing = await self.sessions.begin_operation(job, self.owner)
+        if existing is None:
+            self._running[job['_id']] = (job.get('cache_key'), asyncio.current_task())
+        return existing
+
+    async def finish(self, key, messages=(), status='done', cached=False):
+        """
+        Mark an operation as finished
+
+        Args:
+            key: Idempotency key
+            messages: Sent result Messages, kept so the result can be sent again
+            status: 'done', or 'queued' when a queue worker took it over
+            cached: The result was sent again from the result cache, which
+                    must not store it a second time
+        """
+        cache_key, _ = self._running.pop(key, (None, None))
+        files = sent_files(messages)
+        await self.sessions.finish_operation(key, self.owner, status, files)
+        if not cached:
+            await self.results.put(cache_key, files)
+
+    async def abandon(self, key):
+        """Forget an operation that failed; does nothing once it finished"""
+        if key in self._running:
+            del self._running[key]
+            await self.sessions.abandon_operation(key, self.owner)
+
+    async def renew_loop(self, interval=OPERATION_LEASE_SECONDS / 3):
+        """Renew the leases of this process's operations until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            for key in list(self._running):
+                try:
+                    if not await self.sessions.renew_operation(key, self.owner):
+                        # Another process resumes it; stop this run before it sends a result
+                        logger.warning(f"Lost the lease of operation {key}, cancelling it")
+                        _, task = self._running.pop(key, (None, None))
+                        if task is not None:
+                            task.cancel()
+                except Exception as e:
+                    logger.error(f"Error renewing operation {key}: {e}")
+
+    async def resume_loop(self, runner, interval=OPERATION_LEASE_SECONDS):
+        """
+        Resume interrupted operations every interval seconds until cancelled
+
+        The first sweep waits one interval, so the leases of operations that
+        were running when the previous process stopped have run out. When
+        cancelled, the resumed operations are cancelled too and left to the
+        next process.
+
+        Args:
+            runner: worker.QueueWorker used to run the operations
+            interval: Seconds between sweeps
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    while True:
+                        record = await self.sessions.claim_interrupted_operation(self.owner)
+                        if record is None:
+                            break
+                        task = asyncio.create_task(self._resume(runner, record))
+                        self._running[record['_id']] = (record.get('cache_key'), task)
+                        self._resumed.add(task)
+                        task.add_done_callback(self._resumed.discard)
+                except Exception as e:
+                    logger.error(f"Error resuming operations: {e}")
+        finally:
+            # Their leases run out and another process resumes them
+            tasks = list(self._resumed)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _resume(self, runner, record):
+        key = record['_id']
+        if record['resumes'] > JOB_MAX_ATTEMPTS:
+            # Every process that tried it died
+            logger.error(f"Giving up on operation {key} after {record['resumes'] - 1} resumes")
+            await self.abandon(key)
+            await runner.notify(record, "❌ This operation could not be completed. Please try again.")
+            return
+
+        logger.info(f"Resuming {record['operation']} operation {key}")
+        # The session still points at the inputs of the interrupted run
+        session = await self.sessions.get_session(record['user_id'])
+        if session.get('operation') == key:
+            await self.sessions.clear_session(record['user_id'])
+        await runner.notify(record, "🔄 Resuming your operation after a restart...")
+
+        try:
+            messages = await runner.process(record)
+        except JobExecutorBusy:
+            # Stop renewing; a later sweep takes it over again, and this
+            # claim does not count as a resume
+            self._running.pop(key, None)
+            await self.sessions.release_operation(key, self.owner)
+            return
+        except Exception as e:
+            logger.error(f"Resumed operation {key} failed: {e}")
+            await self.abandon(key)
+            await runner.notify(record, "❌ An error occurred while processing your files. Please try again.")
+            return
+        await self.finish(key, messages)
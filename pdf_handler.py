@@ -1,31 +1,469 @@
+import os
+import gc
+import mmap
+import time
 import shutil
+from collections import OrderedDict
+from contextlib import contextmanager
 from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject
+)
+from pdf_optimizer import PDF_OPTIMIZE, optimize_writer
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.colors import Color
 from io import BytesIO
 import math
 
+# Watermark font settings
+WATERMARK_FONT = "Helvetica-Bold"
+WATERMARK_FONT_SIZE = 50
+
+# 'merge' merges the overlay into every page's content stream,
+# 'stamp' adds it once as a Form XObject that every page references
+WATERMARK_MODE = os.getenv('WATERMARK_MODE', 'merge')
+if WATERMARK_MODE not in ('merge', 'stamp'):
+    raise ValueError(f"WATERMARK_MODE must be 'merge' or 'stamp', not '{WATERMARK_MODE}'")
+
+# Maximum number of watermark overlays kept in memory per process
+WATERMARK_CACHE_SIZE = int(os.getenv('WATERMARK_CACHE_SIZE', 64))
+
+# Overlay cache shared by all PDFHandler instances in this process
+_overlay_cache = OrderedDict()
+
+# Maximum total input size for a merge in bytes (0 = no limit). The merged
+# document is held in memory, so a merge peaks at about its input size plus
+# ~55 MB; the default admits ten 20 MB scans in a 512 MB container
+MERGE_MEMORY_LIMIT = int(os.getenv('MERGE_MEMORY_LIMIT_MB', 200)) * 1024 * 1024
+
+# Maximum number of files one split may produce
+SPLIT_MAX_PARTS = int(os.getenv('SPLIT_MAX_PARTS', 50))
+
+
+class PDFMemoryLimitError(Exception):
+    """Raised when an operation would exceed the configured memory ceiling"""
+
+
+class PageRangeError(ValueError):
+    """Raised for page ranges that are malformed or outside the document"""
+
+
+def parse_page_ranges(text):
+    """
+    Parse page ranges like "1-3,5,10-"
+    
+    Args:
+        text: Comma-separated pages or ranges, 1-based and inclusive;
+              an open end means "to the last page"
+    
+    Returns:
+        List of (start, end) tuples, end None for the last page
+    
+    Raises:
+        PageRangeError: If the text is not a valid range list
+    """
+    ranges = []
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        start, sep, end = part.partition('-')
+        try:
+            start = int(start) if start else 1
+            end = (int(end) if end else None) if sep else start
+        except ValueError:
+            raise PageRangeError(f"'{part}' is not a page or page range")
+        if start < 1 or (end is not None and end < start):
+            raise PageRangeError(f"'{part}' is not a valid page range")
+        ranges.append((start, end))
+    if not ranges:
+        raise PageRangeError("No pages given")
+    return ranges
+
+
+def parse_split_spec(spec):
+    """
+    Parse how to split a PDF
+    
+    Accepts "every 5" for parts of 5 pages, "10MB" for parts of at most
+    10 MB, or page ranges with one part per ';'-separated group, like
+    "1-3; 4-10; 11-" (a single group such as "2,5,7" or "5" extracts those
+    pages).
+    
+    Args:
+        spec: Split spec text
+    
+    Returns:
+        Keyword arguments for PDFHandler.split_pdf
+    
+    Raises:
+        PageRangeError: If the spec is malformed
+    """
+    text = spec.strip().lower().replace(' ', '')
+    if text.startswith('every'):
+        text = text[len('every'):]
+        if not text.isdigit():
+            raise PageRangeError("Say how many pages per part, e.g. every 5")
+        if int(text) < 1:
+            raise PageRangeError("Parts need at least one page")
+        return {'every': int(text)}
+    
+    if text.endswith('mb') or text.endswith('kb'):
+        try:
+            amount = float(text[:-2])
+        except ValueError:
+            raise PageRangeError(f"'{spec}' is not a size, e.g. 10MB")
+        unit = 1024 * 1024 if text.endswith('mb') else 1024
+        if amount <= 0:
+            raise PageRangeError("The size must be greater than zero")
+        return {'max_bytes': int(amount * unit)}
+    
+    groups = [parse_page_ranges(group) for group in spec.split(';') if group.strip()]
+    if not groups:
+        raise PageRangeError("No pages given")
+    return {'page_ranges': groups}
+
+
+def _range_indices(ranges, page_count):
+    """
+    Resolve 1-based page ranges into 0-based page indices
+    
+    Raises:
+        PageRangeError: If a range starts after the last page
+    """
+    indices = []
+    for start, end in ranges:
+        if start > page_count:
+            raise PageRangeError(
+                f"Page {start} requested, but the document has {page_count} pages"
+            )
+        indices.extend(range(start - 1, min(end or page_count, page_count)))
+    return indices
+
+
+def parse_merge_spec(spec, file_names):
+    """
+    Parse a merge spec like "a.pdf:1-3,b.pdf:10-" or "1:1-3,2:10-"
+    
+    Files are named by upload number or file name. The output follows the
+    order of the spec; files it does not mention are left out, and a file
+    may appear more than once.
+    
+    Args:
+        spec: Merge spec text
+        file_names: Names of the uploaded files, in upload order
+    
+    Returns:
+        List of (file index, page ranges) tuples
+    
+    Raises:
+        PageRangeError: If the spec is malformed or names an unknown file
+    """
+    entries = []
+    for part in spec.replace(';', ',').replace('\n', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if ':' in part:
+            name, _, part = part.rpartition(':')
+            name = name.strip()
+            if name.isdigit() and 1 <= int(name) <= len(file_names):
+                index = int(name) - 1
+            elif name in file_names:
+                index = file_names.index(name)
+            else:
+                raise PageRangeError(f"There is no uploaded file '{name}'")
+            entries.append((index, []))
+        elif not entries:
+            raise PageRangeError("Start with a file, e.g. 1:1-3")
+        entries[-1][1].extend(parse_page_ranges(part))
+    
+    for index, ranges in entries:
+        if not ranges:
+            raise PageRangeError(f"No pages given for file {index + 1}")
+    if not entries:
+        raise PageRangeError("No files given")
+    return entries
+
+
+class _MappedPDF:
+    """Read-only memory map (or buffer) of a PDF file and its parsed reader"""
+    
+    def __init__(self, pdf_file):
+        self.file = None
+        self.data = None
+        try:
+            if _is_buffer(pdf_file):
+                self.data = BytesIO(pdf_file)
+            else:
+                self.file = open(pdf_file, 'rb')
+                if os.fstat(self.file.fileno()).st_size == 0:
+                    # Empty files cannot be mapped; let PdfReader report the error
+                    self.data = self.file
+                else:
+                    self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.reader = PdfReader(self.data)
+        except Exception:
+            self.close()
+            raise
+    
+    def close(self):
+        self.reader = None
+        if self.data is not None and self.data is not self.file:
+            self.data.close()
+        if self.file is not None:
+            self.file.close()
+
+
+def _is_buffer(pdf_file):
+    """Return True if pdf_file holds PDF data instead of a path"""
+    return isinstance(pdf_file, (bytes, bytearray, memoryview))
+
+
+def _input_size(pdf_file):
+    return len(pdf_file) if _is_buffer(pdf_file) else os.path.getsize(pdf_file)
+
+
+class _ProgressStream:
+    """Output stream wrapper that reports the number of bytes written"""
+    
+    def __init__(self, stream, progress):
+        self.stream = stream
+        self.progress = progress
+        self.written = 0
+    
+    def write(self, data):
+        self.stream.write(data)
+        self.written += len(data)
+        self.progress(bytes=self.written)
+    
+    def tell(self):
+        return self.stream.tell()
+
+
+def _write_output(writer, output_path, progress=None):
+    """
+    Write a PdfWriter to a file, or to memory if no path is given
+    
+    Args:
+        writer: PdfWriter to write
+        output_path: Output file path (None = return bytes)
+        progress: Optional callback, called with bytes= as the output grows
+    
+    Returns:
+        PDF bytes when output_path is None, otherwise None
+    """
+    if output_path is None:
+        buffer = BytesIO()
+        writer.write(buffer if progress is None else _ProgressStream(buffer, progress))
+        return buffer.getvalue()
+    
+    with open(output_path, 'wb') as output_file:
+        writer.write(output_file if progress is None else _ProgressStream(output_file, progress))
+
+
 class PDFHandler:
     """Handle all PDF operations"""
     
-    def merge_pdfs(self, pdf_files, output_path):
+    def __init__(self, optimize=PDF_OPTIMIZE):
+        self.stage_timings = {}  # Seconds spent per stage since last reset
+        self.optimize = optimize  # Output optimization level (see PDF_OPTIMIZE)
+        # Optional callback receiving pages=, total= and bytes= as work proceeds;
+        # it may raise to abort the operation
+        self.progress = None
+        self.pages_done = 0  # Pages processed since last reset
+    
+    @contextmanager
+    def _stage(self, name):
+        """Add the duration of a with-block to stage_timings"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_timings[name] = self.stage_timings.get(name, 0) + time.perf_counter() - start
+    
+    def _page_done(self, total=None):
+        """Count a processed page and report it to the progress callback"""
+        self.pages_done += 1
+        if self.progress is not None:
+            self.progress(pages=self.pages_done, total=total)
+    
+    def merge_pdfs(self, pdf_files, output_path, memory_limit=MERGE_MEMORY_LIMIT,
+                   page_ranges=None):
         """
         Merge multiple PDF files into one
         
+        Inputs are memory-mapped and opened one at a time. Each reader is
+        released as soon as its pages have been copied into the writer, so
+        only the merged result is held on the heap.
+        
         Args:
-            pdf_files: List of PDF file paths to merge
-            output_path: Output file path for merged PDF
+            pdf_files: List of PDF file paths or PDF bytes to merge
+            output_path: Output file path for merged PDF (None = return bytes)
+            memory_limit: Maximum total input size in bytes (0 = no limit)
+            page_ranges: Optional list with the pages to take from each input,
+                         as (start, end) tuples or None for all pages
+        
+        Returns:
+            Merged PDF bytes if output_path is None
+        
+        Raises:
+            PDFMemoryLimitError: If the inputs exceed memory_limit
+            PageRangeError: If a range lies outside its document
         """
+        total_size = sum(_input_size(pdf_file) for pdf_file in pdf_files)
+        if memory_limit and total_size > memory_limit:
+            raise PDFMemoryLimitError(
+                f"Merge input is {total_size} bytes, limit is {memory_limit} bytes"
+            )
+        
         writer = PdfWriter()
         
-        for pdf_file in pdf_files:
-            reader = PdfReader(pdf_file)
-            for page in reader.pages:
-                writer.add_page(page)
+        with self._stage('parse'):
+            for i, pdf_file in enumerate(pdf_files):
+                self._append_pages(writer, pdf_file, page_ranges[i] if page_ranges else None)
+                # Break reader reference cycles before opening the next input
+                gc.collect()
         
-        with open(output_path, 'wb') as output_file:
-            writer.write(output_file)
+        with self._stage('optimize'):
+            optimize_writer(writer, self.optimize)
+        
+        with self._stage('write'):
+            return _write_output(writer, output_path, self.progress)
+    
+    def _append_pages(self, writer, pdf_file, ranges=None):
+        """
+        Copy pages of a PDF file into a writer
+        
+        Page objects are resolved on access, so pages outside the ranges are
+        never parsed or copied.
+        
+        Args:
+            writer: PdfWriter receiving the pages
+            pdf_file: PDF file path or PDF bytes to read
+            ranges: List of 1-based (start, end) tuples (None = all pages)
+        """
+        mapped = _MappedPDF(pdf_file)
+        try:
+            pages = mapped.reader.pages
+            indices = range(len(pages)) if ranges is None else _range_indices(ranges, len(pages))
+            for index in indices:
+                # add_page clones the page, so nothing keeps the map alive
+                writer.add_page(pages[index])
+                self._page_done()
+        finally:
+            # The writer maps cloned objects by id(reader); drop this reader's
+            # map so a later input that gets the same id is cloned afresh
+            writer.reset_translation(mapped.reader)
+            mapped.close()
+    
+    def inspect_pdf(self, pdf_file):
+        """
+        Check that a PDF file can be read and count its pages
+        
+        Args:
+            pdf_file: PDF file path or PDF bytes to inspect
+        
+        Returns:
+            Dictionary with 'pages' (int) and 'encrypted' (bool)
+        """
+        mapped = _MappedPDF(pdf_file)
+        try:
+            if mapped.reader.is_encrypted:
+                return {'pages': 0, 'encrypted': True}
+            
+            # Walk the page tree so broken files fail now, not during the merge
+            for page in mapped.reader.pages:
+                page.mediabox
+            return {'pages': len(mapped.reader.pages), 'encrypted': False}
+        finally:
+            mapped.close()
+    
+    def split_pdf(self, input_path, output_dir, page_ranges=None, every=None, max_bytes=None):
+        """
+        Split a PDF into several files
+        
+        The source is parsed once and every part is cloned from the same
+        reader, so objects shared between parts (fonts, images) are read
+        only once. Parts are written one after another.
+        
+        Args:
+            input_path: Input PDF file path or PDF bytes
+            output_dir: Directory for the parts (None = return bytes)
+            page_ranges: List of page range lists, one part per list
+            every: Number of pages per part
+            max_bytes: Maximum size of a part in bytes (single pages may exceed it)
+        
+        Returns:
+            List of part file paths, or of PDF bytes if output_dir is None
+        
+        Raises:
+            PageRangeError: If a range lies outside the document or the split
+                            would produce more than SPLIT_MAX_PARTS files;
+                            no part is kept then
+        """
+        with self._stage('parse'):
+            mapped = _MappedPDF(input_path)
+        try:
+            pages = mapped.reader.pages
+            page_count = len(pages)
+            
+            if page_ranges:
+                groups = [_range_indices(ranges, page_count) for ranges in page_ranges]
+            else:
+                if max_bytes:
+                    # Start from the average page size; parts that still come
+                    # out too large are halved below
+                    page_bytes = max(_input_size(input_path) / max(page_count, 1), 1)
+                    every = max(int(max_bytes * 0.9 // page_bytes), 1)
+                every = every or page_count
+                groups = [list(range(i, min(i + every, page_count)))
+                          for i in range(0, page_count, every)]
+            if len(groups) > SPLIT_MAX_PARTS:
+                raise PageRangeError(f"This would create more than {SPLIT_MAX_PARTS} files")
+            
+            # Parts over the size budget are written again in halves
+            total = None if max_bytes else sum(len(group) for group in groups)
+            written = 0
+            outputs = []
+            groups.reverse()  # Used as a stack, first part on top
+            while groups:
+                group = groups.pop()
+                if len(outputs) + 1 > SPLIT_MAX_PARTS:
+                    # Only parts halved to fit max_bytes get here
+                    if output_dir is not None:
+                        for part_path in outputs:
+                            os.remove(part_path)
+                    raise PageRangeError(f"This would create more than {SPLIT_MAX_PARTS} files")
+                
+                writer = PdfWriter()
+                with self._stage('stamp'):
+                    for index in group:
+                        writer.add_page(pages[index])
+                        self._page_done(total)
+                with self._stage('optimize'):
+                    optimize_writer(writer, self.optimize)
+                with self._stage('write'):
+                    data = _write_output(writer, None)
+                
+                if max_bytes and len(data) > max_bytes and len(group) > 1:
+                    half = len(group) // 2
+                    groups.extend([group[half:], group[:half]])
+                    continue
+                
+                written += len(data)
+                if self.progress is not None:
+                    self.progress(bytes=written)
+                if output_dir is None:
+                    outputs.append(data)
+                else:
+                    part_path = os.path.join(output_dir, f"part_{len(outputs) + 1:02d}.pdf")
+                    with open(part_path, 'wb') as part_file:
+                        part_file.write(data)
+                    outputs.append(part_path)
+            return outputs
+        finally:
+            mapped.close()
     
     def rename_pdf(self, input_path, output_path):
         """
@@ -37,38 +475,181 @@ class PDFHandler:
         """
         shutil.copy2(input_path, output_path)
     
-    def add_watermark(self, input_path, output_path, watermark_text, position='center', opacity=0.3):
+    def add_watermark(self, input_path, output_path, watermark_text, position='center', opacity=0.3,
+                      mode=WATERMARK_MODE):
         """
         Add text watermark to all pages of a PDF
         
         Args:
-            input_path: Input PDF file path
-            output_path: Output PDF file path
+            input_path: Input PDF file path or PDF bytes
+            output_path: Output PDF file path (None = return bytes)
             watermark_text: Text to use as watermark
             position: Watermark position ('center', 'top', 'bottom', 'diagonal')
             opacity: Watermark opacity (0.0 to 1.0)
+            mode: 'merge' or 'stamp' (see WATERMARK_MODE)
+        
+        Returns:
+            Watermarked PDF bytes if output_path is None
+        """
+        return self.watermark_range(
+            input_path, output_path, watermark_text, position, opacity, mode=mode
+        )
+    
+    def watermark_range(self, input_path, output_path, watermark_text, position='center',
+                        opacity=0.3, start=0, end=None, mode=WATERMARK_MODE):
         """
-        reader = PdfReader(input_path)
+        Add text watermark to a slice of the pages of a PDF
+        
+        Used directly for whole documents and by the job executor to
+        watermark large documents in parallel, one slice per worker.
+        
+        Args:
+            input_path: Input PDF file path or PDF bytes
+            output_path: Output PDF file path (None = return bytes)
+            watermark_text: Text to use as watermark
+            position: Watermark position ('center', 'top', 'bottom', 'diagonal')
+            opacity: Watermark opacity (0.0 to 1.0)
+            start: Index of the first page to include
+            end: Index after the last page to include (None = last page)
+            mode: 'merge' or 'stamp' (see WATERMARK_MODE)
+        
+        Returns:
+            Watermarked PDF bytes if output_path is None
+        
+        Raises:
+            ValueError: If mode is not 'merge' or 'stamp'
+        """
+        if mode not in ('merge', 'stamp'):
+            raise ValueError(f"Unknown watermark mode '{mode}'")
+        with self._stage('parse'):
+            reader = PdfReader(BytesIO(input_path) if _is_buffer(input_path) else input_path)
         writer = PdfWriter()
+        stamps = {}  # Form XObjects already added to this writer
         
-        for page in reader.pages:
-            # Create watermark
-            watermark = self._create_watermark(
-                watermark_text, 
-                position, 
-                opacity,
-                float(page.mediabox.width),
-                float(page.mediabox.height)
-            )
+        with self._stage('stamp'):
+            pages = reader.pages[start:end]
+            for page in pages:
+                # Get watermark for this page size
+                watermark = self._get_watermark(
+                    watermark_text, 
+                    position, 
+                    opacity,
+                    float(page.mediabox.width),
+                    float(page.mediabox.height)
+                )
+                
+                if mode == 'stamp':
+                    # Reference one shared XObject instead of copying the overlay
+                    page = writer.add_page(page)
+                    key = (float(page.mediabox.width), float(page.mediabox.height))
+                    self._stamp_page(writer, page, watermark.pages[0], key, stamps)
+                else:
+                    # Merge watermark with page
+                    page.merge_page(watermark.pages[0])
+                    writer.add_page(page)
+                self._page_done(len(pages))
+        
+        with self._stage('optimize'):
+            optimize_writer(writer, self.optimize)
+        
+        with self._stage('write'):
+            return _write_output(writer, output_path, self.progress)
+    
+    def _stamp_page(self, writer, page, overlay, key, stamps):
+        """
+        Draw an overlay on a writer page through a shared Form XObject
+        
+        The overlay's content and resources (font, transparency) are added to
+        the writer once per overlay; each page only gets a resource entry and
+        a few bytes of content that paint it with the 'Do' operator.
+        
+        Args:
+            writer: PdfWriter owning the page
+            page: Page already added to the writer
+            overlay: Watermark page to draw
+            key: Hashable identifying the overlay within this writer
+            stamps: Dictionary of XObjects added to this writer so far
+        """
+        if key not in stamps:
+            form = DecodedStreamObject()
+            form.set_data(overlay.get_contents().get_data())
+            # flate_encode returns a bare stream, so set the keys afterwards
+            form = form.flate_encode()
+            form.update({
+                NameObject('/Type'): NameObject('/XObject'),
+                NameObject('/Subtype'): NameObject('/Form'),
+                NameObject('/BBox'): ArrayObject(overlay.mediabox),
+                NameObject('/Resources'): overlay['/Resources'].get_object().clone(writer),
+            })
+            name = NameObject(f'/PdfBotWm{len(stamps)}')
+            stamps[key] = (name, writer._add_object(form))
             
-            # Merge watermark with page
-            page.merge_page(watermark.pages[0])
-            writer.add_page(page)
+            if 'open' not in stamps:
+                # Isolate the page's own graphics state from the stamp
+                save = DecodedStreamObject()
+                save.set_data(b'q\n')
+                stamps['open'] = writer._add_object(save)
+        name, form_ref = stamps[key]
+        
+        if '/Resources' not in page:
+            page[NameObject('/Resources')] = DictionaryObject()
+        resources = page['/Resources']
+        if '/XObject' not in resources:
+            resources[NameObject('/XObject')] = DictionaryObject()
+        resources['/XObject'][name] = form_ref
+        
+        # Overlays are drawn from (0, 0); follow the page's mediabox origin
+        left, bottom = float(page.mediabox.left), float(page.mediabox.bottom)
+        paint_key = (name, left, bottom)
+        if paint_key not in stamps:
+            paint = DecodedStreamObject()
+            paint.set_data(f'\nQ q 1 0 0 1 {left:g} {bottom:g} cm {name} Do Q\n'.encode())
+            stamps[paint_key] = writer._add_object(paint)
+        
+        contents = page.raw_get('/Contents') if '/Contents' in page else None
+        if contents is None:
+            parts = []
+        elif isinstance(contents.get_object(), ArrayObject):
+            parts = list(contents.get_object())
+        elif isinstance(contents, IndirectObject):
+            parts = [contents]
+        else:
+            parts = [writer._add_object(contents)]
+        page[NameObject('/Contents')] = ArrayObject([stamps['open']] + parts + [stamps[paint_key]])
+    
+    def _get_watermark(self, text, position, opacity, page_width, page_height,
+                       font=WATERMARK_FONT, font_size=WATERMARK_FONT_SIZE):
+        """
+        Get a watermark PDF from the overlay cache, creating it if needed
+        
+        Args:
+            text: Watermark text
+            position: Position of watermark
+            opacity: Opacity value
+            page_width: Width of the page
+            page_height: Height of the page
+            font: Font name
+            font_size: Font size
+        
+        Returns:
+            PdfReader object with watermark
+        """
+        key = (text, position, opacity, page_width, page_height, font, font_size)
+        watermark = _overlay_cache.get(key)
+        if watermark is not None:
+            _overlay_cache.move_to_end(key)
+            return watermark
         
-        with open(output_path, 'wb') as output_file:
-            writer.write(output_file)
+        watermark = self._create_watermark(
+            text, position, opacity, page_width, page_height, font, font_size
+        )
+        _overlay_cache[key] = watermark
+        if len(_overlay_cache) > WATERMARK_CACHE_SIZE:
+            _overlay_cache.popitem(last=False)
+        return watermark
     
-    def _create_watermark(self, text, position, opacity, page_width, page_height):
+    def _create_watermark(self, text, position, opacity, page_width, page_height,
+                          font=WATERMARK_FONT, font_size=WATERMARK_FONT_SIZE):
         """
         Create a watermark PDF
         
@@ -78,6 +659,8 @@ class PDFHandler:
             opacity: Opacity value
             page_width: Width of the page
             page_height: Height of the page
+            font: Font name
+            font_size: Font size
         
         Returns:
             PdfReader object with watermark
@@ -86,14 +669,13 @@ class PDFHandler:
         c = canvas.Canvas(packet, pagesize=(page_width, page_height))
         
         # Set font and size
-        font_size = 50
-        c.setFont("Helvetica-Bold", font_size)
+        c.setFont(font, font_size)
         
         # Set color with opacity
         c.setFillColor(Color(0.5, 0.5, 0.5, alpha=opacity))
         
         # Calculate text dimensions
-        text_width = c.stringWidth(text, "Helvetica-Bold", font_size)
+        text_width = c.stringWidth(text, font, font_size)
         
         # Position watermark based on user selection
         if position == 'center':
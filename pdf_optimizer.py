@@ -0,0 +1,182 @@
+import os
+import zlib
+import hashlib
+import logging
+from io import BytesIO
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, EncodedStreamObject, IndirectObject,
+    NameObject, NullObject, StreamObject
+)
+
+logger = logging.getLogger(__name__)
+
+# Optimization applied to merge and watermark output:
+# 'off', 'fast' (compress streams, drop unreferenced objects)
+# or 'full' (also deduplicate identical objects, strongest compression)
+PDF_OPTIMIZE = os.getenv('PDF_OPTIMIZE', 'off')
+OPTIMIZE_LEVELS = ('off', 'fast', 'full')
+if PDF_OPTIMIZE not in OPTIMIZE_LEVELS:
+    raise ValueError(f"PDF_OPTIMIZE must be 'off', 'fast' or 'full', not '{PDF_OPTIMIZE}'")
+
+# zlib level per optimization level
+COMPRESSION_LEVELS = {'fast': 1, 'full': 9}
+# Passes of deduplication; each pass can merge the parents of objects
+# merged by the previous one (e.g. fonts whose font files were identical)
+DEDUP_PASSES = 4
+
+
+def _children(obj):
+    """Direct child objects of a dictionary, array or stream"""
+    if isinstance(obj, DictionaryObject):
+        return obj.values()
+    if isinstance(obj, ArrayObject):
+        return obj
+    return ()
+
+
+def _walk_references(writer, obj):
+    """Yield every indirect reference into the writer below obj"""
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        for child in _children(obj):
+            if isinstance(child, IndirectObject):
+                if child.pdf is writer:
+                    yield child
+            else:
+                stack.append(child)
+
+
+def _reachable(writer):
+    """Object numbers reachable from the trailer of the writer"""
+    # The catalog is only added as an object when the writer is written
+    stack = [ref.idnum for ref in _walk_references(writer, writer._root_object)]
+    for ref in (writer._root, writer._info):
+        if ref is not None and ref.pdf is writer:
+            stack.append(ref.idnum)
+    seen = set()
+    while stack:
+        idnum = stack.pop()
+        if idnum in seen or not 0 < idnum <= len(writer._objects):
+            continue
+        seen.add(idnum)
+        obj = writer._objects[idnum - 1]
+        stack.extend(ref.idnum for ref in _walk_references(writer, obj))
+    return seen
+
+
+def _compress_streams(writer, level):
+    """Flate-compress streams that were written without a filter"""
+    saved = 0
+    for i, obj in enumerate(writer._objects):
+        if not isinstance(obj, StreamObject) or '/Filter' in obj:
+            continue
+        data = obj.get_data()
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        compressed = zlib.compress(data, level)
+        if len(compressed) >= len(data):
+            continue
+        encoded = EncodedStreamObject()
+        for key, value in obj.items():
+            if key != '/Length':
+                encoded[key] = value
+        encoded[NameObject('/Filter')] = NameObject('/FlateDecode')
+        encoded._data = compressed
+        writer._objects[i] = encoded
+        saved += len(data) - len(compressed)
+    return saved
+
+
+def _fingerprint(obj):
+    """Digest of an object's serialized form, references included"""
+    buffer = BytesIO()
+    obj.write_to_stream(buffer, None)
+    return hashlib.sha256(buffer.getvalue()).digest()
+
+
+def _is_page_tree(obj):
+    # Pages must stay distinct objects, even when their content is identical
+    return isinstance(obj, DictionaryObject) and obj.get('/Type') in ('/Page', '/Pages')
+
+
+def _replace_references(writer, obj, mapping):
+    """Point references in obj at their replacement object numbers"""
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, DictionaryObject):
+            items = obj.items()
+        elif isinstance(obj, ArrayObject):
+            items = enumerate(obj)
+        else:
+            continue
+        for key, child in list(items):
+            if isinstance(child, IndirectObject):
+                if child.pdf is writer and child.idnum in mapping:
+                    obj[key] = IndirectObject(mapping[child.idnum], 0, writer)
+            else:
+                stack.append(child)
+
+
+def _deduplicate(writer, live):
+    """Merge objects with identical content into one object"""
+    merged = 0
+    for _ in range(DEDUP_PASSES):
+        canonical = {}
+        mapping = {}
+        for idnum in sorted(live):
+            obj = writer._objects[idnum - 1]
+            if obj is None or _is_page_tree(obj):
+                continue
+            fingerprint = _fingerprint(obj)
+            if fingerprint in canonical:
+                mapping[idnum] = canonical[fingerprint]
+            else:
+                canonical[fingerprint] = idnum
+        if not mapping:
+            break
+
+        for idnum in live:
+            if idnum not in mapping and writer._objects[idnum - 1] is not None:
+                _replace_references(writer, writer._objects[idnum - 1], mapping)
+        for idnum in mapping:
+            writer._objects[idnum - 1] = NullObject()
+        live -= mapping.keys()
+        merged += len(mapping)
+    return merged
+
+
+def optimize_writer(writer, level=PDF_OPTIMIZE):
+    """
+    Shrink a PdfWriter's output before it is written
+
+    Removed objects are replaced by null objects rather than dropped, because
+    PdfWriter numbers objects by their position; a null costs a few bytes.
+
+    Args:
+        writer: PdfWriter to optimize in place
+        level: 'off', 'fast' or 'full' (see PDF_OPTIMIZE)
+
+    Raises:
+        ValueError: If level is not one of those
+    """
+    if level not in OPTIMIZE_LEVELS:
+        raise ValueError(f"Unknown PDF optimization level '{level}'")
+    # Leave encrypted writers alone
+    if level == 'off' or hasattr(writer, '_encrypt'):
+        return
+
+    live = _reachable(writer)
+    dropped = 0
+    for idnum in range(1, len(writer._objects) + 1):
+        if idnum not in live and writer._objects[idnum - 1] is not None:
+            writer._objects[idnum - 1] = NullObject()
+            dropped += 1
+
+    merged = _deduplicate(writer, live) if level == 'full' else 0
+    saved = _compress_streams(writer, COMPRESSION_LEVELS[level])
+    logger.debug(
+        f"Optimized PDF: {dropped} unreferenced and {merged} duplicate objects removed, "
+        f"{saved} bytes saved by compression"
+    )
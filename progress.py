@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between edits of a status message, to stay within
+# Telegram's rate limits for editing messages
+PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', 3))
+
+# Callback data of the button that cancels a running job
+CANCEL_JOB = 'cancel_job'
+
+
+def cancel_markup():
+    """Inline keyboard with the button that cancels a running job"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel", callback_data=CANCEL_JOB)]])
+
+
+def format_progress(progress):
+    """
+    Describe the progress of a job
+
+    Args:
+        progress: Dictionary with any of pages, total and bytes
+
+    Returns:
+        One line per reported figure
+    """
+    lines = []
+    pages, total = progress.get('pages'), progress.get('total')
+    if pages and total:
+        lines.append(f"📄 Page {min(pages, total)} of {total} ({min(pages * 100 // total, 100)}%)")
+    elif pages:
+        lines.append(f"📄 {pages} pages done")
+    if progress.get('bytes'):
+        lines.append(f"💾 {progress['bytes'] / (1024 * 1024):.1f} MB written")
+    return "\n".join(lines)
+
+
+class JobStatus:
+    """
+    Status message of a running job
+
+    Shows the queue position and progress of the job. Updates arriving
+    faster than the edit interval are coalesced, and only the latest text is
+    shown, so a busy job edits its message at most once per interval.
+
+    Args:
+        edit: Coroutine function that edits the status message, like
+              CallbackQuery.edit_message_text or Message.edit_text
+        working_text: Text shown while the job runs
+        cancellable: Show a Cancel button under the status
+        interval: Minimum seconds between edits
+    """
+
+    def __init__(self, edit, working_text, cancellable=True, interval=PROGRESS_EDIT_INTERVAL):
+        self.edit = edit
+        self.working_text = working_text
+        self.cancellable = cancellable
+        self.interval = interval
+        self._shown = None
+        self._shown_at = 0
+        self._pending = None
+        self._editing = False
+        self._closed = False
+        self._task = None
+
+    def start(self):
+        """Show the working text (and Cancel button)"""
+        self._update(self.working_text)
+
+    async def on_position(self, position):
+        """JobScheduler callback: show the queue position"""
+        if position:
+            self._update(f"🕒 Waiting in queue... position {position}")
+        else:
+            self._update(self.working_text)
+
+    def on_progress(self, progress):
+        """JobExecutor callback: show the pages processed and bytes written"""
+        details = format_progress(progress)
+        self._update(f"{self.working_text}\n{details}" if details else self.working_text)
+
+    def _update(self, text):
+        if self._closed:
+            return
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._pending is not None:
+            delay = self._shown_at + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            text, self._pending = self._pending, None
+            if text == self._shown:
+                continue
+            self._shown_at = time.monotonic()
+            self._editing = True
+            try:
+                markup = cancel_markup() if self.cancellable else None
+                await self.edit(text, reply_markup=markup)
+                self._shown = text
+            except Exception as e:
+                logger.debug(f"Status update failed: {e}")
+            finally:
+                self._editing = False
+
+    async def close(self):
+        """Stop updating; waits for an edit in flight so it cannot land after the final text"""
+        self._closed = True
+        self._pending = None
+        if self._task is None:
+            return
+        if not self._editing:
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
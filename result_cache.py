@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from pymongo.errors import CollectionInvalid
+from motor.motor_asyncio import AsyncIOMotorClient
+from session_manager import MONGODB_POOL_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+# Seconds a sent result is reused for the same operation on the same files
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 86400))
+# Maximum number of cached results
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 10000))
+# Size cap of the MongoDB result cache (a capped collection)
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MB', 16)) * 1024 * 1024
+
+# Operations whose results can be sent again by file_id. A renamed file must
+# be uploaded again, because Telegram keeps the name a file_id was sent with.
+CACHED_OPERATIONS = ('merge', 'watermark', 'images', 'split', 'preview')
+
+
+def result_key(operation, unique_ids, params):
+    """
+    Cache key of an operation on a set of files
+
+    Args:
+        operation: Operation name
+        unique_ids: Telegram file_unique_ids of the inputs, in order
+        params: Operation parameters
+
+    Returns:
+        Hex digest, or None if the result cannot be cached
+    """
+    if operation not in CACHED_OPERATIONS or not unique_ids or not all(unique_ids):
+        return None
+    # Tuples and lists serialize alike, so parameters read back from a job
+    # document give the same key
+    payload = json.dumps([operation, list(unique_ids), params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Telegram file_ids of sent results, keyed by operation, inputs and parameters
+
+    Uses a capped MongoDB collection when MONGODB_URI is set, so the bot and
+    all queue workers share results and the oldest are dropped once the size
+    cap is reached. Otherwise results are kept in memory, least recently used
+    first. Entries older than the TTL are ignored on read.
+    """
+
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.results = None  # MongoDB collection
+        self._entries = OrderedDict()  # key -> (stored_at, files), least recent first
+
+    async def connect(self):
+        """Use MongoDB if configured, falling back to memory"""
+        mongodb_uri = os.getenv('MONGODB_URI')
+        if not mongodb_uri:
+            return
+
+        try:
+            db = AsyncIOMotorClient(mongodb_uri, **MONGODB_POOL_OPTIONS)['pdf_bot']
+            try:
+                await db.create_collection(
+                    'results', capped=True, size=self.max_bytes, max=self.max_entries
+                )
+            except CollectionInvalid:
+                pass  # Created before
+            self.results = db['results']
+            await self.results.create_index('key')
+        except Exception as e:
+            logger.warning(f"MongoDB result cache unavailable: {e}. Caching results in memory.")
+            self.results = None
+
+    async def get(self, key):
+        """
+        Get a cached result
+
+        Args:
+            key: Key from result_key
+
+        Returns:
+            Sent files (see telegram_files.sent_files), or None on a miss
+        """
+        if key is None:
+            return None
+        oldest = time.time() - self.ttl
+
+        if self.results is not None:
+            entry = await self.results.find_one(
+                {'key': key, 'stored_at': {'$gt': oldest}}, sort=[('$natural', -1)]
+            )
+            return entry['files'] if entry else None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= oldest:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def put(self, key, files):
+        """Cache the sent files of a result"""
+        if key is None or not files:
+            return
+
+        if self.results is not None:
+            # Capped collections only append; a newer entry shadows older ones
+            await self.results.insert_one({'key': key, 'files': files, 'stored_at': time.time()})
+            return
+
+        self._entries[key] = (time.time(), files)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def discard(self, key):
+        """Forget a result whose file_ids no longer work"""
+        if self.results is not None:
+            # Documents of capped collections cannot be deleted; make them stale
+            await self.results.update_many({'key': key}, {'$set': {'stored_at': 0.0}})
+        else:
+            self._entries.pop(key, None)
@@ -0,0 +1,206 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from job_executor import PDF_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of PDF jobs running at once across all users
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', PDF_WORKERS))
+# Token bucket per user: burst size and refill rate
+USER_JOB_BURST = int(os.getenv('USER_JOB_BURST', 3))
+USER_JOBS_PER_MINUTE = float(os.getenv('USER_JOBS_PER_MINUTE', 2))
+# Maximum number of jobs a user may have waiting at once
+MAX_QUEUED_JOBS_PER_USER = int(os.getenv('MAX_QUEUED_JOBS_PER_USER', 2))
+# Seconds between sweeps for the token buckets of idle users
+BUCKET_PRUNE_INTERVAL = float(os.getenv('BUCKET_PRUNE_INTERVAL', 60))
+
+
+class RateLimited(Exception):
+    """Raised when a user submits jobs faster than allowed"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Retry after {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate  # Tokens per second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self):
+        """Return True if the bucket has refilled completely"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def consume(self):
+        """
+        Take one token
+
+        Returns:
+            0 if a token was taken, otherwise seconds until one is available
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate else float('inf')
+
+
+class _QueuedJob:
+    def __init__(self, on_position):
+        self.ready = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.position = None
+
+
+class JobScheduler:
+    """
+    Fair scheduler in front of the JobExecutor
+
+    Each user is limited by a token bucket. Admitted jobs wait in per-user
+    queues that are served round-robin, so one user with many jobs cannot
+    starve others, and at most max_concurrent jobs run at once.
+    """
+
+    def __init__(self, executor, max_concurrent=MAX_CONCURRENT_JOBS,
+                 burst=USER_JOB_BURST, jobs_per_minute=USER_JOBS_PER_MINUTE,
+                 max_queued_per_user=MAX_QUEUED_JOBS_PER_USER):
+        self.executor = executor
+        self.max_concurrent = max_concurrent
+        self.burst = burst
+        self.rate = jobs_per_minute / 60
+        self.max_queued_per_user = max_queued_per_user
+        self.running = 0
+        self.queues = OrderedDict()  # user_id -> deque of _QueuedJob, in round-robin order
+        self.buckets = {}
+        self._pruned_at = time.monotonic()
+
+    def _bucket(self, user_id):
+        if time.monotonic() - self._pruned_at >= BUCKET_PRUNE_INTERVAL:
+            self._prune()
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.burst, self.rate)
+        return bucket
+
+    def _prune(self):
+        """Forget the buckets that refilled completely; they carry no state worth keeping"""
+        for user_id in [user_id for user_id, bucket in self.buckets.items() if bucket.is_full()]:
+            del self.buckets[user_id]
+        self._pruned_at = time.monotonic()
+
+    def admit(self, user_id):
+        """
+        Charge one job to a user's rate limit
+
+        Args:
+            user_id: Telegram user ID
+
+        Raises:
+            RateLimited: If the user exceeded the rate limit or queue length
+        """
+        if len(self.queues.get(user_id, ())) >= self.max_queued_per_user:
+            raise RateLimited(retry_after=1 / self.rate if self.rate else 60)
+        retry_after = self._bucket(user_id).consume()
+        if retry_after:
+            raise RateLimited(retry_after=retry_after)
+
+    async def run(self, user_id, method, *args, on_position=None, **kwargs):
+        """
+        Queue a PDFHandler method for a user and run it when its turn comes
+
+        Args:
+            user_id: Telegram user ID
+            method: Name of the PDFHandler method to call
+            *args: Positional arguments for the method
+            on_position: Optional async callback called with the queue position
+                         whenever it changes while the job waits, and with 0
+                         when a job that had to wait starts running
+            **kwargs: Keyword arguments for the method
+
+        Returns:
+            Whatever the PDFHandler method returns
+
+        Raises:
+            RateLimited: If the user exceeded the rate limit or queue length
+        """
+        self.admit(user_id)
+
+        job = _QueuedJob(on_position)
+        self.queues.setdefault(user_id, deque()).append(job)
+        self._dispatch()
+
+        try:
+            await job.ready
+        except asyncio.CancelledError:
+            self._discard(user_id, job)
+            raise
+
+        try:
+            return await self.executor.run(method, *args, **kwargs)
+        finally:
+            self.running -= 1
+            self._dispatch()
+
+    def _discard(self, user_id, job):
+        """Remove a job that was cancelled while waiting"""
+        queue = self.queues.get(user_id)
+        if queue and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self.queues[user_id]
+            self._report_positions()
+        elif job.ready.done() and not job.ready.cancelled():
+            # Cancelled right after being admitted; give the slot back
+            self.running -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """Start waiting jobs round-robin while slots are free"""
+        while self.running < self.max_concurrent and self.queues:
+            user_id, queue = next(iter(self.queues.items()))
+            job = queue.popleft()
+            if queue:
+                self.queues.move_to_end(user_id)
+            else:
+                del self.queues[user_id]
+            if job.ready.cancelled():
+                # Cancelled while waiting, before its task could discard it
+                continue
+            self.running += 1
+            job.ready.set_result(None)
+            if job.on_position and job.position:
+                asyncio.create_task(self._notify(job, 0))
+        self._report_positions()
+
+    def _report_positions(self):
+        """Tell waiting jobs their position in the round-robin order"""
+        position = 0
+        queues = [list(queue) for queue in self.queues.values()]
+        for depth in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    job = queue[depth]
+                    if job.on_position and job.position != position:
+                        job.position = position
+                        asyncio.create_task(self._notify(job, position))
+
+    async def _notify(self, job, position):
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            logger.debug(f"Queue position update failed: {e}")
@@ -1,16 +1,241 @@
 import os
-from pymongo import MongoClient
+import time
+import asyncio
+from collections import OrderedDict
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
-class SessionManager:
-    """Manage user sessions with MongoDB or in-memory fallback"""
+# Seconds a MongoDB session read is reused before querying again
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 5))
+
+# Connection pool settings for the async MongoDB client
+MONGODB_POOL_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGODB_MAX_POOL_SIZE', 50)),
+    'minPoolSize': int(os.getenv('MONGODB_MIN_POOL_SIZE', 2)),
+    'maxIdleTimeMS': int(os.getenv('MONGODB_MAX_IDLE_MS', 60000)),
+    'waitQueueTimeoutMS': int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    'serverSelectionTimeoutMS': 5000,
+}
+
+# In-memory session limits
+SESSION_TTL = int(os.getenv('SESSION_TTL', 3600))
+MAX_MEMORY_SESSIONS = int(os.getenv('MAX_MEMORY_SESSIONS', 10000))
+# Seconds between sweeps for expired in-memory sessions
+SESSION_CLEANUP_INTERVAL = int(os.getenv('SESSION_CLEANUP_INTERVAL', 60))
+# Seconds a stored file may go without any session referencing it before it
+# is released (uploads are stored just before they are added to the session)
+SESSION_FILE_GRACE = int(os.getenv('SESSION_FILE_GRACE', 300))
+
+# Seconds operation records are kept to recognise redelivered updates
+OPERATION_TTL = int(os.getenv('OPERATION_TTL', 86400))
+# Seconds a running operation stays owned without renewal before it is resumed
+OPERATION_LEASE_SECONDS = int(os.getenv('OPERATION_LEASE_SECONDS', 60))
+
+def _changes_update(fields, pdf_files):
+    """Build the MongoDB update document for staged session changes"""
+    update = {'$set': dict(fields, last_activity=datetime.utcnow())}
+    if pdf_files:
+        update['$push'] = {'pdf_files': {'$each': list(pdf_files)}}
+    return update
+
+def _remove_file(file_path):
+    """Delete a session file from disk if it still exists"""
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+class Session:
+    """Compact in-memory session"""
+    
+    __slots__ = (
+        'state', 'pdf_files', 'new_name', 'watermark_text',
+        'watermark_position', 'last_activity', 'extra'
+    )
     
     def __init__(self):
+        self.state = None
+        self.pdf_files = []
+        self.new_name = None
+        self.watermark_text = None
+        self.watermark_position = None
+        self.last_activity = time.monotonic()
+        self.extra = None  # Dictionary for keys without a slot
+    
+    def get(self, key, default=None):
+        if key in Session.__slots__:
+            value = getattr(self, key)
+            return default if value is None else value
+        return (self.extra or {}).get(key, default)
+    
+    def set(self, key, value):
+        if key in Session.__slots__:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+    
+    def to_dict(self):
+        """Return the session as a dictionary, like a MongoDB document"""
+        session = dict(self.extra or {})
+        for key in ('state', 'new_name', 'watermark_text', 'watermark_position'):
+            value = getattr(self, key)
+            if value is not None:
+                session[key] = value
+        session['pdf_files'] = list(self.pdf_files)
+        return session
+
+
+class MemorySessionStore:
+    """In-memory session store bounded by size, with TTL and LRU eviction"""
+    
+    def __init__(self, on_evict, max_sessions=MAX_MEMORY_SESSIONS, ttl=SESSION_TTL):
+        self.on_evict = on_evict
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # user_id -> Session, least recent first
+    
+    def __len__(self):
+        return len(self._sessions)
+    
+    def _is_expired(self, session, now):
+        return now - session.last_activity > self.ttl
+    
+    def get(self, user_id):
+        """
+        Get a live session without creating one
+        
+        Args:
+            user_id: Telegram user ID
+        
+        Returns:
+            Session object or None if missing or expired
+        """
+        session = self._sessions.get(user_id)
+        if session is not None and self._is_expired(session, time.monotonic()):
+            self._evict(user_id)
+            return None
+        return session
+    
+    def touch(self, user_id):
+        """
+        Get a session for writing, creating it if needed
+        
+        Args:
+            user_id: Telegram user ID
+        
+        Returns:
+            Session object with its last activity updated
+        """
+        session = self.get(user_id)
+        if session is None:
+            session = self._sessions[user_id] = Session()
+            while len(self._sessions) > self.max_sessions:
+                self._evict(next(iter(self._sessions)))
+        else:
+            self._sessions.move_to_end(user_id)
+        session.last_activity = time.monotonic()
+        return session
+    
+    def pop(self, user_id):
+        """Remove a session without running the eviction callback"""
+        return self._sessions.pop(user_id, None)
+    
+    def expire(self):
+        """
+        Evict all expired sessions
+        
+        Returns:
+            Number of sessions evicted
+        """
+        now = time.monotonic()
+        expired = []
+        # Least recently used first, so stop at the first live session
+        for user_id, session in self._sessions.items():
+            if not self._is_expired(session, now):
+                break
+            expired.append(user_id)
+        
+        for user_id in expired:
+            self._evict(user_id)
+        return len(expired)
+    
+    def _evict(self, user_id):
+        session = self._sessions.pop(user_id)
+        try:
+            self.on_evict(session)
+        except Exception as e:
+            logger.error(f"Error evicting session {user_id}: {e}")
+
+
+class BaseSessionManager:
+    """
+    State and in-memory fallback shared by SessionManager and AsyncSessionManager
+    
+    Holds no public session methods: SessionManager implements them as plain
+    functions and AsyncSessionManager as coroutines, on top of these helpers.
+    
+    Args:
+        file_remover: Function that releases a session file
+    """
+    
+    def __init__(self, file_remover=_remove_file):
+        self.remove_file = file_remover
         self.use_mongodb = False
-        self.sessions = {}  # In-memory fallback
+        self.sessions = MemorySessionStore(self._remove_session_files)  # In-memory fallback
+        self._cache = {}  # user_id -> (expires_at, session) for MongoDB reads
+    
+    def _remove_session_files(self, session):
+        """Delete the temporary files of an evicted in-memory session"""
+        self._remove_files(session.pdf_files)
+    
+    def _remove_files(self, pdf_files):
+        for file_path in pdf_files:
+            try:
+                self.remove_file(file_path)
+            except Exception as e:
+                logger.error(f"Error removing file {file_path}: {e}")
+    
+    def _get_cached(self, user_id):
+        """Return a cached MongoDB session, or None if missing or expired"""
+        cached = self._cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+    
+    def _set_cached(self, user_id, session):
+        self._cache[user_id] = (time.monotonic() + SESSION_CACHE_TTL, session)
+    
+    def _memory_get_session(self, user_id):
+        session = self.sessions.get(user_id)
+        return session.to_dict() if session else {}
+    
+    def _memory_remove_pdf(self, user_id, file_path):
+        session = self.sessions.get(user_id)
+        if session and file_path in session.pdf_files:
+            session.pdf_files.remove(file_path)
+    
+    def _memory_apply_changes(self, user_id, fields, pdf_files):
+        session = self.sessions.touch(user_id)
+        for key, value in fields.items():
+            session.set(key, value)
+        session.pdf_files.extend(pdf_files)
+    
+    def _memory_cleanup(self):
+        expired = self.sessions.expire()
+        if expired:
+            logger.info(f"Evicted {expired} expired sessions")
+
+
+class SessionManager(BaseSessionManager):
+    """Manage user sessions with MongoDB or in-memory fallback"""
+    
+    def __init__(self, file_remover=_remove_file):
+        super().__init__(file_remover)
         
         # Try to connect to MongoDB
         mongodb_uri = os.getenv('MONGODB_URI')
@@ -47,10 +272,13 @@ class SessionManager:
             Session dictionary or empty dict if not found
         """
         if self.use_mongodb:
-            session = self.sessions_collection.find_one({'user_id': user_id})
-            return session if session else {}
+            session = self._get_cached(user_id)
+            if session is None:
+                session = self.sessions_collection.find_one({'user_id': user_id}) or {}
+                self._set_cached(user_id, session)
+            return session
         else:
-            return self.sessions.get(user_id, {})
+            return self._memory_get_session(user_id)
     
     def set_state(self, user_id, state):
         """
@@ -61,6 +289,7 @@ class SessionManager:
             state: Current state string
         """
         if self.use_mongodb:
+            self._cache.pop(user_id, None)
             self.sessions_collection.update_one(
                 {'user_id': user_id},
                 {
@@ -72,9 +301,7 @@ class SessionManager:
                 upsert=True
             )
         else:
-            if user_id not in self.sessions:
-                self.sessions[user_id] = {}
-            self.sessions[user_id]['state'] = state
+            self.sessions.touch(user_id).state = state
     
     def get_state(self, user_id):
         """
@@ -99,6 +326,7 @@ class SessionManager:
             value: Value to set
         """
         if self.use_mongodb:
+            self._cache.pop(user_id, None)
             self.sessions_collection.update_one(
                 {'user_id': user_id},
                 {
@@ -110,9 +338,7 @@ class SessionManager:
                 upsert=True
             )
         else:
-            if user_id not in self.sessions:
-                self.sessions[user_id] = {}
-            self.sessions[user_id][key] = value
+            self.sessions.touch(user_id).set(key, value)
     
     def add_pdf(self, user_id, file_path):
         """
@@ -123,6 +349,7 @@ class SessionManager:
             file_path: Path to the PDF file
         """
         if self.use_mongodb:
+            self._cache.pop(user_id, None)
             self.sessions_collection.update_one(
                 {'user_id': user_id},
                 {
@@ -132,11 +359,61 @@ class SessionManager:
                 upsert=True
             )
         else:
-            if user_id not in self.sessions:
-                self.sessions[user_id] = {}
-            if 'pdf_files' not in self.sessions[user_id]:
-                self.sessions[user_id]['pdf_files'] = []
-            self.sessions[user_id]['pdf_files'].append(file_path)
+            self.sessions.touch(user_id).pdf_files.append(file_path)
+    
+    def remove_pdf(self, user_id, file_path):
+        """
+        Remove a PDF file from user's session
+        
+        Args:
+            user_id: Telegram user ID
+            file_path: Path to the PDF file
+        """
+        if self.use_mongodb:
+            self._cache.pop(user_id, None)
+            self.sessions_collection.update_one(
+                {'user_id': user_id},
+                {
+                    '$pull': {'pdf_files': file_path},
+                    '$set': {'last_activity': datetime.utcnow()}
+                }
+            )
+        else:
+            self._memory_remove_pdf(user_id, file_path)
+    
+    def unit_of_work(self, user_id):
+        """
+        Start a unit of work for one update
+        
+        Args:
+            user_id: Telegram user ID
+        
+        Returns:
+            SessionUnitOfWork holding the loaded session
+        """
+        return SessionUnitOfWork(self, user_id, self.get_session(user_id))
+    
+    def apply_changes(self, user_id, fields, pdf_files):
+        """
+        Write staged session changes in a single operation
+        
+        Args:
+            user_id: Telegram user ID
+            fields: Dictionary of keys to set
+            pdf_files: List of PDF file paths to append
+        """
+        if not fields and not pdf_files:
+            return
+        
+        if self.use_mongodb:
+            self._cache.pop(user_id, None)
+            self.sessions_collection.update_one(
+                {'user_id': user_id},
+                _changes_update(fields, pdf_files),
+                upsert=True
+            )
+        else:
+            self._memory_apply_changes(user_id, fields, pdf_files)
     
     def clear_session(self, user_id):
         """
@@ -147,19 +424,13 @@ class SessionManager:
         """
         # Clean up any temporary files
         session = self.get_session(user_id)
-        pdf_files = session.get('pdf_files', [])
-        for file_path in pdf_files:
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    logger.error(f"Error removing file {file_path}: {e}")
+        self._remove_files(session.get('pdf_files', []))
         
         if self.use_mongodb:
+            self._cache.pop(user_id, None)
             self.sessions_collection.delete_one({'user_id': user_id})
         else:
-            if user_id in self.sessions:
-                del self.sessions[user_id]
+            self.sessions.pop(user_id)
     
     def cleanup_expired_sessions(self):
         """
@@ -167,14 +438,376 @@ class SessionManager:
         MongoDB has TTL index for auto-cleanup
         """
         if not self.use_mongodb:
-            # Remove sessions older than 1 hour
-            current_time = datetime.utcnow()
-            expired_users = []
+            self._memory_cleanup()
+
+
+class SessionUnitOfWork:
+    """Load a session once, stage changes and flush them in one write"""
+    
+    def __init__(self, manager, user_id, session):
+        self.manager = manager
+        self.user_id = user_id
+        self.session = dict(session)
+        self._fields = {}
+        self._pdf_files = []
+    
+    def get(self, key, default=None):
+        """Read a key, including changes staged in this unit of work"""
+        return self.session.get(key, default)
+    
+    def set_state(self, state):
+        """Stage a state change"""
+        self.update(key='state', value=state)
+    
+    def update(self, key, value):
+        """Stage a change of one session key"""
+        self.session[key] = value
+        self._fields[key] = value
+    
+    def add_pdf(self, file_path):
+        """Stage a PDF file to add to the session"""
+        self.session['pdf_files'] = self.session.get('pdf_files', []) + [file_path]
+        self._pdf_files.append(file_path)
+    
+    def flush(self):
+        """Write all staged changes"""
+        self.manager.apply_changes(self.user_id, self._fields, self._pdf_files)
+        self._fields = {}
+        self._pdf_files = []
+
+
+class AsyncSessionUnitOfWork(SessionUnitOfWork):
+    """Unit of work for AsyncSessionManager"""
+    
+    async def flush(self):
+        """Write all staged changes"""
+        await self.manager.apply_changes(self.user_id, self._fields, self._pdf_files)
+        self._fields = {}
+        self._pdf_files = []
+
+
+class AsyncSessionManager(BaseSessionManager):
+    """
+    Manage user sessions with an async MongoDB client or in-memory fallback
+    
+    Same interface as SessionManager, but every method is a coroutine so
+    database round-trips never block the event loop. Call connect() once
+    the event loop is running.
+    
+    Args:
+        file_remover: Function that releases a session file
+        file_lister: Coroutine function returning the session files this
+                     process keeps that were stored at least min_age seconds
+                     ago; with MongoDB, those no session references any more
+                     are released by cleanup_expired_sessions
+    """
+    
+    def __init__(self, file_remover=_remove_file, file_lister=None):
+        super().__init__(file_remover)
+        self.list_files = file_lister
+        self._operations = OrderedDict()  # key -> operation record, oldest first
+    
+    async def connect(self):
+        """Connect to MongoDB, falling back to in-memory storage"""
+        mongodb_uri = os.getenv('MONGODB_URI')
+        if not mongodb_uri:
+            logger.info("No MongoDB URI provided. Using in-memory storage.")
+            return
+        
+        try:
+            self.client = AsyncIOMotorClient(mongodb_uri, **MONGODB_POOL_OPTIONS)
+            self.db = self.client['pdf_bot']
+            self.sessions_collection = self.db['sessions']
             
-            for user_id, session in self.sessions.items():
-                last_activity = session.get('last_activity')
-                if last_activity and (current_time - last_activity) > timedelta(hours=1):
-                    expired_users.append(user_id)
+            # Test connection
+            await self.client.admin.command('ping')
+            self.use_mongodb = True
+            logger.info("Connected to MongoDB (async)")
             
-            for user_id in expired_users:
-                self.clear_session(user_id)
+            # Create TTL index for auto-cleanup (sessions expire after 1 hour)
+            await self.sessions_collection.create_index(
+                "last_activity",
+                expireAfterSeconds=3600
+            )
+            
+            # Operation records expire at their own 'expires' time
+            self.operations_collection = self.db['operations']
+            await self.operations_collection.create_index("expires", expireAfterSeconds=0)
+            await self.operations_collection.create_index([('status', 1), ('lease_until', 1)])
+        except Exception as e:
+            logger.warning(f"MongoDB connection failed: {e}. Using in-memory storage.")
+            self.use_mongodb = False
+    
+    async def get_session(self, user_id):
+        """Get user session data"""
+        if not self.use_mongodb:
+            return self._memory_get_session(user_id)
+        
+        session = self._get_cached(user_id)
+        if session is None:
+            session = await self.sessions_collection.find_one({'user_id': user_id}) or {}
+            self._set_cached(user_id, session)
+        return session
+    
+    async def set_state(self, user_id, state):
+        """Set user's current state"""
+        await self.update_session(user_id, 'state', state)
+    
+    async def get_state(self, user_id):
+        """Get user's current state"""
+        session = await self.get_session(user_id)
+        return session.get('state')
+    
+    async def update_session(self, user_id, key, value):
+        """Update a specific key in user session"""
+        if not self.use_mongodb:
+            return self.sessions.touch(user_id).set(key, value)
+        
+        self._cache.pop(user_id, None)
+        await self.sessions_collection.update_one(
+            {'user_id': user_id},
+            {'$set': {key: value, 'last_activity': datetime.utcnow()}},
+            upsert=True
+        )
+    
+    async def add_pdf(self, user_id, file_path):
+        """Add a PDF file to user's session"""
+        await self.apply_changes(user_id, {}, [file_path])
+    
+    async def remove_pdf(self, user_id, file_path):
+        """Remove a PDF file from user's session"""
+        if not self.use_mongodb:
+            return self._memory_remove_pdf(user_id, file_path)
+        
+        self._cache.pop(user_id, None)
+        await self.sessions_collection.update_one(
+            {'user_id': user_id},
+            {
+                '$pull': {'pdf_files': file_path},
+                '$set': {'last_activity': datetime.utcnow()}
+            }
+        )
+    
+    async def unit_of_work(self, user_id):
+        """Start a unit of work for one update"""
+        return AsyncSessionUnitOfWork(self, user_id, await self.get_session(user_id))
+    
+    async def apply_changes(self, user_id, fields, pdf_files):
+        """Write staged session changes in a single operation"""
+        if not fields and not pdf_files:
+            return
+        if not self.use_mongodb:
+            return self._memory_apply_changes(user_id, fields, pdf_files)
+        
+        self._cache.pop(user_id, None)
+        await self.sessions_collection.update_one(
+            {'user_id': user_id},
+            _changes_update(fields, pdf_files),
+            upsert=True
+        )
+    
+    async def clear_session(self, user_id):
+        """Clear all session data for a user"""
+        session = await self.get_session(user_id)
+        self._remove_files(session.get('pdf_files', []))
+        
+        if self.use_mongodb:
+            self._cache.pop(user_id, None)
+            await self.sessions_collection.delete_one({'user_id': user_id})
+        else:
+            self.sessions.pop(user_id)
+    
+    async def cleanup_expired_sessions(self):
+        """
+        Cleanup expired sessions
+        
+        In-memory sessions are evicted together with their files. MongoDB
+        drops expired sessions itself (TTL index) but cannot release their
+        files, so files that no session references any more are released.
+        """
+        if not self.use_mongodb:
+            return self._memory_cleanup()
+        if self.list_files is None:
+            return
+        
+        files = await self.list_files(SESSION_FILE_GRACE)
+        if not files:
+            return
+        referenced = set()
+        async for session in self.sessions_collection.find(
+            {'pdf_files': {'$in': files}}, {'pdf_files': 1}
+        ):
+            referenced.update(session.get('pdf_files', []))
+        
+        orphaned = [file_path for file_path in files if file_path not in referenced]
+        self._remove_files(orphaned)
+        if orphaned:
+            logger.info(f"Released {len(orphaned)} files of expired sessions")
+    
+    async def cleanup_loop(self, interval=SESSION_CLEANUP_INTERVAL):
+        """Clean up expired sessions every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.cleanup_expired_sessions()
+            except Exception as e:
+                logger.error(f"Session cleanup error: {e}")
+    
+    def _memory_operation(self, key):
+        """Get a live in-memory operation record"""
+        record = self._operations.get(key)
+        if record is not None and record['expires'] <= datetime.utcnow():
+            del self._operations[key]
+            return None
+        return record
+    
+    async def get_operation(self, key):
+        """
+        Get the record of an operation
+        
+        Args:
+            key: Idempotency key of the update that started the operation
+        
+        Returns:
+            Operation record or None
+        """
+        if not self.use_mongodb:
+            return self._memory_operation(key)
+        return await self.operations_collection.find_one({'_id': key})
+    
+    async def begin_operation(self, record, owner, lease=OPERATION_LEASE_SECONDS):
+        """
+        Record an operation that is about to run
+        
+        The record holds everything needed to run the operation again (input
+        file_ids, parameters, status message) and is owned by the caller
+        while its lease is renewed.
+        
+        Args:
+            record: Job dictionary (see job_queue.new_job) whose _id is the
+                    idempotency key of the update that started it
+            owner: ID of the running process
+            lease: Seconds the operation stays owned without renewal
+        
+        Returns:
+            None if the operation was recorded, or the record that already
+            exists for the same key
+        """
+        record = dict(
+            record, status='running', owner=owner, lease_until=time.time() + lease,
+            expires=datetime.utcnow() + timedelta(seconds=OPERATION_TTL)
+        )
+        if not self.use_mongodb:
+            existing = self._memory_operation(record['_id'])
+            if existing is not None:
+                return existing
+            self._operations[record['_id']] = record
+            while len(self._operations) > MAX_MEMORY_SESSIONS:
+                self._operations.popitem(last=False)
+            return None
+        
+        for _ in range(2):
+            try:
+                await self.operations_collection.insert_one(record)
+                return None
+            except DuplicateKeyError:
+                existing = await self.operations_collection.find_one({'_id': record['_id']})
+                # Otherwise it was abandoned in between; try again
+                if existing is not None:
+                    return existing
+        return None
+    
+    async def renew_operation(self, key, owner, lease=OPERATION_LEASE_SECONDS):
+        """
+        Extend the lease of a running operation
+        
+        Returns:
+            False if the operation is no longer owned by owner
+        """
+        if not self.use_mongodb:
+            record = self._memory_operation(key)
+            if record is None or record.get('owner') != owner:
+                return False
+            record['lease_until'] = time.time() + lease
+            return True
+        
+        result = await self.operations_collection.update_one(
+            {'_id': key, 'owner': owner, 'status': 'running'},
+            {'$set': {'lease_until': time.time() + lease}}
+        )
+        return result.matched_count == 1
+    
+    async def finish_operation(self, key, owner, status='done', outputs=()):
+        """
+        Mark an operation as finished
+        
+        Args:
+            key: Idempotency key
+            owner: ID of the owning process
+            status: 'done', or 'queued' when a queue worker took it over
+            outputs: Sent result files, as {'type', 'file_id'} dictionaries
+        """
+        fields = {'status': status, 'outputs': list(outputs), 'finished': time.time()}
+        if not self.use_mongodb:
+            record = self._memory_operation(key)
+            if record is not None and record.get('owner') == owner:
+                record.update(fields)
+                record.pop('lease_until', None)
+            return
+        
+        await self.operations_collection.update_one(
+            {'_id': key, 'owner': owner},
+            {'$set': fields, '$unset': {'lease_until': ''}}
+        )
+    
+    async def abandon_operation(self, key, owner):
+        """Delete the record of a failed operation, so a redelivered update runs it again"""
+        if not self.use_mongodb:
+            record = self._memory_operation(key)
+            if record is not None and record.get('owner') == owner:
+                del self._operations[key]
+            return
+        
+        await self.operations_collection.delete_one({'_id': key, 'owner': owner})
+    
+    async def release_operation(self, key, owner):
+        """
+        Give back a claimed operation that could not be resumed yet
+        
+        Its lease runs out as usual, but the claim does not count toward
+        the resumes that give up on the operation.
+        """
+        if not self.use_mongodb:
+            return
+        
+        await self.operations_collection.update_one(
+            {'_id': key, 'owner': owner, 'status': 'running'},
+            {'$inc': {'resumes': -1}}
+        )
+    
+    async def claim_interrupted_operation(self, owner, lease=OPERATION_LEASE_SECONDS):
+        """
+        Take over a running operation whose owner stopped renewing its lease
+        
+        In-memory records die with their process, so only MongoDB records
+        can be resumed.
+        
+        Args:
+            owner: ID of the claiming process
+            lease: Seconds the operation stays owned without renewal
+        
+        Returns:
+            Operation record, or None if nothing was interrupted
+        """
+        if not self.use_mongodb:
+            return None
+        
+        now = time.time()
+        return await self.operations_collection.find_one_and_update(
+            {'status': 'running', 'lease_until': {'$lt': now}},
+            {
+                '$set': {'owner': owner, 'lease_until': now + lease},
+                '$inc': {'resumes': 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
@@ -0,0 +1,256 @@
+import os
+import shutil
+import asyncio
+import logging
+import zipfile
+from io import BytesIO
+from pathlib import Path
+from contextlib import ExitStack
+from telegram import InputMediaDocument, InputMediaPhoto
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Self-hosted Bot API server, e.g. http://localhost:8081/bot (default: Telegram cloud)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+TELEGRAM_API_FILE_URL = os.getenv('TELEGRAM_API_FILE_URL')
+# The Bot API server runs with --local and shares its filesystem with the bot
+TELEGRAM_LOCAL_MODE = os.getenv('TELEGRAM_LOCAL_MODE', '').lower() in ('1', 'true', 'yes')
+# Timeout in seconds for downloading and sending large files
+FILE_TIMEOUT = float(os.getenv('TELEGRAM_FILE_TIMEOUT', 300 if TELEGRAM_LOCAL_MODE else 60))
+
+
+def configure_builder(builder):
+    """
+    Point an ApplicationBuilder at the configured Bot API server
+
+    Args:
+        builder: telegram.ext ApplicationBuilder
+
+    Returns:
+        The builder
+    """
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL)
+        if TELEGRAM_API_FILE_URL:
+            builder = builder.base_file_url(TELEGRAM_API_FILE_URL)
+        builder = builder.local_mode(TELEGRAM_LOCAL_MODE)
+        logger.info(f"Using Bot API server at {TELEGRAM_API_URL}")
+    return builder
+
+
+async def download_file(bot, file_id, file_path=None, in_place=False):
+    """
+    Download a Telegram file to a path, or into memory
+
+    With a local Bot API server the file already sits on this machine, so
+    nothing is fetched over HTTP. Callers that only read the file can use it
+    in place from the server's directory; otherwise file_path becomes a hard
+    link to it, so the data is not copied and removing file_path leaves the
+    server's file alone. It is copied only across filesystems.
+
+    Args:
+        bot: Telegram bot
+        file_id: Telegram file_id
+        file_path: Destination path (None = return the content as bytes)
+        in_place: Return the server's own path instead of writing file_path,
+                  for callers that neither modify nor remove the file
+
+    Returns:
+        File content as bytes if file_path is None, otherwise the path to
+        read the file from
+    """
+    file = await bot.get_file(file_id, read_timeout=FILE_TIMEOUT)
+    if TELEGRAM_LOCAL_MODE and os.path.isabs(file.file_path):
+        if file_path is None:
+            return await asyncio.to_thread(Path(file.file_path).read_bytes)
+        if in_place:
+            return file.file_path
+        await asyncio.to_thread(_link_or_copy, file.file_path, file_path)
+        return file_path
+
+    if file_path is None:
+        buffer = BytesIO()
+        await file.download_to_memory(buffer, read_timeout=FILE_TIMEOUT)
+        return buffer.getvalue()
+    await file.download_to_drive(file_path, read_timeout=FILE_TIMEOUT)
+    return file_path
+
+
+def _link_or_copy(source, dest):
+    """Hard link source to dest, copying only if they are on different filesystems"""
+    try:
+        os.link(source, dest)
+    except OSError:
+        # copyfile streams through the kernel without loading the file
+        shutil.copyfile(source, dest)
+
+
+async def send_file(bot, chat_id, document, filename, caption, operation):
+    """
+    Send a document given as a file path or as bytes
+
+    Args:
+        bot: Telegram bot
+        chat_id: Chat to send to
+        document: File path or bytes
+        filename: File name shown to the user
+        caption: Message caption
+        operation: Operation label for metrics
+
+    Returns:
+        The sent Message
+    """
+    if isinstance(document, bytes):
+        size = len(document)
+        with metrics.STAGE_SECONDS.time(operation=operation, stage='upload'):
+            message = await bot.send_document(
+                chat_id, document=document, filename=filename, caption=caption,
+                write_timeout=FILE_TIMEOUT
+            )
+    elif TELEGRAM_LOCAL_MODE:
+        # The local server reads the file from disk itself (file:// URI)
+        size = os.path.getsize(document)
+        with metrics.STAGE_SECONDS.time(operation=operation, stage='upload'):
+            message = await bot.send_document(
+                chat_id, document=Path(document).resolve(), filename=filename, caption=caption,
+                write_timeout=FILE_TIMEOUT
+            )
+    else:
+        size = os.path.getsize(document)
+        with open(document, 'rb') as doc, \
+                metrics.STAGE_SECONDS.time(operation=operation, stage='upload'):
+            message = await bot.send_document(
+                chat_id, document=doc, filename=filename, caption=caption,
+                write_timeout=FILE_TIMEOUT
+            )
+    metrics.FILE_BYTES.observe(size, operation=operation, direction='out')
+    return message
+
+
+async def send_photos(bot, chat_id, photos, caption):
+    """
+    Send images as one photo or as an album
+
+    Args:
+        bot: Telegram bot
+        chat_id: Chat to send to
+        photos: List of image bytes or file_ids (at most 10, the album limit)
+        caption: Caption of the first photo
+
+    Returns:
+        List of sent Messages
+    """
+    if len(photos) == 1:
+        return [await bot.send_photo(chat_id, photo=photos[0], caption=caption)]
+    return list(await bot.send_media_group(chat_id, media=[
+        InputMediaPhoto(photo, caption=caption if i == 0 else None)
+        for i, photo in enumerate(photos[:10])
+    ]))
+
+
+def _zip_parts(parts, filenames, zip_path):
+    """Pack PDF parts into a zip archive; returns the path or the archive bytes"""
+    target = BytesIO() if zip_path is None else zip_path
+    # PDF streams are already compressed, so the parts are stored as they are
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_STORED) as archive:
+        for part, filename in zip(parts, filenames):
+            if isinstance(part, bytes):
+                archive.writestr(filename, part)
+            else:
+                archive.write(part, filename)
+    return target.getvalue() if zip_path is None else zip_path
+
+
+async def send_parts(bot, chat_id, parts, base_name, caption, operation, zip_path=None):
+    """
+    Send the files of a split as one reply
+
+    A single part is sent as a document, up to 10 parts as an album of
+    documents and more than that as one zip archive.
+
+    Args:
+        bot: Telegram bot
+        chat_id: Chat to send to
+        parts: List of file paths or bytes
+        base_name: File name stem, parts are named {base_name}_01.pdf etc.
+        caption: Caption of the reply
+        operation: Operation label for metrics
+        zip_path: Where to build the archive (None = in memory)
+
+    Returns:
+        List of sent Messages
+    """
+    filenames = [f"{base_name}_{i:02d}.pdf" for i in range(1, len(parts) + 1)]
+    if len(parts) == 1:
+        return [await send_file(bot, chat_id, parts[0], filenames[0], caption, operation)]
+
+    if len(parts) > 10:
+        archive = await asyncio.to_thread(_zip_parts, parts, filenames, zip_path)
+        return [await send_file(bot, chat_id, archive, f"{base_name}.zip", caption, operation)]
+
+    size = 0
+    with ExitStack() as stack:
+        media = []
+        for i, (part, filename) in enumerate(zip(parts, filenames)):
+            if isinstance(part, bytes):
+                size += len(part)
+            else:
+                size += os.path.getsize(part)
+                if TELEGRAM_LOCAL_MODE:
+                    part = Path(part).resolve()
+                else:
+                    part = stack.enter_context(open(part, 'rb'))
+            # Telegram shows the caption of the last document under the album
+            media.append(InputMediaDocument(
+                part, filename=filename, caption=caption if i == len(parts) - 1 else None
+            ))
+        with metrics.STAGE_SECONDS.time(operation=operation, stage='upload'):
+            messages = await bot.send_media_group(chat_id, media=media, write_timeout=FILE_TIMEOUT)
+    metrics.FILE_BYTES.observe(size, operation=operation, direction='out')
+    return list(messages)
+
+
+def sent_files(messages):
+    """
+    Describe the files of sent messages so they can be sent again by file_id
+
+    Args:
+        messages: Sent Messages
+
+    Returns:
+        List of {'type': 'document' or 'photo', 'file_id': ...} dictionaries
+    """
+    files = []
+    for message in messages:
+        if message.document:
+            files.append({'type': 'document', 'file_id': message.document.file_id})
+        elif message.photo:
+            files.append({'type': 'photo', 'file_id': message.photo[-1].file_id})
+    return files
+
+
+async def send_sent_files(bot, chat_id, files, caption):
+    """
+    Send files again by their file_id, without uploading anything
+
+    Args:
+        bot: Telegram bot
+        chat_id: Chat to send to
+        files: Dictionaries returned by sent_files
+        caption: Caption of the reply
+
+    Returns:
+        List of sent Messages
+    """
+    photos = [file['file_id'] for file in files if file['type'] == 'photo']
+    if photos:
+        return await send_photos(bot, chat_id, photos, caption)
+
+    documents = [file['file_id'] for file in files]
+    if len(documents) == 1:
+        return [await bot.send_document(chat_id, document=documents[0], caption=caption)]
+    return list(await bot.send_media_group(chat_id, media=[
+        InputMediaDocument(document, caption=caption if i == len(documents) - 1 else None)
+        for i, document in enumerate(documents)
+    ]))
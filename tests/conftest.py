@@ -0,0 +1,29 @@
+import os
+import sys
+from io import BytesIO
+
+import pytest
+from reportlab.pdfgen import canvas
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pdf_bytes(name, pages):
+    """Build a small PDF whose pages read "<name> page <n>" """
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer)
+    for page in range(pages):
+        c.drawString(72, 720, f"{name} page {page + 1}")
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """Write a PDF with labelled pages and return its path"""
+    def make(name, pages=2):
+        path = tmp_path / f"{name}.pdf"
+        path.write_bytes(pdf_bytes(name, pages))
+        return str(path)
+    return make
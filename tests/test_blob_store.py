@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+from blob_store import BlobStore, MemoryFileStore, MemoryStoreFull
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    """Directory standing in for the session upload directories"""
+    path = tmp_path / 'sessions'
+    path.mkdir()
+    return path
+
+
+def download(store, sessions, file_unique_id, data):
+    """Download a file into a session and add it to the store"""
+    path = str(sessions / f"{file_unique_id}.pdf")
+    with open(path, 'wb') as f:
+        f.write(data)
+    store.add(file_unique_id, path)
+    return path
+
+
+def test_session_files_are_counted_references(tmp_path, sessions):
+    store = BlobStore(str(tmp_path / 'blobs'))
+    first = download(store, sessions, 'a', b'x' * 100)
+    sha256 = store.aliases['a']
+    assert store.refcount(sha256) == 1
+
+    second = str(sessions / 'copy.pdf')
+    assert store.link('a', second)
+    assert os.path.samefile(first, second)
+    assert store.refcount(sha256) == 2
+
+    os.remove(first)
+    assert store.refcount(sha256) == 1
+    assert not store.link('unknown', str(sessions / 'other.pdf'))
+
+
+def test_identical_uploads_are_stored_once(tmp_path, sessions):
+    store = BlobStore(str(tmp_path / 'blobs'))
+    # Forwarded copies of a file get new file_unique_ids
+    first = download(store, sessions, 'a', b'x' * 100)
+    second = download(store, sessions, 'b', b'x' * 100)
+
+    assert store.aliases['a'] == store.aliases['b']
+    assert os.path.samefile(first, second)
+    assert len(store.blobs) == 1
+    assert store.total_size == 100
+    assert store.refcount(store.aliases['a']) == 2
+
+
+def test_unreferenced_blobs_are_evicted_least_recently_used_first(tmp_path, sessions):
+    store = BlobStore(str(tmp_path / 'blobs'), max_bytes=250)
+    for name in 'ab':
+        os.remove(download(store, sessions, name, name.encode() * 100))
+    # A cache hit makes 'a' the most recently used
+    assert store.link('a', str(sessions / 'a.pdf'))
+    os.remove(sessions / 'a.pdf')
+    evicted = store.aliases['b']
+
+    os.remove(download(store, sessions, 'c', b'c' * 100))
+
+    assert set(store.aliases) == {'a', 'c'}
+    assert evicted not in store.blobs
+    assert not os.path.exists(os.path.join(store.root, evicted))
+    assert store.total_size == 200
+
+
+def test_blob_is_released_with_its_last_reference(tmp_path, sessions):
+    store = BlobStore(str(tmp_path / 'blobs'), max_bytes=150)
+    first = download(store, sessions, 'a', b'a' * 100)
+    second = str(sessions / 'copy.pdf')
+    store.link('a', second)
+    # Over the cap, but nothing may be evicted while sessions use it
+    kept = download(store, sessions, 'b', b'b' * 100)
+    assert set(store.aliases) == {'a', 'b'}
+
+    os.remove(first)
+    os.remove(download(store, sessions, 'c', b'c' * 10))
+    assert 'a' in store.aliases
+
+    os.remove(second)
+    os.remove(download(store, sessions, 'd', b'd' * 10))
+    assert set(store.aliases) == {'b', 'c', 'd'}
+    assert open(kept, 'rb').read() == b'b' * 100
+    assert store.total_size == 120
+
+
+def test_blobs_are_found_again_after_a_restart(tmp_path, sessions):
+    root = str(tmp_path / 'blobs')
+    download(BlobStore(root), sessions, 'a', b'x' * 100)
+
+    store = BlobStore(root)
+    assert store.total_size == 100
+    # Aliases are not persisted, but the content still deduplicates
+    assert not store.link('a', str(sessions / 'copy.pdf'))
+    download(store, sessions, 'b', b'x' * 100)
+    assert len(store.blobs) == 1
+
+
+def test_memory_store_keeps_to_its_budget():
+    store = MemoryFileStore(max_bytes=100)
+    first = store.put('1/a', b'x' * 60)
+
+    with store.reserve(40):
+        with pytest.raises(MemoryStoreFull):
+            with store.reserve(1):
+                pass
+        second = store.put('1/b', b'y' * 40)
+    assert store.total_size == 100
+
+    store.discard(first)
+    store.discard(first)
+    with store.reserve(60):
+        pass
+    assert store.total_size == 40
+    assert store.get(second) == b'y' * 40
+
+
+def test_storing_a_key_again_replaces_it():
+    store = MemoryFileStore(max_bytes=100)
+    ref = store.put('1/a', b'x' * 60)
+    assert store.put('1/a', b'x' * 60) == ref
+    assert store.total_size == 60
+
+
+def test_memory_store_lists_files_by_age():
+    store = MemoryFileStore()
+    ref = store.put('1/a', b'x')
+    assert store.refs() == [ref]
+    assert store.refs(min_age=60) == []
+    store.discard(ref)
+    assert store.refs() == []
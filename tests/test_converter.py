@@ -0,0 +1,61 @@
+from io import BytesIO
+
+from PIL import Image
+from PyPDF2 import PdfReader
+
+from converter import PDFConverter
+
+# EXIF tag telling viewers how to rotate the stored pixels
+ORIENTATION = 0x0112
+
+
+def image_bytes(size, orientation=None):
+    # A gradient, as ReportLab shares images whose pixel data is identical
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ORIENTATION] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+def placed_images(data):
+    """(width, height) of the image and of the page, for each page"""
+    result = []
+    for page in PdfReader(BytesIO(data)).pages:
+        xobjects = page['/Resources']['/XObject']
+        (image,) = [xobjects[name].get_object() for name in xobjects]
+        page_size = (float(page.mediabox.width), float(page.mediabox.height))
+        result.append(((image['/Width'], image['/Height']), page_size))
+    return result
+
+
+def test_one_page_per_image(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(image_bytes((300, 200)))
+
+    data = PDFConverter().images_to_pdf(
+        [image_bytes((200, 300)), str(path), image_bytes((100, 100))], None
+    )
+
+    images = placed_images(data)
+    assert [size for size, _ in images] == [(200, 300), (300, 200), (100, 100)]
+    # Landscape images get landscape pages
+    assert [width > height for _, (width, height) in images] == [False, True, False]
+
+
+def test_exif_rotation_is_applied():
+    # Stored landscape, shown portrait: rotated 90 degrees clockwise
+    data = PDFConverter().images_to_pdf([image_bytes((300, 200), orientation=6)], None)
+
+    ((size, (width, height)),) = placed_images(data)
+    assert size == (200, 300)
+    assert width < height
+
+
+def test_large_images_are_down_sampled():
+    data = PDFConverter().images_to_pdf([image_bytes((3000, 1500))], None, max_pixels=1000)
+
+    ((size, _),) = placed_images(data)
+    assert size == (1000, 500)
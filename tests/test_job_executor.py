@@ -0,0 +1,101 @@
+import re
+import asyncio
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader
+
+from job_executor import JobExecutor, JobExecutorBusy
+from pdf_handler import PDFHandler
+
+
+def run_with_executor(coroutine_function, **kwargs):
+    async def main():
+        executor = JobExecutor(**kwargs)
+        try:
+            return await coroutine_function(executor)
+        finally:
+            executor.shutdown()
+    return asyncio.run(main())
+
+
+def content_bytes(page):
+    contents = page['/Contents'].get_object()
+    streams = contents if isinstance(contents, list) else [contents]
+    data = b''.join(stream.get_object().get_data() for stream in streams)
+    # merge_page renames clashing resources with random UUIDs
+    return re.sub(rb'[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}', b'', data)
+
+
+def page_contents(data):
+    return [(content_bytes(page), page.extract_text()) for page in PdfReader(BytesIO(data)).pages]
+
+
+def test_run_returns_the_method_result(make_pdf):
+    path = make_pdf('doc', pages=3)
+
+    info = run_with_executor(lambda executor: executor.run('inspect_pdf', path), max_workers=1)
+
+    assert info == {'pages': 3, 'encrypted': False}
+
+
+def test_full_queue_is_rejected(make_pdf):
+    path = make_pdf('doc')
+
+    async def fill(executor):
+        first = asyncio.create_task(executor.run('inspect_pdf', path))
+        await asyncio.sleep(0)  # Let the first job take the only place
+        with pytest.raises(JobExecutorBusy):
+            await executor.run('inspect_pdf', path)
+        return await first
+
+    assert run_with_executor(fill, max_workers=1, queue_limit=1)['pages'] == 2
+
+
+def test_worker_errors_reach_the_caller(tmp_path):
+    missing = str(tmp_path / 'missing.pdf')
+
+    with pytest.raises(FileNotFoundError):
+        run_with_executor(lambda executor: executor.run('inspect_pdf', missing), max_workers=1)
+
+
+@pytest.mark.parametrize('mode', ['merge', 'stamp'])
+def test_chunked_watermark_matches_single_pass(make_pdf, monkeypatch, mode):
+    monkeypatch.setattr('job_executor.WATERMARK_CHUNK_PAGES', 2)
+    path = make_pdf('doc', pages=16)
+    expected = PDFHandler().add_watermark(path, None, 'DRAFT', mode=mode)
+
+    # Repeat, since stitching used to corrupt pages only some of the time
+    for _ in range(3):
+        data = run_with_executor(
+            lambda executor: executor.run('add_watermark', path, None, 'DRAFT', mode=mode),
+            max_workers=8
+        )
+        assert page_contents(data) == page_contents(expected)
+
+
+def test_cancelled_job_frees_its_worker(make_pdf):
+    path = make_pdf('big', pages=2000)
+
+    async def cancel_then_run(executor):
+        started = asyncio.Event()
+        progress = []
+
+        def on_progress(report):
+            progress.append(report)
+            started.set()
+
+        # Takes far longer than the wait below if it is not aborted
+        job = asyncio.create_task(executor.run('merge_pdfs', [path] * 50, None, on_progress=on_progress))
+        await asyncio.wait_for(started.wait(), 10)
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+
+        # The single worker process must be free again
+        info = await asyncio.wait_for(executor.run('inspect_pdf', path), 5)
+        return progress, info
+
+    progress, info = run_with_executor(cancel_then_run, max_workers=1)
+    assert progress[0]['pages'] >= 1
+    assert info['pages'] == 2000
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('pymongo')
+pytest.importorskip('motor')
+
+from job_queue import FileJobQueue, new_job
+
+
+def make_queue(root):
+    queue = FileJobQueue(str(root))
+    asyncio.run(queue.connect())
+    return queue
+
+
+def enqueue(queue):
+    job = new_job('merge', 1, 1, 1, ['file'])
+    asyncio.run(queue.enqueue(job))
+    return job
+
+
+def test_only_one_worker_takes_over_an_expired_lease(tmp_path):
+    async def race(queue):
+        # A worker died holding the job; its lease has expired
+        await queue.claim('dead', lease=-1)
+        return await asyncio.gather(*(queue.claim(f"worker{i}") for i in range(8)))
+
+    for attempt in range(20):
+        queue = make_queue(tmp_path / str(attempt))
+        enqueue(queue)
+        claimed = [job for job in asyncio.run(race(queue)) if job is not None]
+        assert len(claimed) == 1
+        assert claimed[0]['attempts'] == 2
+
+
+def test_previous_owner_loses_the_job_on_takeover(tmp_path):
+    queue = make_queue(tmp_path)
+    enqueue(queue)
+
+    async def scenario():
+        stale = await queue.claim('a', lease=-1)
+        current = await queue.claim('b')
+        assert current['attempts'] == 2
+
+        assert not await queue.renew(stale, 'a')
+        await queue.complete(stale, 'a')
+        await queue.retry(stale, 'a', 0, 'error')
+        assert await queue.renew(current, 'b')
+        assert await queue.claim('c') is None
+
+        await queue.complete(current, 'b')
+        assert await queue.claim('c') is None
+
+    asyncio.run(scenario())
+    assert list(tmp_path.iterdir()) == [tmp_path / 'failed']
+
+
+def test_retried_job_can_be_claimed_again(tmp_path):
+    queue = make_queue(tmp_path)
+    enqueue(queue)
+
+    async def scenario():
+        first = await queue.claim('a')
+        await queue.retry(first, 'a', 0, 'error')
+        second = await queue.claim('a')
+        assert second['attempts'] == 2
+        assert second['error'] == 'error'
+        # The same worker's earlier claim is over too
+        assert not await queue.renew(first, 'a')
+        assert await queue.renew(second, 'a')
+
+    asyncio.run(scenario())
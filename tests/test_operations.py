@@ -0,0 +1,150 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telegram')
+pytest.importorskip('motor')
+
+from job_executor import JobExecutorBusy
+from operations import OperationTracker
+from result_cache import ResultCache
+
+
+class FakeSessions:
+    """The operation records of SessionManager"""
+
+    def __init__(self, interrupted=()):
+        self.finished = {}
+        self.released = []
+        self.interrupted = list(interrupted)
+
+    async def begin_operation(self, job, owner):
+        return None
+
+    async def renew_operation(self, key, owner):
+        return False  # Taken over by another process
+
+    async def claim_interrupted_operation(self, owner):
+        return self.interrupted.pop() if self.interrupted else None
+
+    async def release_operation(self, key, owner):
+        self.released.append(key)
+
+    async def get_session(self, user_id):
+        return {}
+
+    async def finish_operation(self, key, owner, status, files):
+        self.finished[key] = (status, files)
+
+
+def document(file_id):
+    return SimpleNamespace(document=SimpleNamespace(file_id=file_id), photo=None)
+
+
+def test_finished_operation_is_cached():
+    sessions, results = FakeSessions(), ResultCache()
+    tracker = OperationTracker(sessions, results)
+
+    async def scenario():
+        await tracker.begin({'_id': 'op', 'cache_key': 'key'})
+        await tracker.finish('op', [document('result')])
+        return await results.get('key')
+
+    assert asyncio.run(scenario()) == [{'type': 'document', 'file_id': 'result'}]
+    assert sessions.finished['op'][0] == 'done'
+
+
+def test_cache_hit_is_not_cached_again():
+    sessions, results = FakeSessions(), ResultCache()
+    tracker = OperationTracker(sessions, results)
+    files = [{'type': 'document', 'file_id': 'result'}]
+
+    async def scenario():
+        await results.put('key', files)
+        stored_at = results._entries['key'][0]
+        # A second request answered from the cache
+        await tracker.begin({'_id': 'op', 'cache_key': 'key'})
+        await tracker.finish('op', [document('resent')], cached=True)
+        return stored_at
+
+    stored_at = asyncio.run(scenario())
+    # Neither refreshed nor replaced by the resent copy
+    assert results._entries['key'] == (stored_at, files)
+    assert sessions.finished['op'] == ('done', [{'type': 'document', 'file_id': 'resent'}])
+
+
+class Runner:
+    """QueueWorker whose process runs the given coroutine function"""
+
+    def __init__(self, process):
+        self.process = process
+        self.notified = []
+
+    async def notify(self, record, text):
+        self.notified.append(text)
+
+
+def interrupted(key='op'):
+    return {'_id': key, 'operation': 'merge', 'user_id': 1, 'resumes': 1}
+
+
+def test_lost_lease_cancels_the_operation():
+    tracker = OperationTracker(FakeSessions(), ResultCache())
+
+    async def handler():
+        await tracker.begin({'_id': 'op'})
+        await asyncio.sleep(10)
+
+    async def scenario():
+        renew = asyncio.create_task(tracker.renew_loop(interval=0.01))
+        task = asyncio.create_task(handler())
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(task, 5)
+        renew.cancel()
+
+    asyncio.run(scenario())
+    assert tracker._running == {}
+
+
+def test_busy_resume_is_released_without_counting():
+    sessions = FakeSessions([interrupted()])
+    tracker = OperationTracker(sessions, ResultCache())
+
+    async def process(record):
+        raise JobExecutorBusy("busy")
+
+    async def scenario():
+        loop = asyncio.create_task(tracker.resume_loop(Runner(process), interval=0))
+        while not sessions.released:
+            await asyncio.sleep(0.01)
+        loop.cancel()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert sessions.released == ['op']
+    assert tracker._running == {}
+
+
+def test_stopping_the_resume_loop_cancels_resumed_operations():
+    tracker = OperationTracker(FakeSessions([interrupted()]), ResultCache())
+    cancelled = []
+
+    async def process(record):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(record['_id'])
+            raise
+
+    async def scenario():
+        loop = asyncio.create_task(tracker.resume_loop(Runner(process), interval=0))
+        while not tracker._resumed:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        loop.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await loop
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert cancelled == ['op']
+    assert tracker._resumed == set()
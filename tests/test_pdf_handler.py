@@ -0,0 +1,196 @@
+import os
+from collections import OrderedDict
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+
+import pdf_handler
+from pdf_handler import PDFHandler, PDFMemoryLimitError, PageRangeError, parse_split_spec
+
+
+def reference_merge(paths):
+    """Merge like the original implementation, keeping every reader alive"""
+    readers = [PdfReader(path) for path in paths]
+    writer = PdfWriter()
+    for reader in readers:
+        for page in reader.pages:
+            writer.add_page(page)
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def page_contents(data):
+    return [
+        (page.get_contents().get_data(), page.extract_text().strip())
+        for page in PdfReader(BytesIO(data)).pages
+    ]
+
+
+def test_merge_matches_reference_merge(make_pdf):
+    paths = [make_pdf(f"doc{i}") for i in range(8)]
+    expected = page_contents(reference_merge(paths))
+
+    # Readers are released between inputs, so a later reader can reuse an
+    # earlier one's id(); repeat to catch a stale clone map
+    for _ in range(20):
+        assert page_contents(PDFHandler().merge_pdfs(paths, None)) == expected
+
+
+def test_merge_page_ranges_repeat_an_input(make_pdf):
+    first, second = make_pdf('a', pages=3), make_pdf('b', pages=2)
+
+    data = PDFHandler().merge_pdfs(
+        [first, second, first], None, page_ranges=[[(3, None)], None, [(1, 1)]]
+    )
+
+    texts = [text for _, text in page_contents(data)]
+    assert texts == ['a page 3', 'b page 1', 'b page 2', 'a page 1']
+
+
+def test_merge_rejects_range_past_the_end(make_pdf):
+    with pytest.raises(PageRangeError):
+        PDFHandler().merge_pdfs([make_pdf('a')], None, page_ranges=[[(5, None)]])
+
+
+def test_oversized_merge_is_rejected_before_parsing(make_pdf, monkeypatch):
+    paths = [make_pdf(f"doc{i}") for i in range(3)]
+    limit = sum(os.path.getsize(path) for path in paths) - 1
+    opened = []
+    monkeypatch.setattr(pdf_handler, '_MappedPDF', lambda pdf_file: opened.append(pdf_file))
+
+    with pytest.raises(PDFMemoryLimitError):
+        PDFHandler().merge_pdfs(paths, None, memory_limit=limit)
+    assert opened == []
+
+
+def test_default_merge_limit_admits_ten_full_size_uploads():
+    assert pdf_handler.MERGE_MEMORY_LIMIT >= 10 * 20 * 1024 * 1024
+
+
+def part_texts(parts):
+    return [[text for _, text in page_contents(part)] for part in parts]
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('every 5', {'every': 5}),
+    ('Every5', {'every': 5}),
+    ('10MB', {'max_bytes': 10 * 1024 * 1024}),
+    ('512 kb', {'max_bytes': 512 * 1024}),
+    ('5', {'page_ranges': [[(5, 5)]]}),
+    ('2,5,7', {'page_ranges': [[(2, 2), (5, 5), (7, 7)]]}),
+    ('1-3; 4-10; 11-', {'page_ranges': [[(1, 3)], [(4, 10)], [(11, None)]]}),
+])
+def test_split_spec_is_parsed(spec, expected):
+    assert parse_split_spec(spec) == expected
+
+
+@pytest.mark.parametrize('spec', ['every', 'every 0', 'every five', '0MB', 'abc', ';'])
+def test_malformed_split_spec_is_rejected(spec):
+    with pytest.raises(PageRangeError):
+        parse_split_spec(spec)
+
+
+def test_split_by_range_groups(make_pdf):
+    parts = PDFHandler().split_pdf(
+        make_pdf('a', pages=5), None, page_ranges=[[(1, 2)], [(4, None)], [(3, 3), (1, 1)]]
+    )
+
+    assert part_texts(parts) == [
+        ['a page 1', 'a page 2'], ['a page 4', 'a page 5'], ['a page 3', 'a page 1']
+    ]
+
+
+def test_split_every_n_pages(make_pdf, tmp_path):
+    parts = PDFHandler().split_pdf(make_pdf('a', pages=5), str(tmp_path), every=2)
+
+    assert [os.path.basename(part) for part in parts] == ['part_01.pdf', 'part_02.pdf', 'part_03.pdf']
+    datas = [open(part, 'rb').read() for part in parts]
+    assert part_texts(datas) == [['a page 1', 'a page 2'], ['a page 3', 'a page 4'], ['a page 5']]
+
+
+def test_split_keeps_parts_within_the_size_budget(make_pdf):
+    path = make_pdf('a', pages=12)
+    page_size = len(PDFHandler().split_pdf(path, None, page_ranges=[[(1, 1)]])[0])
+    max_bytes = page_size * 3
+
+    parts = PDFHandler().split_pdf(path, None, max_bytes=max_bytes)
+
+    assert len(parts) > 1
+    assert all(len(part) <= max_bytes for part in parts)
+    texts = [text for texts in part_texts(parts) for text in texts]
+    assert texts == [f"a page {n}" for n in range(1, 13)]
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'every': 1},
+    {'page_ranges': [[(n, n)] for n in range(1, 5)]},
+    {'max_bytes': 1},
+])
+def test_split_over_the_parts_cap_writes_nothing(make_pdf, tmp_path, monkeypatch, kwargs):
+    monkeypatch.setattr(pdf_handler, 'SPLIT_MAX_PARTS', 3)
+    path = make_pdf('a', pages=4)
+    output_dir = tmp_path / 'parts'
+    output_dir.mkdir()
+    progress = []
+    handler = PDFHandler()
+    handler.progress = lambda **report: progress.append(report)
+
+    with pytest.raises(PageRangeError):
+        handler.split_pdf(path, str(output_dir), **kwargs)
+    assert list(output_dir.iterdir()) == []
+    if 'max_bytes' not in kwargs:
+        # Refused before any page was copied
+        assert progress == []
+
+
+@pytest.fixture
+def overlays_created(monkeypatch):
+    """Count the watermark overlays built, starting with an empty cache"""
+    monkeypatch.setattr(pdf_handler, '_overlay_cache', OrderedDict())
+    created = []
+    create = PDFHandler._create_watermark
+
+    def counting_create(self, *args, **kwargs):
+        created.append(args[3:5])  # Page width and height
+        return create(self, *args, **kwargs)
+
+    monkeypatch.setattr(PDFHandler, '_create_watermark', counting_create)
+    return created
+
+
+def test_watermark_overlay_is_built_once_per_page_size(make_pdf, tmp_path, overlays_created):
+    PDFHandler().add_watermark(make_pdf('a', pages=10), None, 'DRAFT')
+    assert len(overlays_created) == 1
+
+    # Cached across documents
+    PDFHandler().add_watermark(make_pdf('b', pages=3), None, 'DRAFT')
+    assert len(overlays_created) == 1
+
+    mixed = tmp_path / 'mixed.pdf'
+    c = canvas.Canvas(str(mixed))
+    for size in [(300, 400), (500, 400), (300, 400)]:
+        c.setPageSize(size)
+        c.drawString(20, 20, 'page')
+        c.showPage()
+    c.save()
+    PDFHandler().add_watermark(str(mixed), None, 'DRAFT')
+    assert overlays_created[1:] == [(300.0, 400.0), (500.0, 400.0)]
+
+
+def test_stamp_mode_shares_one_xobject(make_pdf):
+    path = make_pdf('doc', pages=100)
+    merged = PDFHandler().add_watermark(path, None, 'CONFIDENTIAL', 'diagonal', mode='merge')
+    stamped = PDFHandler().add_watermark(path, None, 'CONFIDENTIAL', 'diagonal', mode='stamp')
+
+    forms = set()
+    pages = PdfReader(BytesIO(stamped)).pages
+    for number, page in enumerate(pages, 1):
+        assert f"doc page {number}" in page.extract_text()
+        xobjects = page['/Resources']['/XObject']
+        forms.update(xobjects.raw_get(name).idnum for name in xobjects)
+    assert len(pages) == 100
+    assert len(forms) == 1
+    assert len(stamped) < len(merged) * 0.8
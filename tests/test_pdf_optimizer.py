@@ -0,0 +1,75 @@
+import shutil
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+
+from pdf_handler import PDFHandler
+from pdf_optimizer import optimize_writer
+
+
+def page_texts(data):
+    return [page.extract_text().strip() for page in PdfReader(BytesIO(data)).pages]
+
+
+def merged_copies(make_pdf, tmp_path, level):
+    """Merge three identical files, each with its own copy of the font"""
+    path = make_pdf('doc', pages=3)
+    paths = [path]
+    for i in range(2):
+        paths.append(str(tmp_path / f"copy{i}.pdf"))
+        shutil.copyfile(path, paths[-1])
+    return PDFHandler(optimize=level).merge_pdfs(paths, None)
+
+
+@pytest.mark.parametrize('level', ['fast', 'full'])
+def test_optimized_merge_reads_like_the_original(make_pdf, level):
+    paths = [make_pdf(f"doc{i}") for i in range(4)]
+    expected = page_texts(PDFHandler(optimize='off').merge_pdfs(paths, None))
+
+    assert page_texts(PDFHandler(optimize=level).merge_pdfs(paths, None)) == expected
+
+
+@pytest.mark.parametrize('level', ['fast', 'full'])
+@pytest.mark.parametrize('mode', ['merge', 'stamp'])
+def test_optimized_watermark_reads_like_the_original(make_pdf, level, mode):
+    path = make_pdf('doc', pages=5)
+    expected = page_texts(PDFHandler(optimize='off').add_watermark(path, None, 'DRAFT', mode=mode))
+
+    data = PDFHandler(optimize=level).add_watermark(path, None, 'DRAFT', mode=mode)
+    assert page_texts(data) == expected
+
+
+def test_full_optimization_merges_duplicate_objects(make_pdf, tmp_path):
+    fast = merged_copies(make_pdf, tmp_path, 'fast')
+    full = merged_copies(make_pdf, tmp_path, 'full')
+
+    assert page_texts(full) == page_texts(fast)
+    assert len(full) < len(fast)
+    fonts = {
+        page['/Resources']['/Font']['/F1'].indirect_reference.idnum
+        for page in PdfReader(BytesIO(full)).pages
+    }
+    assert len(fonts) == 1
+
+
+def test_encrypted_writer_is_left_alone(make_pdf):
+    writer = PdfWriter()
+    for page in PdfReader(make_pdf('doc')).pages:
+        writer.add_page(page)
+    writer.encrypt('secret')
+    objects = list(writer._objects)
+
+    optimize_writer(writer, 'full')
+
+    assert writer._objects == objects
+    buffer = BytesIO()
+    writer.write(buffer)
+    reader = PdfReader(BytesIO(buffer.getvalue()))
+    reader.decrypt('secret')
+    assert [page.extract_text().strip() for page in reader.pages] == ['doc page 1', 'doc page 2']
+
+
+def test_unknown_level_is_rejected():
+    with pytest.raises(ValueError):
+        optimize_writer(PdfWriter(), 'fastest')
@@ -0,0 +1,184 @@
+import asyncio
+
+import pytest
+
+from scheduler import JobScheduler, RateLimited, TokenBucket
+
+
+class FakeExecutor:
+    """JobExecutor whose jobs run until the test finishes them"""
+
+    def __init__(self):
+        self.started = []
+        self.running = []
+
+    async def run(self, method, *args, **kwargs):
+        self.started.append(method)
+        done = asyncio.get_running_loop().create_future()
+        self.running.append(done)
+        await done
+        return method
+
+    def finish_one(self):
+        self.running.pop(0).set_result(None)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def make_scheduler(executor, **kwargs):
+    options = dict(max_concurrent=1, burst=100, jobs_per_minute=6000, max_queued_per_user=5)
+    options.update(kwargs)
+    return JobScheduler(executor, **options)
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(capacity=2, rate=1 / 60)
+    assert bucket.consume() == 0
+    assert bucket.consume() == 0
+    assert bucket.consume() == pytest.approx(60, abs=1)
+
+    # Half a minute later half a token has come back
+    bucket.updated -= 30
+    assert bucket.consume() == pytest.approx(30, abs=1)
+    bucket.updated -= 30
+    assert bucket.consume() == 0
+
+
+def test_rate_limit_and_queue_length_are_enforced():
+    scheduler = make_scheduler(FakeExecutor(), burst=1, jobs_per_minute=1)
+    scheduler.admit(1)
+    with pytest.raises(RateLimited):
+        scheduler.admit(1)
+    # Other users have their own bucket
+    scheduler.admit(2)
+
+
+def test_users_are_served_round_robin_and_see_their_positions():
+    executor = FakeExecutor()
+    scheduler = make_scheduler(executor)
+    positions = {}
+
+    async def scenario():
+        tasks = []
+        for user_id, name in [(1, 'a1'), (1, 'a2'), (1, 'a3'), (2, 'b1'), (2, 'b2'), (3, 'c1')]:
+            async def on_position(position, name=name):
+                positions.setdefault(name, []).append(position)
+
+            tasks.append(asyncio.create_task(scheduler.run(user_id, name, on_position=on_position)))
+            await settle()
+
+        assert executor.started == ['a1']
+        assert {name: shown[-1] for name, shown in positions.items()} == {
+            'a2': 1, 'b1': 2, 'c1': 3, 'a3': 4, 'b2': 5,
+        }
+
+        while len(executor.started) < len(tasks):
+            executor.finish_one()
+            await settle()
+        executor.finish_one()
+        return await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert executor.started == ['a1', 'a2', 'b1', 'c1', 'a3', 'b2']
+    # Waiting jobs count down and see 0 when they start
+    assert positions['b2'] == [4, 5, 4, 3, 2, 1, 0]
+    assert 'a1' not in positions
+
+
+def test_cancelled_waiting_job_leaves_the_queue():
+    executor = FakeExecutor()
+    scheduler = make_scheduler(executor)
+    positions = []
+
+    async def on_position(position):
+        positions.append(position)
+
+    async def scenario():
+        first = asyncio.create_task(scheduler.run(1, 'first'))
+        waiting = asyncio.create_task(scheduler.run(1, 'waiting'))
+        last = asyncio.create_task(scheduler.run(2, 'last', on_position=on_position))
+        await settle()
+        assert positions == [2]
+
+        waiting.cancel()
+        await settle()
+        assert scheduler.queues == {2: scheduler.queues[2]}
+        assert positions == [2, 1]
+
+        executor.finish_one()
+        await settle()
+        assert executor.started == ['first', 'last']
+        executor.finish_one()
+        await asyncio.gather(first, last)
+
+    asyncio.run(scenario())
+    assert scheduler.running == 0
+
+
+def test_job_cancelled_before_its_task_wakes_is_skipped():
+    executor = FakeExecutor()
+    scheduler = make_scheduler(executor)
+
+    async def scenario():
+        first = asyncio.create_task(scheduler.run(1, 'first'))
+        second = asyncio.create_task(scheduler.run(2, 'second'))
+        third = asyncio.create_task(scheduler.run(3, 'third'))
+        await settle()
+        # The slot frees up before the cancelled task could leave the queue
+        executor.finish_one()
+        second.cancel()
+        await settle()
+        assert executor.started == ['first', 'third']
+        executor.finish_one()
+        await asyncio.gather(first, third)
+        assert second.cancelled()
+
+    asyncio.run(scenario())
+    assert scheduler.running == 0
+
+
+def test_job_cancelled_as_it_is_admitted_gives_its_slot_back():
+    executor = FakeExecutor()
+    scheduler = make_scheduler(executor)
+    dispatch = scheduler._dispatch
+
+    async def scenario():
+        first = asyncio.create_task(scheduler.run(1, 'first'))
+        second = asyncio.create_task(scheduler.run(2, 'second'))
+        third = asyncio.create_task(scheduler.run(3, 'third'))
+        await settle()
+
+        def dispatch_then_cancel():
+            # The second job is admitted, then cancelled before it wakes up
+            dispatch()
+            if not second.done():
+                second.cancel()
+
+        scheduler._dispatch = dispatch_then_cancel
+        executor.finish_one()
+        await settle()
+        scheduler._dispatch = dispatch
+        assert executor.started == ['first', 'third']
+        executor.finish_one()
+        await asyncio.gather(first, third)
+        assert second.cancelled()
+
+    asyncio.run(scenario())
+    assert scheduler.running == 0
+
+
+def test_idle_users_buckets_are_pruned():
+    scheduler = make_scheduler(FakeExecutor(), burst=3, jobs_per_minute=60)
+    for user_id in range(1000):
+        scheduler.admit(user_id)
+    assert len(scheduler.buckets) == 1000
+
+    # Every bucket has refilled and a sweep is due
+    for bucket in scheduler.buckets.values():
+        bucket.updated -= 10
+    scheduler._pruned_at -= 3600
+    scheduler.admit(1000)
+    assert list(scheduler.buckets) == [1000]
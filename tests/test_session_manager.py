@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('pymongo')
+pytest.importorskip('motor')
+
+from session_manager import AsyncSessionManager, SessionManager
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeSessions:
+    """Sessions collection left after MongoDB's TTL index dropped expired sessions"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    def find(self, query, projection):
+        wanted = set(query['pdf_files']['$in'])
+        return FakeCursor([
+            {'pdf_files': session['pdf_files']} for session in self.sessions
+            if wanted & set(session['pdf_files'])
+        ])
+
+
+def test_files_of_expired_mongodb_sessions_are_released():
+    removed = []
+    listed = []
+
+    async def list_files(min_age):
+        listed.append(min_age)
+        return ['memory://1/a', 'memory://2/b', 'temp/work/3/uploads/c.pdf']
+
+    manager = AsyncSessionManager(file_remover=removed.append, file_lister=list_files)
+    manager.use_mongodb = True
+    manager.sessions_collection = FakeSessions([{'user_id': 1, 'pdf_files': ['memory://1/a']}])
+
+    asyncio.run(manager.cleanup_expired_sessions())
+    assert removed == ['memory://2/b', 'temp/work/3/uploads/c.pdf']
+    assert listed and listed[0] > 0
+
+
+def test_async_manager_is_not_a_sync_manager(monkeypatch):
+    monkeypatch.delenv('MONGODB_URI', raising=False)
+    removed = []
+    manager = AsyncSessionManager(file_remover=removed.append)
+    assert not isinstance(manager, SessionManager)
+
+    async def scenario():
+        await manager.connect()
+        await manager.set_state(1, 'MERGE_UPLOAD')
+        session = await manager.unit_of_work(1)
+        session.add_pdf('a.pdf')
+        session.add_pdf('b.pdf')
+        await session.flush()
+        await manager.remove_pdf(1, 'a.pdf')
+        assert await manager.get_session(1) == {'state': 'MERGE_UPLOAD', 'pdf_files': ['b.pdf']}
+        await manager.clear_session(1)
+        return await manager.get_session(1)
+
+    assert asyncio.run(scenario()) == {}
+    assert removed == ['b.pdf']
+
+
+def test_sync_manager_keeps_sessions_in_memory(monkeypatch):
+    monkeypatch.delenv('MONGODB_URI', raising=False)
+    removed = []
+    manager = SessionManager(file_remover=removed.append)
+    manager.set_state(1, 'MERGE_UPLOAD')
+    manager.add_pdf(1, 'a.pdf')
+    assert manager.get_state(1) == 'MERGE_UPLOAD'
+    manager.clear_session(1)
+    assert manager.get_session(1) == {}
+    assert removed == ['a.pdf']
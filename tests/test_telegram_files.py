@@ -0,0 +1,58 @@
+import asyncio
+import os
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telegram')
+
+import telegram_files
+from telegram_files import download_file
+
+
+class LocalServerBot:
+    """Bot talking to a local Bot API server that keeps files in server_dir"""
+
+    def __init__(self, server_dir):
+        self.server_dir = server_dir
+
+    async def get_file(self, file_id, read_timeout=None):
+        async def download(*args, **kwargs):
+            raise AssertionError("A local server's file was fetched over HTTP")
+
+        return SimpleNamespace(
+            file_path=str(self.server_dir / file_id),
+            download_to_drive=download, download_to_memory=download,
+        )
+
+
+@pytest.fixture
+def local_server(monkeypatch, tmp_path):
+    monkeypatch.setattr(telegram_files, 'TELEGRAM_LOCAL_MODE', True)
+
+    def copyfile(*args):
+        raise AssertionError("The file was copied")
+
+    monkeypatch.setattr(shutil, 'copyfile', copyfile)
+    server_dir = tmp_path / 'server'
+    server_dir.mkdir()
+    (server_dir / 'file').write_bytes(b'%PDF-1.4 content')
+    return LocalServerBot(server_dir)
+
+
+def test_local_file_is_used_in_place(local_server, tmp_path):
+    dest = tmp_path / 'input0'
+    path = asyncio.run(download_file(local_server, 'file', str(dest), in_place=True))
+    assert path == str(local_server.server_dir / 'file')
+    assert not dest.exists()
+
+
+def test_private_copy_shares_the_data_and_leaves_the_server_file(local_server, tmp_path):
+    dest = tmp_path / 'upload.pdf'
+    path = asyncio.run(download_file(local_server, 'file', str(dest)))
+    assert path == str(dest)
+    assert os.path.samefile(dest, local_server.server_dir / 'file')
+
+    os.remove(dest)
+    assert (local_server.server_dir / 'file').read_bytes() == b'%PDF-1.4 content'
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram import Update
+
+from progress import CANCEL_JOB
+from update_ingest import PerUserUpdateProcessor, WebhookIngestor
+
+
+def message_payload(update_id, user_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+            'text': 'hi',
+        },
+    }
+
+
+def message_update(update_id, user_id):
+    return Update.de_json(message_payload(update_id, user_id), None)
+
+
+class FakeApplication:
+    """The parts of Application that WebhookIngestor uses"""
+
+    bot = None
+
+    def __init__(self, update_processor):
+        self.update_processor = update_processor
+        self.release = asyncio.Event()
+        self.handled = []
+
+    async def process_update(self, update):
+        if update.effective_user.id == 1:
+            await self.release.wait()  # User 1 runs a long job
+        self.handled.append(update.update_id)
+
+
+def test_user_updates_run_in_order_without_holding_slots():
+    async def main():
+        processor = PerUserUpdateProcessor(max_concurrent_updates=2)
+        release = asyncio.Event()
+        done = []
+
+        async def handle(name, wait=False):
+            if wait:
+                await release.wait()
+            done.append(name)
+
+        busy_user = [asyncio.create_task(processor.process_update(message_update(1, 1), handle(1, wait=True)))]
+        busy_user += [
+            asyncio.create_task(processor.process_update(message_update(i, 1), handle(i)))
+            for i in range(2, 6)
+        ]
+        await asyncio.sleep(0)
+
+        # More queued updates than slots must not stall another user
+        await asyncio.wait_for(processor.process_update(message_update(10, 2), handle(10)), 1)
+        assert done == [10]
+
+        release.set()
+        await asyncio.gather(*busy_user)
+        assert done == [10, 1, 2, 3, 4, 5]
+
+    asyncio.run(main())
+
+
+def test_ingestor_sheds_when_full_and_keeps_order():
+    async def main():
+        application = FakeApplication(PerUserUpdateProcessor(max_concurrent_updates=2))
+        ingestor = WebhookIngestor(application, queue_size=4)
+
+        assert all(ingestor.submit(message_payload(i, 1)) for i in range(1, 4))
+        assert ingestor.submit(message_payload(10, 2))
+        await asyncio.wait_for(_until(lambda: 10 in application.handled), 1)
+
+        # Three updates of user 1 are still pending; one more fits
+        assert ingestor.submit(message_payload(4, 1))
+        assert not ingestor.submit(message_payload(5, 1))
+
+        application.release.set()
+        await asyncio.wait_for(_until(lambda: len(application.handled) == 5), 1)
+        assert application.handled == [10, 1, 2, 3, 4]
+        assert ingestor.submit(message_payload(6, 1))
+        await ingestor.stop()
+
+    asyncio.run(main())
+
+
+async def _until(condition):
+    while not condition():
+        await asyncio.sleep(0.01)
+
+
+def cancel_payload(update_id, user_id):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': '1',
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+            'data': CANCEL_JOB,
+        },
+    }
+
+
+def test_cancel_skips_the_user_lock_and_slots():
+    async def main():
+        processor = PerUserUpdateProcessor(max_concurrent_updates=1)
+        release = asyncio.Event()
+        done = []
+
+        async def handle(name, wait=False):
+            if wait:
+                await release.wait()
+            done.append(name)
+
+        job = asyncio.create_task(processor.process_update(message_update(1, 1), handle('job', wait=True)))
+        queued = asyncio.create_task(processor.process_update(message_update(2, 1), handle('queued')))
+        await asyncio.sleep(0)
+
+        # The job holds the user's lock and the only slot
+        cancel = Update.de_json(cancel_payload(3, 1), None)
+        await asyncio.wait_for(processor.process_update(cancel, handle('cancel')), 1)
+        assert done == ['cancel']
+
+        release.set()
+        await asyncio.gather(job, queued)
+        assert done == ['cancel', 'job', 'queued']
+
+    asyncio.run(main())
+
+
+def test_ingestor_accepts_cancel_when_full():
+    async def main():
+        application = FakeApplication(PerUserUpdateProcessor(max_concurrent_updates=2))
+        ingestor = WebhookIngestor(application, queue_size=1)
+
+        assert ingestor.submit(message_payload(1, 1))
+        assert not ingestor.submit(message_payload(2, 1))
+        assert ingestor.submit(cancel_payload(3, 1))
+        await ingestor.stop()
+
+    asyncio.run(main())
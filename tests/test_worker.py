@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('telegram')
+pytest.importorskip('motor')
+
+import worker
+from worker import LeaseLost, QueueWorker
+
+
+class LostLeaseQueue:
+    """Job queue whose jobs have been taken over by another worker"""
+
+    def __init__(self):
+        self.finished = []
+
+    async def renew(self, job, worker_id):
+        return False
+
+    async def complete(self, job, worker_id):
+        self.finished.append('complete')
+
+    async def retry(self, job, worker_id, delay, error):
+        self.finished.append('retry')
+
+    async def fail(self, job, worker_id, error):
+        self.finished.append('fail')
+
+
+def job(operation='rename', **params):
+    return {
+        '_id': 'job', 'operation': operation, 'user_id': 1, 'chat_id': 1, 'message_id': 1,
+        'files': ['file'], 'params': params, 'attempts': 1,
+    }
+
+
+def test_lost_lease_cancels_the_job(monkeypatch):
+    monkeypatch.setattr(worker, 'JOB_LEASE_SECONDS', 0.03)
+    queue = LostLeaseQueue()
+    runner = QueueWorker(None, queue, None, None)
+    started = []
+
+    async def process(job):
+        started.append(job['_id'])
+        await asyncio.sleep(10)
+
+    runner.process = process
+
+    async def scenario():
+        await asyncio.wait_for(runner._handle(job()), 5)
+
+    asyncio.run(scenario())
+    assert started == ['job']
+    assert queue.finished == []
+
+
+def test_result_is_not_sent_without_the_lease(monkeypatch, tmp_path):
+    sent = []
+
+    async def send_file(*args):
+        sent.append(args)
+
+    monkeypatch.setattr(worker, 'send_file', send_file)
+    runner = QueueWorker(None, LostLeaseQueue(), None, None)
+    source = tmp_path / 'input0'
+    source.write_bytes(b'%PDF')
+
+    with pytest.raises(LeaseLost):
+        asyncio.run(runner._run(job(new_name='renamed'), [str(source)], None, None))
+    assert sent == []
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from workspace import WorkspaceManager, WorkspaceQuotaExceeded
+
+
+def test_quota_counts_files_and_reservations(tmp_path):
+    workspaces = WorkspaceManager(str(tmp_path), max_bytes=0, user_max_bytes=100)
+
+    async def scenario():
+        path = workspaces.upload_path(1, 'a.pdf')
+        async with workspaces.reserve(1, 60):
+            with open(path, 'wb') as f:
+                f.write(b'x' * 60)
+        async with workspaces.reserve(1, 40):
+            with pytest.raises(WorkspaceQuotaExceeded):
+                async with workspaces.reserve(1, 1):
+                    pass
+        # Other users have their own quota
+        async with workspaces.reserve(2, 100):
+            pass
+
+    asyncio.run(scenario())
+    assert workspaces.usage(1) == 60
+    assert workspaces.reserved == {}
+
+
+def test_concurrent_reservations_do_not_overbook(tmp_path):
+    workspaces = WorkspaceManager(str(tmp_path), max_bytes=100, user_max_bytes=0)
+    granted = []
+
+    async def reserve(user_id):
+        try:
+            async with workspaces.reserve(user_id, 30):
+                granted.append(user_id)
+                await asyncio.sleep(0.05)
+        except WorkspaceQuotaExceeded:
+            pass
+
+    async def scenario():
+        await asyncio.gather(*(reserve(user_id) for user_id in range(10)))
+
+    asyncio.run(scenario())
+    assert len(granted) == 3
+
+
+def test_uploads_are_listed_by_age(tmp_path):
+    workspaces = WorkspaceManager(str(tmp_path))
+    path = workspaces.upload_path(1, 'a.pdf')
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    workspaces.upload_path(2, 'b.pdf')
+
+    assert workspaces.uploads() == [path]
+    assert workspaces.uploads(min_age=60) == []
@@ -0,0 +1,151 @@
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+import metrics
+from progress import CANCEL_JOB
+
+logger = logging.getLogger(__name__)
+
+# Number of updates processed concurrently
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 16))
+# Maximum number of webhook updates accepted but not yet processed
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 256))
+# What to do when the queue is full: 'shed' drops the update and answers OK,
+# 'defer' answers 503 so Telegram delivers it again later
+WEBHOOK_OVERFLOW = os.getenv('WEBHOOK_OVERFLOW', 'shed')
+# Maximum size of a webhook request body
+WEBHOOK_MAX_BODY_BYTES = int(os.getenv('WEBHOOK_MAX_BODY_BYTES', 1024 * 1024))
+
+
+def _user_key(update):
+    """Key used to keep updates of the same user in order"""
+    if isinstance(update, Update) and update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+def _is_cancel(update):
+    """Return True for a press of the Cancel button of a running job"""
+    return (
+        isinstance(update, Update) and update.callback_query is not None
+        and update.callback_query.data == CANCEL_JOB
+    )
+
+
+def _is_cancel_payload(payload):
+    """Return True for the webhook payload of a Cancel button press"""
+    return (payload.get('callback_query') or {}).get('data') == CANCEL_JOB
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates concurrently while keeping each user's updates in order
+
+    An update first waits behind the earlier updates of its user on a
+    per-user lock, which asyncio grants in FIFO order, and only then takes
+    one of the max_concurrent_updates slots. Updates waiting for their user
+    hold no slot, so a user with a long job and many queued taps cannot
+    stall everybody else. Presses of the Cancel button of a running job skip
+    both the lock and the slots, so they reach the job they are meant to stop.
+    """
+
+    def __init__(self, max_concurrent_updates=UPDATE_WORKERS):
+        super().__init__(max_concurrent_updates)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = defaultdict(asyncio.Lock)
+        self._waiting = defaultdict(int)
+
+    async def process_update(self, update, coroutine):
+        # The base class takes a slot before do_process_update, which would
+        # let updates waiting for their user's lock hold slots
+        if _is_cancel(update):
+            await coroutine
+            return
+
+        key = _user_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        self._waiting[key] += 1
+        try:
+            async with self._locks[key]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class WebhookIngestor:
+    """
+    Bounded buffer between the webhook endpoint and update processing
+
+    The endpoint only parses JSON and hands the payload over, so Telegram gets
+    its answer immediately. Each accepted payload is deserialised and passed
+    to the application's update processor in its own task; the processor
+    keeps each user's updates in order and limits how many run at once. At
+    most queue_size updates are accepted but not yet finished, except for
+    Cancel presses, which are always accepted.
+    """
+
+    def __init__(self, application, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.application = application
+        self.queue_size = queue_size
+        self._tasks = set()
+
+    async def stop(self):
+        """Cancel the updates still being processed"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, payload):
+        """
+        Accept a raw webhook payload for processing
+
+        Args:
+            payload: Decoded JSON body of the webhook request
+
+        Returns:
+            True if accepted, False if too many updates are pending
+        """
+        if len(self._tasks) >= self.queue_size and not _is_cancel_payload(payload):
+            metrics.WEBHOOK_UPDATES_TOTAL.inc(result=WEBHOOK_OVERFLOW)
+            logger.warning(f"Webhook queue full, update {payload.get('update_id')} {WEBHOOK_OVERFLOW}")
+            return False
+
+        task = asyncio.create_task(self._process(payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        metrics.WEBHOOK_UPDATES_TOTAL.inc(result='accepted')
+        metrics.WEBHOOK_QUEUE_DEPTH.set(len(self._tasks))
+        return True
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        metrics.WEBHOOK_QUEUE_DEPTH.set(len(self._tasks))
+
+    async def _process(self, payload):
+        try:
+            update = Update.de_json(data=payload, bot=self.application.bot)
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+        except Exception as e:
+            logger.error(f"Error processing update {payload.get('update_id')}: {e}")
@@ -0,0 +1,279 @@
+import os
+import socket
+import asyncio
+import logging
+from functools import partial
+from telegram.ext import Application
+from pdf_handler import PDFMemoryLimitError, PageRangeError
+from converter import RenderingUnavailable
+from job_executor import JobExecutor, PDF_WORKERS
+from job_queue import create_job_queue, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS
+from telegram_files import configure_builder, download_file, send_file, send_parts, send_photos, sent_files
+from workspace import WorkspaceManager
+from result_cache import ResultCache
+from progress import JobStatus
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Jobs processed at once by this worker
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', PDF_WORKERS))
+# Seconds between polls of an empty queue
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+# Seconds before a failed job is retried, multiplied by the attempt number
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 10))
+
+# Errors that will not go away by trying again
+PERMANENT_ERRORS = (PDFMemoryLimitError, PageRangeError, RenderingUnavailable)
+
+# Text of the status message once a job is done
+DONE_TEXT = {
+    'merge': "✅ Merge completed! Use /start for more operations.",
+    'watermark': "✅ Watermark completed! Use /start for more operations.",
+    'rename': "✅ Rename completed! Use /start for more operations.",
+    'images': "✅ PDF created! Use /start for more operations.",
+    'preview': "✅ Preview sent! Use /start for more operations.",
+    'split': "✅ Split completed! Use /start for more operations.",
+}
+
+
+class LeaseLost(Exception):
+    """Raised when another worker took over a job"""
+
+
+class QueueWorker:
+    """
+    Claim jobs from the shared queue, run them and send the results
+
+    Each claimed job is leased; the lease is renewed while the job runs, so a
+    crashed worker's jobs are picked up by another worker once it expires.
+    A job whose lease is lost to another worker is cancelled, and its result
+    is only sent while the lease is still held. Failed jobs are retried with
+    a growing delay up to JOB_MAX_ATTEMPTS.
+    Progress is shown on the job's status message, and results are added to
+    the result cache, if one is given.
+    """
+
+    def __init__(self, bot, queue, executor, workspaces, concurrency=WORKER_CONCURRENCY,
+                 results=None):
+        self.bot = bot
+        self.queue = queue
+        self.executor = executor
+        self.workspaces = workspaces
+        self.results = results
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def run(self):
+        """Process jobs until cancelled"""
+        logger.info(f"Worker {self.worker_id} started with {self.concurrency} slots")
+        await asyncio.gather(*(self._slot() for _ in range(self.concurrency)))
+
+    async def _slot(self):
+        while True:
+            try:
+                job = await self.queue.claim(self.worker_id)
+            except Exception as e:
+                logger.error(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            await self._handle(job)
+
+    async def _keep_lease(self, job, work):
+        """Renew the lease of a running job; cancel the job once the lease is lost"""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                renewed = await self.queue.renew(job, self.worker_id)
+            except Exception as e:
+                logger.error(f"Error renewing the lease of job {job['_id']}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost the lease of job {job['_id']}; cancelling it")
+                work.cancel()
+                return
+
+    async def _confirm_lease(self, job):
+        """Make sure this worker still owns a queued job before sending its result"""
+        if self.queue is not None and not await self.queue.renew(job, self.worker_id):
+            raise LeaseLost(f"Job {job['_id']} was taken over by another worker")
+
+    async def _handle(self, job):
+        if job['attempts'] > JOB_MAX_ATTEMPTS:
+            # Claimed again after its workers kept dying
+            await self.queue.fail(job, self.worker_id, 'Too many attempts')
+            await self.notify(job, "❌ This operation could not be completed. Please try again.")
+            return
+
+        work = asyncio.create_task(self.process(job))
+        heartbeat = asyncio.create_task(self._keep_lease(job, work))
+        try:
+            messages = await work
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                # The worker is shutting down
+                raise
+            # The job belongs to another worker now, which reports the outcome
+            return
+        except LeaseLost as e:
+            logger.warning(str(e))
+            return
+        except Exception as e:
+            logger.error(f"Job {job['_id']} ({job['operation']}) attempt {job['attempts']} failed: {e}")
+            if isinstance(e, PERMANENT_ERRORS) or job['attempts'] >= JOB_MAX_ATTEMPTS:
+                await self.queue.fail(job, self.worker_id, str(e))
+                if isinstance(e, PageRangeError):
+                    text = f"⚠️ {e}. Please start again with a different page selection."
+                elif isinstance(e, RenderingUnavailable):
+                    text = "⚠️ Previews are not available on this server."
+                elif isinstance(e, PDFMemoryLimitError):
+                    text = ("⚠️ These files are too large to process together. "
+                            "Please try again with fewer or smaller files.")
+                else:
+                    text = "❌ An error occurred while processing your files. Please try again."
+                await self.notify(job, text)
+            else:
+                # Busy executors and full disks are worth waiting for
+                await self.queue.retry(job, self.worker_id, JOB_RETRY_DELAY * job['attempts'], str(e))
+        else:
+            await self.queue.complete(job, self.worker_id)
+            if self.results is not None:
+                await self.results.put(job.get('cache_key'), sent_files(messages))
+        finally:
+            heartbeat.cancel()
+            work.cancel()
+
+    async def process(self, job):
+        """
+        Download the inputs, run the operation and send the result
+
+        Args:
+            job: Job dictionary (see job_queue.new_job)
+
+        Returns:
+            List of sent Messages
+        """
+        operation = job['operation']
+        # Queued jobs cannot be cancelled from the chat; only progress is shown
+        status = JobStatus(
+            partial(self.bot.edit_message_text, chat_id=job['chat_id'], message_id=job['message_id']),
+            "⏳ Working on your files...", cancellable=False
+        )
+
+        async with self.workspaces.job(job['user_id']) as workspace:
+            inputs = []
+            for i, file_id in enumerate(job['files']):
+                # Inputs are only read, so a local server's files are used in place
+                inputs.append(await download_file(self.bot, file_id, workspace.path(f"input{i}"), in_place=True))
+
+            status.start()
+            try:
+                messages = await self._run(job, inputs, workspace, status)
+            finally:
+                await status.close()
+
+        await self.notify(job, DONE_TEXT[operation])
+        return messages
+
+    async def _run(self, job, inputs, workspace, status):
+        """Run the operation on downloaded inputs and send the result"""
+        operation = job['operation']
+        params = job['params']
+
+        if operation == 'merge':
+            output_path = workspace.path('merged.pdf')
+            await self.executor.run(
+                'merge_pdfs', inputs, output_path, page_ranges=params.get('page_ranges'),
+                on_progress=status.on_progress
+            )
+            filename = 'merged.pdf'
+            caption = f"✅ Successfully merged {len(inputs)} PDFs!"
+        elif operation == 'watermark':
+            output_path = workspace.path('watermarked.pdf')
+            await self.executor.run(
+                'add_watermark', inputs[0], output_path,
+                params['watermark_text'], params['position'], params['opacity'],
+                on_progress=status.on_progress
+            )
+            filename = 'watermarked.pdf'
+            caption = f"✅ Watermark added: '{params['watermark_text']}'"
+        elif operation == 'images':
+            output_path = workspace.path('images.pdf')
+            await self.executor.run('images_to_pdf', inputs, output_path, on_progress=status.on_progress)
+            filename = 'images.pdf'
+            caption = f"✅ Created a PDF from {len(inputs)} images!"
+        elif operation == 'preview':
+            thumbnails = await self.executor.run('render_thumbnails', inputs[0])
+            await self._confirm_lease(job)
+            return await send_photos(self.bot, job['chat_id'], thumbnails, "👁 Preview")
+        elif operation == 'split':
+            split = {key: params[key] for key in ('page_ranges', 'every', 'max_bytes') if key in params}
+            parts = await self.executor.run(
+                'split_pdf', inputs[0], workspace.dir, **split, on_progress=status.on_progress
+            )
+            await self._confirm_lease(job)
+            return await send_parts(
+                self.bot, job['chat_id'], parts, params['base_name'],
+                f"✅ Split into {len(parts)} files!", operation,
+                zip_path=workspace.path('parts.zip')
+            )
+        elif operation == 'rename':
+            output_path = inputs[0]
+            filename = f"{params['new_name']}.pdf"
+            caption = f"✅ File renamed to: {filename}"
+        else:
+            raise ValueError(f"Unknown operation: {operation}")
+
+        await self._confirm_lease(job)
+        message = await send_file(self.bot, job['chat_id'], output_path, filename, caption, operation)
+        return [message]
+
+    async def notify(self, job, text):
+        """Update the job's status message"""
+        try:
+            await self.bot.edit_message_text(text, chat_id=job['chat_id'], message_id=job['message_id'])
+        except Exception as e:
+            logger.debug(f"Status update for job {job['_id']} failed: {e}")
+
+
+async def main_async():
+    """Start a queue worker"""
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
+
+    queue = create_job_queue()
+    if queue is None:
+        raise ValueError("Set JOB_QUEUE to 'mongodb' or 'file' to run workers")
+    await queue.connect()
+
+    results = ResultCache()
+    await results.connect()
+
+    application = configure_builder(Application.builder().token(token)).build()
+    executor = JobExecutor()
+    async with application.bot:
+        try:
+            await QueueWorker(
+                application.bot, queue, executor, WorkspaceManager(), results=results
+            ).run()
+        finally:
+            executor.shutdown()
+
+
+def main():
+    """Entry point"""
+    try:
+        asyncio.run(main_async())
+    except KeyboardInterrupt:
+        logger.info("Worker stopped by user")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Directory holding uploads and per-job working directories
+WORKSPACE_DIR = os.getenv('WORKSPACE_DIR', 'temp/work')
+# Maximum disk usage of all workspaces in bytes (0 = no limit)
+WORKSPACE_MAX_BYTES = int(os.getenv('WORKSPACE_QUOTA_MB', 2048)) * 1024 * 1024
+# Maximum disk usage of one user's workspace in bytes (0 = no limit)
+WORKSPACE_USER_MAX_BYTES = int(os.getenv('WORKSPACE_USER_QUOTA_MB', 500)) * 1024 * 1024
+# Files untouched for this many seconds are considered orphaned
+# (keep it above SESSION_TTL so live sessions never lose their uploads)
+WORKSPACE_MAX_AGE = int(os.getenv('WORKSPACE_MAX_AGE', 2 * 3600))
+# Seconds between sweeps for orphaned files
+WORKSPACE_REAP_INTERVAL = int(os.getenv('WORKSPACE_REAP_INTERVAL', 600))
+
+
+class WorkspaceQuotaExceeded(Exception):
+    """Raised when a file would not fit in the disk quota"""
+
+
+def _dir_sizes(path, subdir):
+    """
+    Total size of the files below a directory and below one of its subdirectories
+
+    Both are measured in a single walk.
+
+    Returns:
+        Tuple of bytes below path and bytes below subdir
+    """
+    total = sub_total = 0
+    prefix = os.path.join(subdir, '')
+    for dirpath, _, filenames in os.walk(path):
+        inside = os.path.join(dirpath, '').startswith(prefix)
+        for name in filenames:
+            try:
+                size = os.lstat(os.path.join(dirpath, name)).st_size
+            except FileNotFoundError:
+                continue
+            total += size
+            if inside:
+                sub_total += size
+    return total, sub_total
+
+
+class Job:
+    """Private working directory of one operation"""
+
+    def __init__(self, path):
+        self.dir = path
+
+    def path(self, name):
+        """
+        Get the path of a file inside the job directory
+
+        Args:
+            name: File name
+
+        Returns:
+            Path inside the job directory
+        """
+        return os.path.join(self.dir, os.path.basename(name))
+
+
+class WorkspaceManager:
+    """
+    Collision-free file placement with disk quotas and orphan cleanup
+
+    Every upload gets a unique name below its user's directory and every
+    operation gets its own job directory that is removed when the job ends,
+    so concurrent uploads and jobs never overwrite each other. Space for
+    downloads and jobs is reserved up front and checked against a per-user
+    and a global quota. A reaper removes files left behind by crashes.
+    """
+
+    def __init__(self, root=WORKSPACE_DIR, max_bytes=WORKSPACE_MAX_BYTES,
+                 user_max_bytes=WORKSPACE_USER_MAX_BYTES, max_age=WORKSPACE_MAX_AGE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.user_max_bytes = user_max_bytes
+        self.max_age = max_age
+        self.reserved = {}  # user_id -> bytes reserved by running downloads and jobs
+
+        os.makedirs(self.root, exist_ok=True)
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.root, str(user_id))
+
+    def usage(self, user_id=None):
+        """
+        Get the disk usage of one user's workspace, or of all workspaces
+
+        Args:
+            user_id: Telegram user ID (None = all users)
+
+        Returns:
+            Bytes on disk plus bytes reserved
+        """
+        if user_id is None:
+            return _dir_sizes(self.root, self.root)[0] + sum(self.reserved.values())
+        return _dir_sizes(self.root, self._user_dir(user_id))[1] + self.reserved.get(user_id, 0)
+
+    @asynccontextmanager
+    async def reserve(self, user_id, size):
+        """
+        Reserve space for a file that is about to be written
+
+        The disk is measured in a worker thread, in one walk for both quotas.
+
+        Args:
+            user_id: Telegram user ID
+            size: Expected number of bytes
+
+        Raises:
+            WorkspaceQuotaExceeded: If the space is not available
+        """
+        if self.max_bytes or self.user_max_bytes:
+            total, user_total = await asyncio.to_thread(_dir_sizes, self.root, self._user_dir(user_id))
+            # No await between the check and the reservation, so concurrent
+            # reservations cannot both take the last free space
+            if self.user_max_bytes and user_total + self.reserved.get(user_id, 0) + size > self.user_max_bytes:
+                raise WorkspaceQuotaExceeded(f"User {user_id} is over the workspace quota")
+            if self.max_bytes and total + sum(self.reserved.values()) + size > self.max_bytes:
+                raise WorkspaceQuotaExceeded("Workspace disk quota reached")
+
+        self.reserved[user_id] = self.reserved.get(user_id, 0) + size
+        try:
+            yield
+        finally:
+            self.reserved[user_id] -= size
+            if not self.reserved[user_id]:
+                del self.reserved[user_id]
+
+    def upload_path(self, user_id, file_name):
+        """
+        Get a unique path for an uploaded file
+
+        Args:
+            user_id: Telegram user ID
+            file_name: Original file name
+
+        Returns:
+            New path inside the user's upload directory
+        """
+        upload_dir = os.path.join(self._user_dir(user_id), 'uploads')
+        os.makedirs(upload_dir, exist_ok=True)
+        return os.path.join(upload_dir, f"{uuid.uuid4().hex[:12]}_{os.path.basename(file_name)}")
+
+    def uploads(self, min_age=0):
+        """
+        List the uploaded files of all users
+
+        Args:
+            min_age: Only list files stored at least this many seconds ago
+
+        Returns:
+            List of upload paths
+        """
+        cutoff = time.time() - min_age
+        paths = []
+        for user_dir in os.scandir(self.root):
+            try:
+                entries = os.scandir(os.path.join(user_dir.path, 'uploads'))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    # Links into the blob store keep the blob's mtime (see reap)
+                    if max(stat.st_mtime, stat.st_ctime) <= cutoff:
+                        paths.append(entry.path)
+        return paths
+
+    @asynccontextmanager
+    async def job(self, user_id, expected_size=0):
+        """
+        Create a working directory for one operation and remove it afterwards
+
+        Args:
+            user_id: Telegram user ID
+            expected_size: Bytes the job is expected to write
+
+        Yields:
+            Job for the new directory
+
+        Raises:
+            WorkspaceQuotaExceeded: If the expected output does not fit
+        """
+        async with self.reserve(user_id, expected_size):
+            path = os.path.join(self._user_dir(user_id), 'jobs', uuid.uuid4().hex)
+            os.makedirs(path)
+            try:
+                yield Job(path)
+            finally:
+                await asyncio.to_thread(shutil.rmtree, path, ignore_errors=True)
+
+    def reap(self):
+        """
+        Remove orphaned files and empty directories
+
+        Returns:
+            Number of files removed
+        """
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.lstat(path)
+                    # Hard links into the blob store share the blob's mtime;
+                    # ctime moves whenever a new link is made
+                    if max(stat.st_mtime, stat.st_ctime) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.error(f"Error removing orphaned file {path}: {e}")
+
+            if dirpath != self.root:
+                try:
+                    # Only succeeds for directories that are empty and old
+                    if os.stat(dirpath).st_mtime < cutoff:
+                        os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+        if removed:
+            logger.info(f"Removed {removed} orphaned workspace files")
+        return removed
+
+    async def reaper_loop(self, interval=WORKSPACE_REAP_INTERVAL):
+        """Sweep for orphaned files at startup and then every interval seconds"""
+        while True:
+            try:
+                await asyncio.to_thread(self.reap)
+            except Exception as e:
+                logger.error(f"Workspace reaper error: {e}")
+            await asyncio.sleep(interval)